@@ -0,0 +1,424 @@
+"""
+Streaming CSV / NDJSON exports for the admin reports
+
+The admin pages only load paginated JSON, so exports were built by paging
+through the API (or, on admin-withdrawals.html, from whatever rows happened
+to be loaded). These endpoints stream a whole report instead:
+
+    POST /api/admin/export/{name}/token                      (Authorization: Bearer <admin token>)
+    GET  /api/admin/export/{users|withdrawals|transactions|coupons|logs}
+        ?token=<export token>  &format=csv|ndjson  &gzip=1  &since=2026-01-01  &until=2026-02-01
+        &<filter>=<value>  &search=<text>
+
+Rows are read with a server-side cursor (stream_results + yield_per), so
+only CHUNK_ROWS rows are in memory at a time, encoded straight into ~64 KB
+response chunks and optionally gzip-compressed on the fly. The CSV header
+goes out as soon as the query starts, and a 5M-row export uses the same
+memory as a 5k-row one.
+
+Money columns are exported as naira: integer kobo columns are converted,
+FLOAT naira columns (before migrate_money_to_kobo.py) are written as they
+are. Password hashes are never exported. Every export is written to the audit
+log.
+
+Backend wiring:
+
+    from admin_export import create_router
+    from database import get_read_engine
+    app.include_router(create_router(get_read_engine(), admin_id_from_token), prefix="/api")
+
+`admin_id_from_token(token)` returns the admin's user id or raises
+HTTPException(401/403). The download is a plain link, so the browser streams
+it to disk, and its token is a query parameter - which ends up in access
+logs and browser history. So the link never carries the admin's bearer
+token: the page first POSTs for an export token (ExportTokens), an HMAC over
+the admin id, report name and expiry that is valid for EXPORT_TOKEN_TTL
+seconds and for a single download. Set $EXPORT_TOKEN_SECRET when the API
+runs several worker processes so a token issued by one is accepted by the
+others; the used-token list is per process, so there a token can be replayed
+at most once per worker within its short lifetime.
+
+Usage:
+    python admin_export.py transactions --format csv --gzip -o transactions.csv.gz
+    python admin_export.py withdrawals --status pending -o pending.ndjson --format ndjson
+    python admin_export.py transactions --benchmark      # memory: streaming vs fetch-all
+"""
+import argparse
+import base64
+import csv
+import hashlib
+import hmac
+import io
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+from datetime import date, datetime
+
+from sqlalchemy import text
+
+from audit_log import audit_writer, list_partitions
+from database import get_read_engine
+from db_backend import backend_for
+from money import KOBO_PER_NAIRA, money_scale, to_naira
+
+CHUNK_ROWS = 2000
+CHUNK_BYTES = 64 * 1024
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+EXPORT_TOKEN_TTL = 60
+TRUE_VALUES = ("1", "true", "yes", "active")
+LOG_COLUMNS = ("id", "action", "description", "performed_by", "target_user", "log_metadata", "created_at")
+
+
+class ExportSpec:
+    """One report: SELECT list and tables, filterable columns and money columns"""
+
+    def __init__(self, select, order, filters=(), enum_filters=(), bool_filters=(), search=(), money=(),
+                 created_at="created_at"):
+        self.select = select
+        self.order = order
+        # query parameter -> SQL column
+        self.filters = dict(filters)
+        self.enum_filters = dict(enum_filters)
+        self.bool_filters = dict(bool_filters)
+        # columns matched case-insensitively by ?search=
+        self.search = tuple(search)
+        # output column -> (table, column) it is read from
+        self.money = dict(money)
+        self.created_at = created_at
+
+
+EXPORTS = {
+    "users": ExportSpec(
+        """SELECT u.id, u.username, u.email, u.full_name, u.phone, u.referral_code, u.referred_by,
+                  u.coupon_code, u.role, u.is_active, u.is_verified, u.created_at,
+                  b.activity_balance, b.affiliate_balance, b.total_balance
+           FROM users u LEFT JOIN balances b ON b.user_id = u.id""",
+        "u.id", filters={"referred_by": "u.referred_by"}, enum_filters={"role": "u.role"},
+        bool_filters={"is_active": "u.is_active"}, search=("u.username", "u.email", "u.full_name"),
+        money={column: ("balances", column) for column in ("activity_balance", "affiliate_balance", "total_balance")},
+        created_at="u.created_at"),
+    "withdrawals": ExportSpec(
+        """SELECT w.id, w.user_id, u.username, w.amount, w.balance_type, w.status, w.admin_note,
+                  w.created_at, w.processed_at
+           FROM withdrawals w LEFT JOIN users u ON u.id = w.user_id""",
+        "w.id", filters={"user_id": "w.user_id"}, enum_filters={"status": "w.status", "balance_type": "w.balance_type"},
+        money={"amount": ("withdrawals", "amount")}, created_at="w.created_at"),
+    "transactions": ExportSpec(
+        """SELECT id, user_id, type, amount, balance_type, description, reference, created_at
+           FROM transactions""",
+        "id", filters={"user_id": "user_id", "reference": "reference"},
+        enum_filters={"type": "type", "balance_type": "balance_type"}, money={"amount": ("transactions", "amount")}),
+    "coupons": ExportSpec(
+        """SELECT * FROM coupons""",
+        "id", filters={"assigned_to": "assigned_to", "used_by": "used_by", "coupon_type": "coupon_type"},
+        enum_filters={"status": "status"}, money={"bonus_amount": ("coupons", "bonus_amount")}),
+    # Spread over system_logs plus the month partitions (audit_log.py); {table} is filled per table
+    "logs": ExportSpec(
+        f"SELECT {', '.join(LOG_COLUMNS)} FROM {{table}}",
+        "created_at, id", filters={"action": "action", "performed_by": "performed_by", "target_user": "target_user"}),
+}
+
+
+def build_query(name, filters=None):
+    """(sql, params) for an export; unknown filters raise ValueError, empty ones are ignored"""
+    spec = EXPORTS[name]
+    where, params = [], {}
+    for key, value in (filters or {}).items():
+        if value is None or value == "":
+            continue
+        if key in ("since", "until"):
+            where.append(f"{spec.created_at} {'>=' if key == 'since' else '<'} :{key}")
+        elif key == "search" and spec.search:
+            where.append("(" + " OR ".join(f"LOWER({column}) LIKE :search" for column in spec.search) + ")")
+            value = f"%{str(value).lower()}%"
+        elif key in spec.enum_filters:
+            where.append(f"{spec.enum_filters[key]} = :{key}")
+            value = str(value).upper()
+        elif key in spec.bool_filters:
+            where.append(f"{spec.bool_filters[key]} = :{key}")
+            value = str(value).lower() in TRUE_VALUES
+        elif key in spec.filters:
+            where.append(f"{spec.filters[key]} = :{key}")
+        else:
+            raise ValueError(f"Cannot filter {name} by {key}")
+        params[key] = value
+    sql = spec.select + (f" WHERE {' AND '.join(where)}" if where else "") + f" ORDER BY {spec.order}"
+    return sql, params
+
+
+def _source_tables(conn, name):
+    if name != "logs":
+        return [None]
+    legacy = backend_for(conn).has_table(conn, "system_logs")
+    return (["system_logs"] if legacy else []) + sorted(list_partitions(conn))
+
+
+def iter_rows(conn, name, filters=None):
+    """Yield the column names, then each row as a tuple, oldest first, CHUNK_ROWS at a time"""
+    sql, params = build_query(name, filters)
+    columns_sent = False
+    for table in _source_tables(conn, name):
+        result = conn.execution_options(stream_results=True, yield_per=CHUNK_ROWS).execute(
+            text(sql.format(table=table) if table else sql), params)
+        if not columns_sent:
+            yield list(result.keys())
+            columns_sent = True
+        for partition in result.partitions():
+            yield from partition
+    if not columns_sent:
+        yield list(LOG_COLUMNS)  # no log tables at all
+
+
+def money_scales(conn, name):
+    """{output column: money_scale()} for the money columns of an export"""
+    return {column: money_scale(conn, table, source) for column, (table, source) in EXPORTS[name].money.items()}
+
+
+def _export_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat(sep=" ") if isinstance(value, datetime) else value.isoformat()
+    return value
+
+
+def encode(name, rows, fmt, scales=None):
+    """Turn iter_rows() output into text chunks of about CHUNK_BYTES
+
+    `scales` is money_scales() of the export; money columns stored as kobo
+    are converted to naira (all of them when it is not given).
+    """
+    rows = iter(rows)
+    columns = next(rows)
+    scales = scales if scales is not None else dict.fromkeys(EXPORTS[name].money, KOBO_PER_NAIRA)
+    money = [i for i, column in enumerate(columns) if scales.get(column) == KOBO_PER_NAIRA]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if writer:
+        writer.writerow(columns)
+        yield buffer.getvalue()  # the header goes out before the first batch is read
+        buffer.seek(0)
+        buffer.truncate()
+
+    for row in rows:
+        values = [_export_value(v) for v in row]
+        for i in money:
+            values[i] = to_naira(values[i])
+        if writer:
+            writer.writerow(values)
+        else:
+            buffer.write(json.dumps(dict(zip(columns, values)), default=str, separators=(",", ":")) + "\n")
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def gzip_chunks(chunks):
+    """Compress text chunks into a gzip stream without buffering the whole output"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    first = True
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if first:
+            # Push the header out immediately instead of waiting for a full deflate block
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            first = False
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(engine, name, fmt="csv", gzip=False, filters=None):
+    """Generator of response bytes; owns its connection for the lifetime of the download"""
+    build_query(name, filters)  # reject bad filters before the response starts
+
+    def chunks():
+        with engine.connect() as conn:
+            for chunk in encode(name, iter_rows(conn, name, filters), fmt, money_scales(conn, name)):
+                yield chunk
+
+    if gzip:
+        return gzip_chunks(chunks())
+    return (chunk.encode("utf-8") for chunk in chunks())
+
+
+def export_filename(name, fmt, gzip=False):
+    return f"affluence-{name}-{datetime.utcnow():%Y-%m-%d}.{fmt}" + (".gz" if gzip else "")
+
+
+class ExportTokens:
+    """Short-lived, single-use download tokens for one admin and one report"""
+
+    def __init__(self, secret=None, ttl=EXPORT_TOKEN_TTL):
+        secret = secret or os.getenv("EXPORT_TOKEN_SECRET")
+        self.secret = secret.encode() if isinstance(secret, str) else (secret or secrets.token_bytes(32))
+        self.ttl = ttl
+        self._used = {}  # nonce -> expiry
+        self._lock = threading.Lock()
+
+    def _sign(self, payload):
+        return hmac.new(self.secret, payload.encode(), hashlib.sha256).hexdigest()
+
+    def issue(self, admin_id, name, now=None):
+        expires = int((time.time() if now is None else now) + self.ttl)
+        payload = f"{admin_id}:{name}:{expires}:{secrets.token_hex(8)}"
+        encoded = base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+        return f"{encoded}.{self._sign(payload)}"
+
+    def redeem(self, token, name, now=None):
+        """The admin id the token was issued to; ValueError if it is forged, expired, used or for another report"""
+        now = time.time() if now is None else now
+        try:
+            encoded, signature = token.split(".")
+            payload = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4)).decode()
+            admin_id, token_name, expires, nonce = payload.split(":")
+            expires = int(expires)
+        except (ValueError, UnicodeDecodeError):
+            raise ValueError("Malformed export token")
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            raise ValueError("Invalid export token")
+        if token_name != name:
+            raise ValueError("Export token is for another report")
+        if expires < now:
+            raise ValueError("Export token expired")
+        with self._lock:
+            self._used = {n: e for n, e in self._used.items() if e >= now}
+            if nonce in self._used:
+                raise ValueError("Export token already used")
+            self._used[nonce] = expires
+        return int(admin_id) if admin_id.isdigit() else admin_id
+
+
+def create_router(engine, authenticate_admin, tokens=None):
+    """FastAPI router exposing POST /admin/export/{name}/token and GET /admin/export/{name}
+
+    `authenticate_admin(token)` returns the admin's user id or raises
+    HTTPException; it checks the bearer token of the token request only.
+    Query parameters other than token/format/gzip are filters.
+    """
+    from fastapi import APIRouter, Header, HTTPException, Request
+    from fastapi.responses import StreamingResponse
+
+    router = APIRouter()
+    tokens = tokens or ExportTokens()
+
+    @router.post("/admin/export/{name}/token")
+    def export_token(name: str, authorization: str = Header(default="")):
+        admin_id = authenticate_admin(authorization.removeprefix("Bearer ").strip())
+        if name not in EXPORTS:
+            raise HTTPException(status_code=404, detail=f"Unknown export: {name}")
+        return {"token": tokens.issue(admin_id, name), "expires_in": tokens.ttl}
+
+    @router.get("/admin/export/{name}")
+    def export(name: str, request: Request, token: str, format: str = "csv", gzip: bool = False):
+        if name not in EXPORTS:
+            raise HTTPException(status_code=404, detail=f"Unknown export: {name}")
+        try:
+            admin_id = tokens.redeem(token, name)
+        except ValueError as e:
+            raise HTTPException(status_code=401, detail=str(e))
+        if format not in FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unknown format: {format}")
+        filters = {k: v for k, v in request.query_params.items() if k not in ("token", "format", "gzip")}
+        try:
+            body = stream_export(engine, name, format, gzip, filters)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        audit_writer.log("data_export", f"Exported {name} as {format}", performed_by=admin_id,
+                         metadata={"filters": filters, "gzip": gzip})
+        headers = {
+            "Content-Disposition": f'attachment; filename="{export_filename(name, format, gzip)}"',
+            "Cache-Control": "no-store",
+            "X-Accel-Buffering": "no",
+        }
+        # A .gz download, not transparent Content-Encoding: the file on disk stays compressed
+        media_type = "application/gzip" if gzip else FORMATS[format]
+        return StreamingResponse(body, media_type=media_type, headers=headers)
+
+    return router
+
+
+# -- CLI / benchmark ---------------------------------------------------------
+
+def run_benchmark(engine, name, fmt, filters=None):
+    """Peak Python memory and first-byte latency: streaming export vs fetch-all-then-encode"""
+    results = {}
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    first_byte = None
+    size = 0
+    for chunk in stream_export(engine, name, fmt, False, filters):
+        if first_byte is None:
+            first_byte = time.perf_counter() - started
+        size += len(chunk)
+    results["streaming"] = {"seconds": time.perf_counter() - started, "first_byte": first_byte,
+                            "peak_mb": tracemalloc.get_traced_memory()[1] / 1e6, "bytes": size}
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        rows = list(iter_rows(conn, name, filters))  # what a paginated-to-the-end JSON dump holds
+        body = "".join(encode(name, rows, fmt, money_scales(conn, name))).encode("utf-8")
+    elapsed = time.perf_counter() - started
+    results["fetch_all"] = {"seconds": elapsed, "first_byte": elapsed,
+                            "peak_mb": tracemalloc.get_traced_memory()[1] / 1e6, "bytes": len(body)}
+    tracemalloc.stop()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream an admin report to a CSV/NDJSON file")
+    parser.add_argument('export', choices=sorted(EXPORTS), help="Report to export")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--format', default='csv', choices=sorted(FORMATS))
+    parser.add_argument('--gzip', action='store_true', help="Gzip the output")
+    parser.add_argument('-o', '--output', default=None, help="Output file (default: dated file name)")
+    parser.add_argument('--since', default=None, help="Only rows created on/after this date")
+    parser.add_argument('--until', default=None, help="Only rows created before this date")
+    parser.add_argument('--filter', action='append', default=[], metavar='COLUMN=VALUE', help="Equality filter (repeatable)")
+    parser.add_argument('--status', default=None, help="Shortcut for --filter status=...")
+    parser.add_argument('--benchmark', action='store_true', help="Compare memory with a fetch-all export")
+    args = parser.parse_args(argv)
+
+    filters = dict(f.split("=", 1) for f in args.filter)
+    filters.update({"since": args.since, "until": args.until, "status": args.status})
+    filters = {k: v for k, v in filters.items() if v is not None}
+
+    engine = get_read_engine(args.database_url)
+    try:
+        if args.benchmark:
+            r = run_benchmark(engine, args.export, args.format, filters)
+            print(f"📦 {args.export} as {args.format}: {r['streaming']['bytes'] / 1e6:,.1f} MB")
+            print(f"{'Mode':<10} {'Seconds':>8} {'First byte':>11} {'Peak MB':>9}")
+            print("-" * 42)
+            for mode, m in r.items():
+                print(f"{mode:<10} {m['seconds']:>8.2f} {m['first_byte'] * 1000:>9.1f}ms {m['peak_mb']:>9.1f}")
+            return 0
+
+        path = args.output or export_filename(args.export, args.format, args.gzip)
+        started = time.perf_counter()
+        size = 0
+        with open(path, "wb") as f:
+            for chunk in stream_export(engine, args.export, args.format, args.gzip, filters):
+                f.write(chunk)
+                size += len(chunk)
+        print(f"✅ Exported {args.export} to {path} ({size / 1e6:,.1f} MB in {time.perf_counter() - started:.1f}s)")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,401 @@
+"""
+Append-only, month-partitioned audit log with asynchronous batched writes
+
+Admin actions used to INSERT into system_logs inside the request
+transaction, so every action paid for the audit write, and the single
+ever-growing table made /admin/logs slower over time. Instead:
+
+  - AuditLogWriter.log() only queues the record; a background thread
+    bulk-inserts queued records in one transaction per batch
+  - records go to one table per month (system_logs_202610, ...), each with
+    indexes on (created_at, action) and (created_at, id)
+  - fetch_logs_page() reads the partitions (and any rows left in the
+    legacy system_logs table) newest first with keyset cursors (same
+    {items, next_cursor} shape as keyset_pagination.py)
+  - archive_partitions() rolls months older than the retention window into
+    gzip-compressed JSONL files and drops their tables
+
+Backend wiring:
+
+    from audit_log import audit_writer
+    audit_writer.start()                                     # at startup
+    audit_writer.log("withdrawal_approved", f"Approved WD-{w.id}",
+                     performed_by=admin.id, target_user=w.user_id, metadata={"amount": w.amount})
+
+    # /admin/logs
+    return fetch_logs_page(db, limit, after, action)
+
+Queued records are lost only if the process dies before the next flush
+(FLUSH_INTERVAL seconds); stop() flushes on a clean shutdown and the
+writer blocks callers rather than dropping records when the queue is full.
+
+Usage:
+    python audit_log.py --adopt-legacy                   # move system_logs rows into partitions
+    python audit_log.py --archive --keep-months 6        # compress and drop old partitions
+    python audit_log.py --benchmark --records 5000       # sync vs queued write latency
+"""
+import argparse
+import atexit
+import gzip
+import json
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+from database import format_timestamp, get_engine
+from db_backend import backend_for
+from keyset_pagination import DEFAULT_LIMIT, MAX_LIMIT, decode_cursor, encode_cursor
+
+PARTITION_PREFIX = "system_logs_"
+PARTITION_NAME = re.compile(r"^system_logs_(\d{6})$")
+ARCHIVE_DIR = os.path.join("backups", "audit_logs")
+
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0
+QUEUE_SIZE = 10000
+# How long log() may block when the queue is full before writing inline
+ENQUEUE_TIMEOUT = 2.0
+
+PARTITION_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id {serial_pk},
+        action VARCHAR(100) NOT NULL,
+        description TEXT,
+        performed_by INTEGER,
+        target_user INTEGER,
+        log_metadata TEXT,
+        created_at TIMESTAMP NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_{table}_created_action ON {table} (created_at, action)",
+    "CREATE INDEX IF NOT EXISTS ix_{table}_created_id ON {table} (created_at, id)",
+]
+
+INSERT_SQL = """
+    INSERT INTO {table} (action, description, performed_by, target_user, log_metadata, created_at)
+    VALUES (:action, :description, :performed_by, :target_user, :log_metadata, :created_at)
+"""
+
+
+def partition_for(created_at):
+    return f"{PARTITION_PREFIX}{created_at[:4]}{created_at[5:7]}"
+
+
+def list_partitions(db):
+    """Partition table names, newest first"""
+    names = backend_for(db).table_names(db, PARTITION_PREFIX)
+    return sorted((n for n in names if PARTITION_NAME.match(n)), reverse=True)
+
+
+def ensure_partition(db, table):
+    serial_pk = backend_for(db).serial_pk
+    for ddl in PARTITION_DDL:
+        db.execute(text(ddl.format(table=table, serial_pk=serial_pk)))
+
+
+def make_record(action, description=None, performed_by=None, target_user=None, metadata=None, created_at=None):
+    return {
+        "action": action,
+        "description": description,
+        "performed_by": performed_by,
+        "target_user": target_user,
+        "log_metadata": json.dumps(metadata, default=str) if metadata is not None else None,
+        "created_at": format_timestamp(created_at or datetime.utcnow()),
+    }
+
+
+def write_records(db, records, known_partitions=None):
+    """Bulk-insert records into their month partitions (creating them as needed)"""
+    by_table = {}
+    for record in records:
+        by_table.setdefault(partition_for(record["created_at"]), []).append(record)
+    for table, rows in by_table.items():
+        if known_partitions is None or table not in known_partitions:
+            ensure_partition(db, table)
+            if known_partitions is not None:
+                known_partitions.add(table)
+        db.execute(text(INSERT_SQL.format(table=table)), rows)
+    return len(records)
+
+
+class AuditLogWriter:
+    """Queues audit records and writes them in batches from a background thread"""
+
+    def __init__(self, engine=None, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, queue_size=QUEUE_SIZE):
+        self._engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._partitions = set()
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"queued": 0, "written": 0, "batches": 0, "inline": 0, "errors": 0}
+        self._stats_lock = threading.Lock()  # log() runs on request threads, _write() also on the writer
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._engine = get_engine()
+        return self._engine
+
+    def log(self, action, description=None, performed_by=None, target_user=None, metadata=None):
+        """Queue one audit record; returns without touching the database"""
+        record = make_record(action, description, performed_by, target_user, metadata)
+        try:
+            self._queue.put(record, timeout=ENQUEUE_TIMEOUT)
+            self._count("queued")
+        except queue.Full:
+            # Never drop audit records: write this one inline instead
+            self._count("inline")
+            self._write([record])
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def _write(self, batch):
+        with self._write_lock:
+            with self.engine.begin() as conn:
+                write_records(conn, batch, self._partitions)
+        self._count("written", len(batch))
+        self._count("batches")
+
+    def _drain(self, first=None):
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self):
+        """Write everything queued so far; returns the number of records written"""
+        written = 0
+        while True:
+            batch = self._drain()
+            if not batch:
+                return written
+            self._write(batch)
+            written += len(batch)
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = self._drain(first)
+            while batch:
+                try:
+                    self._write(batch)
+                    batch = None
+                except Exception as e:
+                    # Keep the batch and retry; the database may be briefly locked
+                    self._count("errors")
+                    print(f"⚠️  Audit log write failed (retrying): {e}")
+                    if self._stop.wait(self.flush_interval):
+                        # Shutting down with the database unavailable: put the
+                        # records on stderr rather than losing them silently
+                        for record in batch:
+                            print(json.dumps(record), file=sys.stderr)
+                        batch = None
+
+
+audit_writer = AuditLogWriter()
+
+
+def _page_rows(db, table, limit, key=None, action=None):
+    where, params = ["created_at IS NOT NULL"], {"limit": limit}
+    if action:
+        where.append("action = :action")
+        params["action"] = action
+    if key is not None:
+        where.append("(created_at, id) < (:k0, :k1)")
+        params.update({"k0": key[0], "k1": key[1]})
+    sql = (f"SELECT id, action, description, performed_by, target_user, log_metadata, created_at FROM {table}"
+           f" WHERE {' AND '.join(where)} ORDER BY created_at DESC, id DESC LIMIT :limit")
+    return [dict(row) for row in db.execute(text(sql), params).mappings()]
+
+
+def fetch_logs_page(db, limit=DEFAULT_LIMIT, after=None, action=None):
+    """Newest-first page across the month partitions: {"items": [...], "next_cursor": ...}
+
+    The cursor is the last row's (created_at, id); created_at also names
+    the partition to continue in. Rows still in the legacy system_logs table
+    (written by code that does not use AuditLogWriter yet, or not adopted
+    with --adopt-legacy) are merged in by the same key.
+    """
+    limit = max(1, min(int(limit or DEFAULT_LIMIT), MAX_LIMIT))
+    key = decode_cursor("system_logs", after) if after else None
+    items = []
+    for table in list_partitions(db):
+        if key is not None and table > partition_for(key[0]):
+            continue  # newer than where the previous page stopped
+        same_month = key is not None and table == partition_for(key[0])
+        items.extend(_page_rows(db, table, limit + 1 - len(items), key if same_month else None, action))
+        if len(items) > limit:
+            break
+    if backend_for(db).has_table(db, "system_logs"):
+        items.extend(_page_rows(db, "system_logs", limit + 1, key, action))
+        items.sort(key=lambda row: (row["created_at"], row["id"]), reverse=True)
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor("system_logs", [items[-1]["created_at"], items[-1]["id"]])
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def adopt_legacy(engine, batch_size=BATCH_SIZE * 10):
+    """Move rows from the single system_logs table into month partitions"""
+    moved = 0
+    with engine.begin() as conn:
+        month_key = backend_for(conn).month_key("created_at")
+        months = [row[0] for row in conn.execute(text(
+            f"SELECT DISTINCT {month_key} FROM system_logs WHERE created_at IS NOT NULL"))]
+        for month in months:
+            table = f"{PARTITION_PREFIX}{month}"
+            ensure_partition(conn, table)
+            moved += conn.execute(text(f"""
+                INSERT INTO {table} (action, description, performed_by, target_user, log_metadata, created_at)
+                SELECT action, description, performed_by, target_user, log_metadata, created_at
+                FROM system_logs WHERE {month_key} = :month ORDER BY created_at, id
+            """), {"month": month}).rowcount
+        conn.execute(text("DELETE FROM system_logs WHERE created_at IS NOT NULL"))
+    return moved
+
+
+def archive_partitions(engine, keep_months=6, archive_dir=ARCHIVE_DIR, now=None):
+    """Compress partitions older than keep_months to <archive_dir>/<table>.jsonl.gz and drop them
+
+    Returns [(table, rows, path)]. A table is only dropped after its archive
+    has been written and re-read with the expected number of rows.
+    """
+    now = now or datetime.utcnow()
+    cutoff_index = now.year * 12 + now.month - 1 - keep_months
+    cutoff = f"{cutoff_index // 12:04d}{cutoff_index % 12 + 1:02d}"
+    os.makedirs(archive_dir, exist_ok=True)
+
+    archived = []
+    with engine.connect() as conn:
+        tables = [t for t in list_partitions(conn) if PARTITION_NAME.match(t).group(1) <= cutoff]
+    for table in sorted(tables):
+        path = os.path.join(archive_dir, f"{table}.jsonl.gz")
+        tmp_path = path + ".tmp"
+        rows = 0
+        with engine.connect() as conn, gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            result = conn.execution_options(yield_per=BATCH_SIZE * 10).execute(text(f"SELECT * FROM {table} ORDER BY created_at, id"))
+            for row in result.mappings():
+                f.write(json.dumps(dict(row), default=str) + "\n")
+                rows += 1
+        with gzip.open(tmp_path, "rt", encoding="utf-8") as f:
+            if sum(1 for _ in f) != rows:
+                raise RuntimeError(f"Archive of {table} is incomplete; table kept")
+        os.replace(tmp_path, path)
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE {table}"))
+        archived.append((table, rows, path))
+    return archived
+
+
+def benchmark(engine, records):
+    """Per-call latency of a synchronous insert+commit vs AuditLogWriter.log()"""
+    sync_latencies = []
+    for i in range(records):
+        started = time.perf_counter()
+        with engine.begin() as conn:
+            write_records(conn, [make_record("benchmark_sync", f"record {i}", metadata={"i": i})])
+        sync_latencies.append(time.perf_counter() - started)
+
+    writer = AuditLogWriter(engine).start()
+    async_latencies = []
+    for i in range(records):
+        started = time.perf_counter()
+        writer.log("benchmark_async", f"record {i}", metadata={"i": i})
+        async_latencies.append(time.perf_counter() - started)
+    started = time.perf_counter()
+    writer.stop()
+    drain_seconds = time.perf_counter() - started
+
+    with engine.begin() as conn:
+        for table in list_partitions(conn):
+            conn.execute(text(f"DELETE FROM {table} WHERE action IN ('benchmark_sync', 'benchmark_async')"))
+
+    def ms(values, pct):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * pct / 100.0))] * 1000.0
+
+    return {
+        "sync_p50_ms": ms(sync_latencies, 50), "sync_p99_ms": ms(sync_latencies, 99),
+        "async_p50_ms": ms(async_latencies, 50), "async_p99_ms": ms(async_latencies, 99),
+        "batches": writer.stats["batches"], "drain_ms": drain_seconds * 1000.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the partitioned audit log")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--adopt-legacy', action='store_true', help="Move system_logs rows into month partitions")
+    parser.add_argument('--archive', action='store_true', help="Compress and drop partitions past retention")
+    parser.add_argument('--keep-months', type=int, default=6, help="Months kept as live tables")
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR)
+    parser.add_argument('--benchmark', action='store_true', help="Compare synchronous and queued write latency")
+    parser.add_argument('--records', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    engine = get_engine(args.database_url)
+    try:
+        if args.adopt_legacy:
+            moved = adopt_legacy(engine)
+            print(f"✅ Moved {moved:,} legacy log row(s) into month partitions")
+
+        if args.archive:
+            archived = archive_partitions(engine, args.keep_months, args.archive_dir)
+            for table, rows, path in archived:
+                print(f"📦 {table}: {rows:,} row(s) → {path}")
+            print(f"✅ Archived {len(archived)} partition(s) older than {args.keep_months} month(s)")
+
+        if args.benchmark:
+            r = benchmark(engine, args.records)
+            print(f"⏱️  {args.records:,} audit records")
+            print(f"   Synchronous insert+commit: p50 {r['sync_p50_ms']:.3f} ms, p99 {r['sync_p99_ms']:.3f} ms")
+            print(f"   Queued (AuditLogWriter):   p50 {r['async_p50_ms']:.3f} ms, p99 {r['async_p99_ms']:.3f} ms")
+            print(f"   Background writer used {r['batches']} batch(es); final drain {r['drain_ms']:.0f} ms")
+
+        with engine.connect() as conn:
+            partitions = list_partitions(conn)
+        print(f"📚 {len(partitions)} live partition(s){': ' + ', '.join(partitions) if partitions else ''}")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
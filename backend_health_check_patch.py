@@ -39,4 +39,7 @@ def ping():
     """
     Simple ping endpoint for quick connectivity tests
     """
-    return {"ping": "pong"}
\ No newline at end of file
+    return {"ping": "pong"}
+# Request/SQL metrics at /api/metrics and ?profile=1 for admins (see instrumentation.py)
+from instrumentation import install as install_instrumentation
+install_instrumentation(app, engine, is_admin_request=lambda request: admin_from_bearer(request) is not None)
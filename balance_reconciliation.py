@@ -0,0 +1,238 @@
+"""
+Set-based balance reconciliation engine
+
+Finds balances where total_balance != activity_balance + affiliate_balance
+with SQL instead of a per-row Python loop:
+  1. One aggregate query counts the mismatches and the total drift.
+  2. Mismatched rows are streamed in keyset-paginated chunks
+     (balances.id > :last_id ORDER BY id LIMIT :n), so memory stays constant.
+  3. Fixes are applied as batched UPDATE ... WHERE id IN (...) statements,
+     one bounded transaction per chunk.
+
+Amounts in the report and the tolerance are int kobo whatever the columns
+hold (money.money_scale: FLOAT naira until migrate_money_to_kobo.py ran, then
+exact integers). Fixes bump balances.version when the column exists
+(migration 8, balance_service.py).
+
+Usage:
+    python balance_reconciliation.py --dry-run
+    python balance_reconciliation.py --chunk-size 5000 --report reconcile.json
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+from functools import lru_cache
+
+from sqlalchemy import bindparam, text
+
+from database import get_engine
+from money import format_naira, from_stored, money_scale, stored_tolerance
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_TOLERANCE = 0  # kobo; exact on integer columns, half a kobo of float noise on naira
+DEFAULT_SAMPLE_SIZE = 100
+
+EXPECTED_TOTAL = "(COALESCE(activity_balance, 0) + COALESCE(affiliate_balance, 0))"
+DRIFT = f"(COALESCE(total_balance, 0) - {EXPECTED_TOTAL})"
+
+SUMMARY_SQL = text(f"""
+    SELECT COUNT(*) AS total_records,
+           COALESCE(SUM(CASE WHEN ABS({DRIFT}) > :tolerance THEN 1 ELSE 0 END), 0) AS mismatched,
+           COALESCE(SUM(CASE WHEN ABS({DRIFT}) > :tolerance THEN {DRIFT} ELSE 0 END), 0) AS total_drift
+    FROM balances
+""")
+
+MISMATCH_CHUNK_SQL = text(f"""
+    SELECT id, user_id, activity_balance, affiliate_balance, total_balance,
+           {EXPECTED_TOTAL} AS expected_total
+    FROM balances
+    WHERE id > :last_id AND ABS({DRIFT}) > :tolerance
+    ORDER BY id
+    LIMIT :limit
+""")
+
+FIX_CHUNK_SQL = f"""
+    UPDATE balances
+    SET total_balance = {EXPECTED_TOTAL}{{bump}}, updated_at = CURRENT_TIMESTAMP
+    WHERE id IN :ids AND ABS({DRIFT}) > :tolerance
+"""
+
+MONEY_FIELDS = ("activity_balance", "affiliate_balance", "total_balance", "expected_total")
+
+
+@lru_cache(maxsize=None)
+def fix_chunk_sql(versioned):
+    bump = ", version = version + 1" if versioned else ""
+    return text(FIX_CHUNK_SQL.format(bump=bump)).bindparams(bindparam('ids', expanding=True))
+
+
+def has_version(conn):
+    """Whether balances.version (optimistic locking) is installed"""
+    return "version" in conn.execute(text("SELECT * FROM balances LIMIT 0")).keys()
+
+
+def summarize(conn, tolerance=DEFAULT_TOLERANCE):
+    """Count records, mismatches and total drift (int kobo) with a single aggregate query"""
+    scale = money_scale(conn, "balances", "total_balance")
+    row = conn.execute(SUMMARY_SQL, {"tolerance": stored_tolerance(tolerance, scale)}).mappings().one()
+    return {
+        "total_records": int(row["total_records"]),
+        "mismatched": int(row["mismatched"]),
+        "total_drift": from_stored(row["total_drift"], scale),
+    }
+
+
+def iter_mismatch_chunks(engine, chunk_size=DEFAULT_CHUNK_SIZE, tolerance=DEFAULT_TOLERANCE):
+    """Yield lists of mismatched balance rows, keyset-paginated on balances.id
+
+    Each chunk is read in its own short connection so no long-lived read
+    transaction is held open while fixes are being written. Amounts are
+    returned in kobo.
+    """
+    last_id = 0
+    scale = None
+    while True:
+        with engine.connect() as conn:
+            if scale is None:
+                scale = money_scale(conn, "balances", "total_balance")
+            rows = conn.execute(
+                MISMATCH_CHUNK_SQL,
+                {"last_id": last_id, "tolerance": stored_tolerance(tolerance, scale), "limit": chunk_size},
+            ).mappings().all()
+        if not rows:
+            return
+        yield [{k: from_stored(v, scale) if k in MONEY_FIELDS else v for k, v in row.items()} for row in rows]
+        last_id = rows[-1]["id"]
+
+
+def apply_fixes(conn, ids, tolerance=DEFAULT_TOLERANCE):
+    """Set total_balance = activity + affiliate for the given balance ids
+
+    The drift condition is re-checked in the WHERE clause, so a row that was
+    corrected concurrently is not rewritten. Returns the number of rows fixed.
+    """
+    if not ids:
+        return 0
+    tolerance = stored_tolerance(tolerance, money_scale(conn, "balances", "total_balance"))
+    result = conn.execute(fix_chunk_sql(has_version(conn)), {"ids": list(ids), "tolerance": tolerance})
+    return result.rowcount
+
+
+def reconcile(engine, dry_run=False, chunk_size=DEFAULT_CHUNK_SIZE,
+              tolerance=DEFAULT_TOLERANCE, sample_size=DEFAULT_SAMPLE_SIZE, on_chunk=None):
+    """Find and (unless dry_run) fix total_balance drift
+
+    Returns a JSON-serialisable report. on_chunk, if given, is called with
+    (chunk_number, rows, fixed_in_chunk) after each chunk for progress output.
+    """
+    started = time.perf_counter()
+    started_at = datetime.utcnow()
+
+    with engine.connect() as conn:
+        before = summarize(conn, tolerance)
+
+    report = {
+        "started_at": started_at.isoformat(),
+        "dry_run": dry_run,
+        "tolerance": tolerance,
+        "chunk_size": chunk_size,
+        "total_records": before["total_records"],
+        "mismatched": before["mismatched"],
+        "total_drift": before["total_drift"],
+        "fixed": 0,
+        "chunks": 0,
+        "sample": [],
+    }
+
+    if before["mismatched"]:
+        for rows in iter_mismatch_chunks(engine, chunk_size, tolerance):
+            report["chunks"] += 1
+            fixed = 0
+            if not dry_run:
+                with engine.begin() as conn:
+                    fixed = apply_fixes(conn, [row["id"] for row in rows], tolerance)
+                report["fixed"] += fixed
+
+            room = sample_size - len(report["sample"])
+            for row in rows[:max(room, 0)]:
+                report["sample"].append({
+                    "balance_id": row["id"],
+                    "user_id": row["user_id"],
+                    "activity_balance": row["activity_balance"],
+                    "affiliate_balance": row["affiliate_balance"],
+                    "total_balance": row["total_balance"],
+                    "expected_total": row["expected_total"],
+                })
+
+            if on_chunk:
+                on_chunk(report["chunks"], rows, fixed)
+
+    report["finished_at"] = datetime.utcnow().isoformat()
+    report["duration_seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def write_report(report, path):
+    """Write the reconciliation report as JSON ('-' for stdout)"""
+    payload = json.dumps(report, indent=2, default=str)
+    if path == '-':
+        print(payload)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(payload + "\n")
+
+
+def print_summary(report):
+    print("\n=== Summary ===")
+    print(f"Total records: {report['total_records']:,}")
+    print(f"Mismatched: {report['mismatched']:,} (drift {format_naira(report['total_drift'])})")
+    if report["dry_run"]:
+        print("Fixed: 0 (dry run)")
+    else:
+        print(f"Fixed: {report['fixed']:,}")
+    print(f"Correct: {report['total_records'] - report['mismatched']:,}")
+    print(f"Duration: {report['duration_seconds']}s over {report['chunks']} chunk(s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile total_balance = activity_balance + affiliate_balance")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--dry-run', action='store_true', help="Report mismatches without fixing them")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Rows per keyset chunk / UPDATE batch")
+    parser.add_argument('--tolerance', type=int, default=DEFAULT_TOLERANCE, help="Allowed absolute drift in kobo")
+    parser.add_argument('--sample-size', type=int, default=DEFAULT_SAMPLE_SIZE, help="Mismatched rows to include in the report")
+    parser.add_argument('--report', default=None, help="Write a JSON report to this path ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    engine = get_engine(args.database_url)
+
+    def progress(chunk, rows, fixed):
+        action = "found" if args.dry_run else f"fixed {fixed} of"
+        print(f"  chunk {chunk}: {action} {len(rows)} mismatched row(s), last id {rows[-1]['id']}")
+
+    try:
+        print("=== Reconciling Total Balances ===")
+        report = reconcile(
+            engine,
+            dry_run=args.dry_run,
+            chunk_size=args.chunk_size,
+            tolerance=args.tolerance,
+            sample_size=args.sample_size,
+            on_chunk=progress,
+        )
+    except Exception as e:
+        print(f"\n❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+    print_summary(report)
+    if args.report:
+        write_report(report, args.report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
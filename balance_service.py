@@ -0,0 +1,289 @@
+"""
+Atomic balance mutations with a version column
+
+Task claims, stream claims, card purchases, withdrawals and coupon bonuses
+all change balances by reading the row, adding in Python and writing the
+absolute value back:
+
+    balance.activity_balance += amount
+    balance.total_balance = balance.activity_balance + balance.affiliate_balance
+
+Two requests doing this at once both read the same old value and one
+credit is silently lost (Postgres READ COMMITTED allows it inside a single
+transaction), and any path that forgets the second line leaves
+total_balance drifting - which is what verify_total_balance.py and
+fix_orphaned_balances.py exist to repair.
+
+Every mutation here is one relative UPDATE that also recomputes
+total_balance in SQL and bumps balances.version:
+
+    UPDATE balances
+    SET activity_balance = COALESCE(activity_balance, 0) + :delta,
+        total_balance = COALESCE(activity_balance, 0) + :delta + COALESCE(affiliate_balance, 0),
+        version = version + 1
+    WHERE user_id = :user_id [AND COALESCE(activity_balance, 0) + :delta >= 0] [AND version = :expected_version]
+
+followed by the matching transactions row in the same transaction, so the
+balance and the ledger can only change together. Debits never go negative,
+and callers that showed the user a balance can pass the version they read
+(optimistic locking): if anything changed in between they get StaleBalance
+instead of acting on numbers the user never saw.
+
+transactions.reference is unique, so passing a natural key (TASK-<id>,
+STREAM-<id>) makes a retried claim fail with IntegrityError - rolling back
+its balance change too - instead of paying twice.
+
+Backend wiring (inside the request's transaction):
+
+    from balance_service import InsufficientFunds, credit, debit
+    from money import to_kobo
+
+    credit(db, user.id, task.amount, "ACTIVITY", f"Task reward: {task.title}", reference=f"TASK-{task.id}")
+
+    try:
+        debit(db, user.id, to_kobo(body.amount), body.balance_type, "Withdrawal request",
+              expected_version=body.balance_version)
+    except InsufficientFunds:
+        raise HTTPException(status_code=400, detail="Insufficient balance")
+
+Usage:
+    python balance_service.py --install
+    python balance_service.py --stress --workers 16 --claims 200 --users 10   # run against a copy of the database
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from functools import lru_cache
+
+from sqlalchemy import text
+
+from database import format_timestamp, get_engine
+from money import BALANCE_COLUMNS, KOBO_PER_NAIRA, format_naira, money_scale
+
+# Columns that make up total_balance (main_balance is tracked separately)
+TOTAL_COLUMNS = ("activity_balance", "affiliate_balance")
+RETURNED_COLUMNS = ("main_balance", "activity_balance", "affiliate_balance", "total_balance", "version")
+
+
+class BalanceError(ValueError):
+    """Raised when a balance mutation cannot be applied"""
+
+
+class InsufficientFunds(BalanceError):
+    """The debit would take the balance below zero"""
+
+
+class StaleBalance(BalanceError):
+    """The balance changed since the caller read `expected_version`"""
+
+
+ADD_VERSION_SQL = text("ALTER TABLE balances ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+INSERT_TRANSACTION_SQL = text("""
+    INSERT INTO transactions (user_id, type, amount, balance_type, description, reference, created_at)
+    VALUES (:user_id, :type, :amount, :balance_type, :description, :reference, :now)
+""")
+
+BALANCE_STATE_SQL = "SELECT version, {column} FROM balances WHERE user_id = :user_id"
+
+
+def install(db):
+    """Add balances.version if it is missing; returns True when the column was added"""
+    columns = set(db.execute(text("SELECT * FROM balances LIMIT 0")).keys())
+    if "version" in columns:
+        return False
+    db.execute(ADD_VERSION_SQL)
+    return True
+
+
+@lru_cache(maxsize=None)
+def mutation_sql(column, debit, versioned):
+    """The single UPDATE for one balance column, with optional guards"""
+    total = " + ".join(f"COALESCE({c}, 0)" + (" + :delta" if c == column else "") for c in TOTAL_COLUMNS)
+    where = ["user_id = :user_id"]
+    if debit:
+        where.append(f"COALESCE({column}, 0) + :delta >= 0")
+    if versioned:
+        where.append("version = :expected_version")
+    return text(f"""
+        UPDATE balances
+        SET {column} = COALESCE({column}, 0) + :delta,
+            total_balance = {total},
+            version = version + 1,
+            updated_at = :now
+        WHERE {' AND '.join(where)}
+        RETURNING {', '.join(RETURNED_COLUMNS)}
+    """)
+
+
+def apply(db, user_id, amount, balance_type, description=None, reference=None, expected_version=None):
+    """Credit (amount > 0) or debit (amount < 0) kobo on one balance and record it in transactions
+
+    Runs in the caller's transaction and returns the new balances row as a
+    dict (including version). Raises InsufficientFunds, StaleBalance or
+    BalanceError; nothing is written in that case.
+    """
+    balance_type = balance_type.upper()
+    column = BALANCE_COLUMNS.get(balance_type)
+    if column is None:
+        raise BalanceError(f"Unknown balance type: {balance_type}")
+    if isinstance(amount, float):
+        raise BalanceError(f"Amounts are int kobo, got {amount!r} - use money.to_kobo()")
+    if not amount:
+        raise BalanceError("Amount must be non-zero")
+
+    debit = amount < 0
+    now = format_timestamp(datetime.utcnow())
+    sql = mutation_sql(column, debit, expected_version is not None)
+    row = db.execute(sql, {"user_id": user_id, "delta": amount, "expected_version": expected_version,
+                           "now": now}).mappings().first()
+    if row is None:
+        state = db.execute(text(BALANCE_STATE_SQL.format(column=column)), {"user_id": user_id}).first()
+        if state is None:
+            raise BalanceError(f"User {user_id} has no balance")
+        if expected_version is not None and state[0] != expected_version:
+            raise StaleBalance(f"Balance changed (version {state[0]}, expected {expected_version})")
+        raise InsufficientFunds(f"Insufficient {balance_type.lower()} balance ({format_naira(state[1] or 0)})")
+
+    db.execute(INSERT_TRANSACTION_SQL, {
+        "user_id": user_id, "type": "DEBIT" if debit else "CREDIT", "amount": abs(amount),
+        "balance_type": balance_type, "description": description, "reference": reference, "now": now,
+    })
+    return dict(row)
+
+
+def credit(db, user_id, amount, balance_type, description=None, reference=None, expected_version=None):
+    if amount <= 0:
+        raise BalanceError("Credit amount must be positive")
+    return apply(db, user_id, amount, balance_type, description, reference, expected_version)
+
+
+def debit(db, user_id, amount, balance_type, description=None, reference=None, expected_version=None):
+    if amount <= 0:
+        raise BalanceError("Debit amount must be positive")
+    return apply(db, user_id, -amount, balance_type, description, reference, expected_version)
+
+
+# -- stress test -------------------------------------------------------------
+
+SNAPSHOT_SQL = "SELECT user_id, activity_balance, affiliate_balance, total_balance FROM balances WHERE user_id IN ({ids})"
+
+
+def _legacy_claim(engine, user_id, amount, reference):
+    """The read-modify-write pattern this module replaces"""
+    with engine.begin() as conn:
+        activity, total = conn.execute(text(
+            "SELECT activity_balance, total_balance FROM balances WHERE user_id = :user_id"), {"user_id": user_id}).one()
+    time.sleep(0)  # request handling between the read and the write
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE balances SET activity_balance = :activity, total_balance = :total, version = version + 1
+            WHERE user_id = :user_id
+        """), {"activity": (activity or 0) + amount, "total": (total or 0) + amount, "user_id": user_id})
+        conn.execute(INSERT_TRANSACTION_SQL, {
+            "user_id": user_id, "type": "CREDIT", "amount": amount, "balance_type": "ACTIVITY",
+            "description": "Stress test claim", "reference": reference, "now": format_timestamp(datetime.utcnow()),
+        })
+
+
+def _atomic_claim(engine, user_id, amount, reference):
+    with engine.begin() as conn:
+        credit(conn, user_id, amount, "ACTIVITY", "Stress test claim", reference)
+
+
+def run_stress(engine, mode, user_ids, workers, claims, seed=7):
+    """Run `workers` threads of `claims` parallel claims; returns lost credits and total drift
+
+    The users' balances are restored and the test transactions removed
+    afterwards.
+    """
+    claim = _atomic_claim if mode == "atomic" else _legacy_claim
+    prefix = f"STRESS-{mode.upper()}-"
+    ids = ", ".join(str(int(i)) for i in user_ids)
+    with engine.connect() as conn:
+        before = {row[0]: row for row in conn.execute(text(SNAPSHOT_SQL.format(ids=ids)))}
+
+    errors = []
+
+    def worker(n):
+        rng = random.Random(seed + n)
+        for i in range(claims):
+            try:
+                claim(engine, rng.choice(user_ids), rng.choice([2500, 5000, 10000]), f"{prefix}{n}-{i}")
+            except Exception as e:  # lock timeouts etc. - the claim simply failed
+                errors.append(e)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    try:
+        with engine.connect() as conn:
+            after = {row[0]: row for row in conn.execute(text(SNAPSHOT_SQL.format(ids=ids)))}
+            ledger = dict(conn.execute(text(
+                "SELECT user_id, SUM(amount) FROM transactions WHERE reference LIKE :prefix GROUP BY user_id"),
+                {"prefix": prefix + "%"}).all())
+        lost = sum(ledger.get(uid, 0) - ((after[uid][1] or 0) - (before[uid][1] or 0)) for uid in user_ids)
+        drifted = sum(1 for uid in user_ids
+                      if abs((after[uid][3] or 0) - (after[uid][1] or 0) - (after[uid][2] or 0)) != 0)
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM transactions WHERE reference LIKE :prefix"), {"prefix": prefix + "%"})
+            for uid, row in before.items():
+                conn.execute(text("""
+                    UPDATE balances SET activity_balance = :activity, affiliate_balance = :affiliate, total_balance = :total,
+                        version = version + 1
+                    WHERE user_id = :user_id
+                """), {"activity": row[1], "affiliate": row[2], "total": row[3], "user_id": uid})
+    return {"claims": workers * claims - len(errors), "failed": len(errors), "lost": lost,
+            "drifted": drifted, "seconds": elapsed}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Install the balance version column / stress-test concurrent claims")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--install', action='store_true', help="Add balances.version")
+    parser.add_argument('--stress', action='store_true', help="Compare read-modify-write and atomic claims under load")
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--claims', type=int, default=200, help="Claims per worker")
+    parser.add_argument('--users', type=int, default=10, help="Users the claims are spread over")
+    args = parser.parse_args(argv)
+
+    engine = get_engine(args.database_url)
+    try:
+        if args.install or args.stress:
+            with engine.begin() as conn:
+                added = install(conn)
+            print("✅ balances.version added" if added else "✅ balances.version already exists")
+
+        if args.stress:
+            with engine.connect() as conn:
+                if money_scale(conn, "balances", "activity_balance") != KOBO_PER_NAIRA:
+                    print("❌ balances still holds FLOAT naira; credits here are int kobo - "
+                          "run migrate_money_to_kobo.py on this copy first")
+                    return 1
+                user_ids = [row[0] for row in conn.execute(
+                    text("SELECT user_id FROM balances ORDER BY user_id LIMIT :n"), {"n": args.users})]
+            print(f"\n📦 {args.workers} workers x {args.claims} claims over {len(user_ids)} users")
+            print(f"{'Mode':<8} {'Applied':>8} {'Failed':>7} {'Lost':>12} {'Drifted':>8} {'Seconds':>8}")
+            print("-" * 56)
+            for mode in ("legacy", "atomic"):
+                r = run_stress(engine, mode, user_ids, args.workers, args.claims)
+                print(f"{mode:<8} {r['claims']:>8} {r['failed']:>7} {format_naira(r['lost']):>12} {r['drifted']:>8} {r['seconds']:>8.2f}")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
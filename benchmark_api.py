@@ -0,0 +1,286 @@
+"""
+Async load-test and latency benchmark for the Affluence API
+
+Builds on check_backend_api.py: after the same reachability check, it
+replays realistic user journeys at configurable concurrency with one pooled
+aiohttp session:
+
+    login -> /users/dashboard -> /tasks/ -> /tasks/{id}/take -> /tasks/{id}/claim
+          -> /withdrawals/ -> /users/top-earners
+
+and reports p50/p95/p99 latency, throughput and error rate per endpoint.
+Results can be exported as JSON and compared with an earlier run.
+
+Usage:
+    python benchmark_api.py --username demo --password secret --concurrency 50 --duration 30
+    python benchmark_api.py --users users.csv --iterations 20 --output run.json
+    python benchmark_api.py ... --compare baseline.json
+
+users.csv holds one "username,password" pair per line; virtual users cycle
+through it. Requires: pip install aiohttp
+"""
+import argparse
+import asyncio
+import csv
+import json
+import random
+import sys
+import time
+from datetime import datetime
+
+from check_backend_api import check_api_status, print_error, print_info, print_success, print_warning
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+DEFAULT_BASE_URL = "http://localhost:8000"
+DEFAULT_TIMEOUT = 30
+
+# Business rejections that are a normal part of a replayed journey
+# (e.g. a task already taken/claimed today) and do not count as errors
+EXPECTED_STATUSES = {
+    "POST /tasks/{id}/take": {400, 409},
+    "POST /tasks/{id}/claim": {400, 409},
+}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Recorder:
+    """Collects per-endpoint latencies and outcomes"""
+
+    def __init__(self):
+        self.samples = {}
+
+    def record(self, name, seconds, status, error=None):
+        entry = self.samples.setdefault(name, {"latencies": [], "statuses": {}, "errors": 0, "rejected": 0})
+        entry["latencies"].append(seconds * 1000.0)
+        key = str(status) if status is not None else "exception"
+        entry["statuses"][key] = entry["statuses"].get(key, 0) + 1
+        if error or status is None or status >= 500:
+            entry["errors"] += 1
+        elif status >= 400:
+            if status in EXPECTED_STATUSES.get(name, ()):
+                entry["rejected"] += 1
+            else:
+                entry["errors"] += 1
+
+    def summary(self, wall_seconds):
+        endpoints = {}
+        for name, entry in sorted(self.samples.items()):
+            latencies = sorted(entry["latencies"])
+            count = len(latencies)
+            endpoints[name] = {
+                "requests": count,
+                "throughput_rps": round(count / wall_seconds, 2) if wall_seconds else None,
+                "error_rate": round(entry["errors"] / count, 4) if count else 0.0,
+                "errors": entry["errors"],
+                "rejected": entry["rejected"],
+                "p50_ms": round(percentile(latencies, 50), 2),
+                "p95_ms": round(percentile(latencies, 95), 2),
+                "p99_ms": round(percentile(latencies, 99), 2),
+                "max_ms": round(latencies[-1], 2),
+                "statuses": entry["statuses"],
+            }
+        total = sum(e["requests"] for e in endpoints.values())
+        errors = sum(e["errors"] for e in endpoints.values())
+        return {
+            "total_requests": total,
+            "throughput_rps": round(total / wall_seconds, 2) if wall_seconds else None,
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+class VirtualUser:
+    """One simulated user replaying the journey with its own token"""
+
+    def __init__(self, session, api_base, recorder, username, password):
+        self.session = session
+        self.api_base = api_base
+        self.recorder = recorder
+        self.username = username
+        self.password = password
+        self.token = None
+
+    async def call(self, name, method, path, **kwargs):
+        headers = kwargs.pop("headers", {})
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        started = time.perf_counter()
+        try:
+            async with self.session.request(method, f"{self.api_base}{path}", headers=headers, **kwargs) as response:
+                body = await response.read()
+                self.recorder.record(name, time.perf_counter() - started, response.status)
+                if response.status >= 400 or not body:
+                    return None
+                try:
+                    return json.loads(body)
+                except ValueError:
+                    return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.recorder.record(name, time.perf_counter() - started, None, error=e)
+            return None
+
+    async def login(self):
+        # OAuth2PasswordRequestForm expects form-urlencoded fields, like js/api.js
+        data = await self.call(
+            "POST /auth/login", "POST", "/auth/login",
+            data={"username": self.username, "password": self.password},
+        )
+        self.token = data.get("access_token") if data else None
+        return self.token is not None
+
+    async def journey(self):
+        if not self.token and not await self.login():
+            return
+        await self.call("GET /users/dashboard", "GET", "/users/dashboard")
+        tasks = await self.call("GET /tasks/", "GET", "/tasks/")
+        if isinstance(tasks, list) and tasks:
+            task_id = random.choice(tasks).get("id")
+            if task_id is not None:
+                await self.call("POST /tasks/{id}/take", "POST", f"/tasks/{task_id}/take")
+                await self.call("POST /tasks/{id}/claim", "POST", f"/tasks/{task_id}/claim")
+        await self.call("GET /withdrawals/", "GET", "/withdrawals/?skip=0&limit=50")
+        await self.call("GET /users/top-earners", "GET", "/users/top-earners?limit=20")
+
+
+async def run_benchmark(base_url, credentials, concurrency, duration=None, iterations=None, timeout=DEFAULT_TIMEOUT):
+    """Run `concurrency` virtual users until duration elapses or each did `iterations` journeys"""
+    recorder = Recorder()
+    api_base = base_url.rstrip('/') + "/api"
+    connector = aiohttp.TCPConnector(limit=concurrency, ttl_dns_cache=300)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    deadline = time.perf_counter() + duration if duration else None
+
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+        async def worker(index):
+            username, password = credentials[index % len(credentials)]
+            user = VirtualUser(session, api_base, recorder, username, password)
+            done = 0
+            while True:
+                if iterations is not None and done >= iterations:
+                    break
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+                await user.journey()
+                done += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        wall = time.perf_counter() - started
+
+    return recorder.summary(wall), wall
+
+
+def load_credentials(args):
+    if args.users:
+        with open(args.users, newline='', encoding='utf-8') as f:
+            credentials = [(row[0].strip(), row[1].strip()) for row in csv.reader(f) if len(row) >= 2]
+        if not credentials:
+            raise ValueError(f"No username,password rows found in {args.users}")
+        return credentials
+    if args.username and args.password:
+        return [(args.username, args.password)]
+    raise ValueError("Pass --username/--password or --users users.csv")
+
+
+def print_results(summary, wall):
+    print_info(f"\n=== Results ({wall:.1f}s, {summary['total_requests']} requests, "
+               f"{summary['throughput_rps']} req/s, error rate {summary['error_rate']:.2%}) ===")
+    print(f"{'Endpoint':<26} {'Reqs':>7} {'RPS':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'Errors':>8}")
+    print("-" * 82)
+    for name, e in summary["endpoints"].items():
+        line = (f"{name:<26} {e['requests']:>7} {e['throughput_rps']:>8} {e['p50_ms']:>9} "
+                f"{e['p95_ms']:>9} {e['p99_ms']:>9} {e['error_rate']:>8.2%}")
+        if e["error_rate"] > 0.01:
+            print_warning(line)
+        else:
+            print(line)
+
+
+def compare_results(summary, baseline):
+    """Print p95 and throughput deltas against an earlier exported run"""
+    print_info("\n=== Compared with baseline ===")
+    for name, e in summary["endpoints"].items():
+        old = baseline.get("summary", {}).get("endpoints", {}).get(name)
+        if not old:
+            continue
+        delta = (e["p95_ms"] - old["p95_ms"]) / old["p95_ms"] if old["p95_ms"] else 0.0
+        line = f"{name:<26} p95 {old['p95_ms']:>8} → {e['p95_ms']:>8} ms ({delta:+.1%})"
+        if delta > 0.10:
+            print_error(line + "  regression")
+        elif delta < -0.10:
+            print_success(line + "  improvement")
+        else:
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent latency benchmark for the Affluence API")
+    parser.add_argument('base_url', nargs='?', default=DEFAULT_BASE_URL, help="Backend base URL (without /api)")
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    parser.add_argument('--users', help="CSV file of username,password pairs")
+    parser.add_argument('--concurrency', type=int, default=10, help="Number of virtual users")
+    parser.add_argument('--duration', type=float, default=None, help="Seconds to run (default: 30 unless --iterations)")
+    parser.add_argument('--iterations', type=int, default=None, help="Journeys per virtual user")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help="Per-request timeout in seconds")
+    parser.add_argument('--output', help="Write JSON results to this file")
+    parser.add_argument('--compare', help="Baseline JSON results to compare against")
+    args = parser.parse_args(argv)
+
+    if aiohttp is None:
+        print_error("aiohttp is required: pip install aiohttp")
+        return 2
+
+    try:
+        credentials = load_credentials(args)
+    except (OSError, ValueError) as e:
+        print_error(str(e))
+        return 2
+
+    if not check_api_status(args.base_url):
+        print_error("\n✗ API is not reachable; start the backend first")
+        return 1
+
+    duration = args.duration if args.duration or args.iterations else 30.0
+    print_info(f"\nRunning {args.concurrency} virtual user(s) "
+               + (f"for {duration:.0f}s" if duration else f"× {args.iterations} journey(s)"))
+
+    summary, wall = asyncio.run(run_benchmark(
+        args.base_url, credentials, args.concurrency,
+        duration=duration, iterations=args.iterations, timeout=args.timeout,
+    ))
+    print_results(summary, wall)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare_results(summary, json.load(f))
+
+    if args.output:
+        result = {
+            "generated_at": datetime.utcnow().isoformat(),
+            "base_url": args.base_url,
+            "concurrency": args.concurrency,
+            "duration_seconds": round(wall, 3),
+            "iterations": args.iterations,
+            "summary": summary,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print_success(f"\n✓ Results written to {args.output}")
+
+    return 0 if summary["error_rate"] <= 0.01 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
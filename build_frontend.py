@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Frontend asset build for Affluence
+
+Reads the top-level HTML pages and writes a deployable dist/ tree:
+  1. Runs of consecutive local <script src="js/..."> tags are bundled into one
+     file, and runs of consecutive local stylesheets into one CSS file
+     (inline scripts and CDN tags in between keep their position and order)
+  2. Bundles are minified (comments and indentation removed; string, template
+     and regex literals are left untouched)
+  3. Every bundle gets a content-hashed file name (js/bundle.3f2a9c1b04.js) and
+     the <script>/<link> references are rewritten to point at it
+  4. dist/manifest.json maps pages and source files to the hashed outputs
+
+Hashed files never change, so serve_frontend.py --root dist can cache them
+as immutable. A cold page load then needs 2-3 cacheable asset requests
+instead of 6-10 uncacheable ones.
+
+Usage:
+    python build_frontend.py [--out dist] [--no-minify]
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import shutil
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent
+DEFAULT_OUT = PROJECT_ROOT / "dist"
+
+# Copied into dist/ unchanged so anything referenced dynamically keeps working
+STATIC_DIRS = ["js", "css", "images", "img", "assets", "audio"]
+STATIC_SUFFIXES = {".png", ".ico", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".mp3", ".json", ".txt", ".webmanifest"}
+SKIP_SUFFIXES = {".bak", ".old", ".dup", ".corrupt"}
+
+SCRIPT_TAG = re.compile(r'<script\b([^>]*)>\s*</script>', re.IGNORECASE)
+LINK_TAG = re.compile(r'<link\b([^>]*)/?>', re.IGNORECASE)
+ATTR = re.compile(r'([\w:-]+)\s*=\s*("([^"]*)"|\'([^\']*)\')')
+GAP = re.compile(r'^(\s|<!--.*?-->)*$', re.DOTALL)
+
+
+def parse_attrs(raw):
+    return {m.group(1).lower(): m.group(3) if m.group(3) is not None else m.group(4) for m in ATTR.finditer(raw)}
+
+
+def local_path(url):
+    """Return the project-relative path for a local asset URL, or None for external ones"""
+    if not url or re.match(r'^([a-z]+:)?//', url, re.IGNORECASE) or url.startswith('data:'):
+        return None
+    path = url.split('?', 1)[0].split('#', 1)[0].lstrip('/')
+    return path if (PROJECT_ROOT / path).is_file() else None
+
+
+def find_assets(html):
+    """Yield (start, end, kind, path) for bundleable local script/stylesheet tags"""
+    for match in SCRIPT_TAG.finditer(html):
+        attrs = parse_attrs(match.group(1))
+        # Only plain classic scripts are safe to concatenate
+        if set(attrs) - {"src", "type"} or attrs.get("type", "text/javascript") != "text/javascript":
+            continue
+        path = local_path(attrs.get("src"))
+        if path and path.endswith(".js"):
+            yield match.start(), match.end(), "js", path
+    for match in LINK_TAG.finditer(html):
+        attrs = parse_attrs(match.group(1))
+        if attrs.get("rel", "").lower() != "stylesheet" or attrs.get("media"):
+            continue
+        path = local_path(attrs.get("href"))
+        if path and path.endswith(".css"):
+            yield match.start(), match.end(), "css", path
+
+
+def group_runs(html, tags):
+    """Group tags of the same kind separated only by whitespace/comments"""
+    runs = []
+    for tag in sorted(tags):
+        start, end, kind, path = tag
+        if runs:
+            last = runs[-1]
+            prev_end = last["end"]
+            if last["kind"] == kind and GAP.match(html[prev_end:start]):
+                last["paths"].append(path)
+                last["end"] = end
+                continue
+        runs.append({"kind": kind, "start": start, "end": end, "paths": [path]})
+    return runs
+
+
+# -- minifiers ---------------------------------------------------------------
+
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^') | {''}
+REGEX_KEYWORDS = {'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void', 'throw', 'case', 'do', 'else', 'yield', 'await'}
+
+
+def minify_js(source):
+    """Strip comments and indentation outside string/template/regex literals
+
+    Newlines are kept so automatic semicolon insertion behaves exactly as in
+    the source; this trades a few bytes for never changing semantics.
+    """
+    out = []
+    i, n = 0, len(source)
+    last_token = ''  # last significant char or identifier, for regex detection
+    line_start = True
+    while i < n:
+        ch = source[i]
+        nxt = source[i + 1] if i + 1 < n else ''
+        if ch == '/' and nxt == '/':
+            while i < n and source[i] != '\n':
+                i += 1
+            continue
+        if ch == '/' and nxt == '*':
+            end = source.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+            if out and not line_start and out[-1] not in ' \n':
+                out.append(' ')
+            continue
+        if ch == '\n':
+            while out and out[-1] == ' ':
+                out.pop()
+            if out and out[-1] != '\n':
+                out.append('\n')
+            line_start = True
+            i += 1
+            continue
+        if ch in ' \t\r':
+            if not line_start and out and out[-1] not in ' \n':
+                out.append(' ')
+            i += 1
+            continue
+        line_start = False
+        if ch in '"\'`':
+            j = i + 1
+            depth = 0
+            while j < n:
+                c = source[j]
+                if c == '\\':
+                    j += 2
+                    continue
+                if ch == '`' and c == '$' and j + 1 < n and source[j + 1] == '{':
+                    depth += 1
+                elif ch == '`' and c == '}' and depth:
+                    depth -= 1
+                elif c == ch and not depth:
+                    break
+                elif c == '\n' and ch != '`':
+                    break
+                j += 1
+            out.append(source[i:j + 1])
+            last_token = ch
+            i = j + 1
+            continue
+        if ch == '/' and (last_token in REGEX_PRECEDERS or last_token in REGEX_KEYWORDS):
+            j = i + 1
+            in_class = False
+            while j < n and source[j] != '\n':
+                c = source[j]
+                if c == '\\':
+                    j += 2
+                    continue
+                if c == '[':
+                    in_class = True
+                elif c == ']':
+                    in_class = False
+                elif c == '/' and not in_class:
+                    break
+                j += 1
+            j += 1
+            while j < n and (source[j].isalnum() or source[j] == '_'):
+                j += 1  # flags
+            out.append(source[i:j])
+            last_token = 'regex'
+            i = j
+            continue
+        if ch.isalnum() or ch in '_$':
+            j = i
+            while j < n and (source[j].isalnum() or source[j] in '_$'):
+                j += 1
+            last_token = source[i:j]
+            out.append(last_token)
+            i = j
+            continue
+        out.append(ch)
+        last_token = ch
+        i += 1
+    return ''.join(out).strip() + '\n'
+
+
+CSS_STRING_OR_COMMENT = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/', re.DOTALL)
+
+
+def minify_css(source):
+    """Remove comments and collapse whitespace outside strings"""
+    parts = []
+    pos = 0
+    for match in CSS_STRING_OR_COMMENT.finditer(source):
+        parts.append(_squeeze_css(source[pos:match.start()]))
+        if match.group(1):
+            parts.append(match.group(1))
+        pos = match.end()
+    parts.append(_squeeze_css(source[pos:]))
+    return ''.join(parts).strip() + '\n'
+
+
+def _squeeze_css(chunk):
+    chunk = re.sub(r'\s+', ' ', chunk)
+    chunk = re.sub(r'\s*([{};,>])\s*', r'\1', chunk)
+    return chunk.replace(';}', '}')
+
+
+# -- build -------------------------------------------------------------------
+
+class Builder:
+    def __init__(self, out_dir, minify=True):
+        self.out_dir = Path(out_dir)
+        self.minify = minify
+        self.bundles = {}   # tuple(paths) -> hashed output path
+        self.manifest = {"assets": {}, "bundles": {}, "pages": {}}
+
+    def bundle(self, kind, paths):
+        key = (kind, tuple(paths))
+        if key in self.bundles:
+            return self.bundles[key]
+
+        sources = []
+        for path in paths:
+            text = (PROJECT_ROOT / path).read_text(encoding="utf-8")
+            if self.minify:
+                text = minify_js(text) if kind == "js" else minify_css(text)
+            sources.append(f"/* {path} */\n{text}")
+        # ';' guards against a file that ends without a semicolon
+        content = (";\n" if kind == "js" else "\n").join(sources)
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()[:10]
+
+        if len(paths) == 1:
+            source = Path(paths[0])
+            name = f"{source.parent.as_posix()}/{source.stem}.{digest}{source.suffix}"
+            self.manifest["assets"][paths[0]] = name
+        else:
+            name = f"{kind}/bundle.{digest}.{kind}"
+            self.manifest["bundles"][name] = list(paths)
+        target = self.out_dir / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(content, encoding="utf-8")
+        self.bundles[key] = name
+        return name
+
+    def build_page(self, page):
+        html = page.read_text(encoding="utf-8")
+        runs = group_runs(html, list(find_assets(html)))
+        outputs = []
+        # Replace from the end so earlier offsets stay valid
+        for run in reversed(runs):
+            name = self.bundle(run["kind"], run["paths"])
+            tag = (f'<script src="{name}"></script>' if run["kind"] == "js"
+                   else f'<link rel="stylesheet" href="{name}">')
+            html = html[:run["start"]] + tag + html[run["end"]:]
+            outputs.insert(0, name)
+        (self.out_dir / page.name).write_text(html, encoding="utf-8")
+        self.manifest["pages"][page.name] = outputs
+        return outputs
+
+    def copy_static(self):
+        for dirname in STATIC_DIRS:
+            source = PROJECT_ROOT / dirname
+            if source.is_dir():
+                shutil.copytree(source, self.out_dir / dirname, dirs_exist_ok=True,
+                                ignore=lambda _, names: [n for n in names if Path(n).suffix in SKIP_SUFFIXES])
+        for path in PROJECT_ROOT.iterdir():
+            if path.is_file() and path.suffix.lower() in STATIC_SUFFIXES:
+                shutil.copy2(path, self.out_dir / path.name)
+
+    def run(self):
+        if self.out_dir.exists():
+            shutil.rmtree(self.out_dir)
+        self.out_dir.mkdir(parents=True)
+        self.copy_static()
+        for page in sorted(PROJECT_ROOT.glob("*.html")):
+            self.build_page(page)
+        (self.out_dir / "manifest.json").write_text(json.dumps(self.manifest, indent=2) + "\n", encoding="utf-8")
+        return self.manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bundle, minify and fingerprint frontend assets into dist/")
+    parser.add_argument("--out", default=str(DEFAULT_OUT), help="Output directory")
+    parser.add_argument("--no-minify", action="store_true", help="Bundle and fingerprint without minifying")
+    args = parser.parse_args()
+
+    print(f"🔨 Affluence Frontend Build")
+    print(f"📁 Project root: {PROJECT_ROOT}")
+    manifest = Builder(args.out, minify=not args.no_minify).run()
+
+    before = sum(len(list(find_assets((PROJECT_ROOT / page).read_text(encoding="utf-8")))) for page in manifest["pages"])
+    after = sum(len(outputs) for outputs in manifest["pages"].values())
+    print(f"📄 Built {len(manifest['pages'])} pages: {before} local asset tags → {after}")
+    print(f"📦 {len(manifest['bundles'])} bundle(s), {len(manifest['assets'])} single fingerprinted asset(s)")
+    print(f"✅ Output written to {args.out} (manifest.json lists every hashed file)")
+    print(f"   Serve it with: python serve_frontend.py --root {args.out}")
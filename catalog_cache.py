@@ -0,0 +1,490 @@
+"""
+Read-through cache for the catalog endpoints
+
+/tasks/, /audios/ (api.getAudios), /admin/click-to-earn, active cards,
+published articles and active announcements change a few times a day (an
+admin edits them) but every page load of every user re-runs their queries
+and re-serialises the same JSON. This module caches the encoded JSON per
+catalog and drops it when an admin write touches the catalog's tables:
+
+    CatalogCache.get("tasks", build)   hit: bytes from the store, no SQL
+                                       miss: build() once, store, return
+    CatalogCache.invalidate("tasks")   after an admin create/update/delete
+
+Invalidation bumps a per-catalog generation that is part of every key, so a
+request that started building before the write stores its (old) result
+under the old generation where nobody looks for it again. Concurrent misses
+on the same key in one process wait for a single build. Entries also expire
+after a TTL, which bounds staleness for writes the cache never hears about
+(raw SQL, other tools) and for announcements passing expires_at.
+
+Stores (CATALOG_CACHE_URL):
+
+    memory             (default) per-process LRU; every worker caches and
+                       invalidates on its own, so with several workers an
+                       admin write reaches the other workers by TTL only
+    sqlite:///path     shared WAL file (database.py engines): one set of
+                       generations and entries for all workers on a host
+    redis://host/db    shared Redis; needs the redis package
+
+A shared lookup costs a round trip, so each worker also keeps what it read
+from the shared store for LOCAL_TTL seconds (NearStore); other workers see
+an admin write within that time.
+
+Backend wiring:
+
+    from catalog_cache import catalog_cache, install
+
+    install(SessionLocal)   # commits that touch a catalog table invalidate it
+
+    @router.get("/tasks/")
+    def list_tasks(db: Session = Depends(get_db)):
+        return catalog_cache.response("tasks", lambda: crud.get_active_tasks(db))
+
+ORM writes are picked up by install(); routes that write with raw SQL call
+catalog_cache.invalidate_tables("tasks") after committing. Hit and miss
+counters are on /api/metrics (catalog_cache_requests_total).
+
+Usage:
+    python catalog_cache.py --benchmark --requests 5000 --write-rate 0.001 --database-url sqlite:////tmp/perf.db
+    python catalog_cache.py --invalidate tasks --store sqlite:////tmp/catalog_cache.db
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from sqlalchemy import event, text
+
+from database import get_engine, get_read_engine
+from instrumentation import CounterMetric, metrics
+
+CATALOG_CACHE_URL = os.environ.get('CATALOG_CACHE_URL', 'memory')
+
+DEFAULT_TTL = 300.0
+ANNOUNCEMENT_TTL = 30.0
+LOCAL_TTL = 2.0  # seconds a worker serves a shared entry from memory
+MAX_ENTRIES = 256
+REDIS_PREFIX = "affluence:catalog:"
+
+
+class CatalogSpec:
+    """A cacheable catalog: the tables it reads and the query that lists it"""
+
+    def __init__(self, tables, sql, ttl=None, description=""):
+        self.tables = tables
+        self.sql = text(sql)
+        self.ttl = ttl
+        self.description = description
+
+    def rows(self, db, params=None):
+        return [dict(row) for row in db.execute(self.sql, {"active": True, **(params or {})}).mappings()]
+
+
+CATALOGS = {
+    "tasks": CatalogSpec(
+        ("tasks",), "SELECT * FROM tasks WHERE is_active = :active ORDER BY id",
+        description="/tasks/"),
+    "audios": CatalogSpec(
+        ("audios",), "SELECT * FROM audios WHERE is_active = :active ORDER BY id",
+        description="/audios/"),
+    "click_to_earn": CatalogSpec(
+        ("click_to_earn_task",), "SELECT * FROM click_to_earn_task ORDER BY id LIMIT 1",
+        description="/admin/click-to-earn"),
+    "cards": CatalogSpec(
+        ("cards",), "SELECT * FROM cards WHERE is_active = :active ORDER BY id",
+        description="active cards"),
+    "articles": CatalogSpec(
+        ("articles",), "SELECT * FROM articles WHERE is_published = :active ORDER BY created_at DESC, id DESC",
+        description="published articles"),
+    # Expiry is not a write, so announcements rely on a short TTL to drop expired rows
+    "announcements": CatalogSpec(
+        ("announcements",),
+        "SELECT * FROM announcements WHERE is_active = :active "
+        "AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP) ORDER BY created_at DESC, id DESC",
+        ttl=ANNOUNCEMENT_TTL, description="active announcements"),
+}
+
+
+def encode(data):
+    return json.dumps(data, default=str, separators=(",", ":")).encode()
+
+
+def variant_key(params):
+    """The part of a cache key that tells requests for the same catalog apart"""
+    return "&".join(f"{k}={params[k]}" for k in sorted(params))
+
+
+# -- stores ------------------------------------------------------------------
+#
+# A store keeps a generation per catalog and entries keyed by (catalog,
+# generation, variant). lookup() returns the current generation together with
+# the entry, so a miss is stored under the generation it was looked up in.
+
+class MemoryStore:
+    """Per-process LRU of encoded catalogs with per-entry expiry"""
+
+    name = "memory"
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries = OrderedDict()  # (catalog, generation, variant) -> (expires_at, value)
+        self._generations = Counter()
+        self._lock = threading.Lock()
+
+    def lookup(self, catalog, variant):
+        with self._lock:
+            generation = self._generations[catalog]
+            key = (catalog, generation, variant)
+            entry = self._entries.get(key)
+            if entry is None:
+                return generation, None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return generation, None
+            self._entries.move_to_end(key)
+            return generation, entry[1]
+
+    def set(self, catalog, generation, variant, value, ttl):
+        with self._lock:
+            if generation != self._generations[catalog]:
+                return  # invalidated while it was being built
+            key = (catalog, generation, variant)
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def bump(self, catalog):
+        with self._lock:
+            self._generations[catalog] += 1
+            for key in [k for k in self._entries if k[0] == catalog]:
+                del self._entries[key]
+
+
+SHARED_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS cache_entries (
+        catalog VARCHAR(64) NOT NULL,
+        generation INTEGER NOT NULL,
+        variant VARCHAR(255) NOT NULL,
+        value BLOB NOT NULL,
+        expires_at REAL NOT NULL,
+        PRIMARY KEY (catalog, generation, variant)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS cache_generations (
+        catalog VARCHAR(64) PRIMARY KEY,
+        generation INTEGER NOT NULL
+    )
+    """,
+]
+
+# One round trip per request: the current generation and its live entry, if any
+LOOKUP_SQL = text("""
+    SELECT g.generation, e.value
+    FROM (SELECT COALESCE(MAX(generation), 0) AS generation
+          FROM cache_generations WHERE catalog = :catalog) g
+    LEFT JOIN cache_entries e
+      ON e.catalog = :catalog AND e.generation = g.generation AND e.variant = :variant
+     AND e.expires_at > :now
+""")
+BUMP_SQL = text("""
+    INSERT INTO cache_generations (catalog, generation) VALUES (:catalog, 1)
+    ON CONFLICT (catalog) DO UPDATE SET generation = cache_generations.generation + 1
+""")
+# Stored only while :generation is still current (as MemoryStore.set): a catalog
+# built before an invalidation must not land under the old generation
+SET_SQL = text("""
+    INSERT INTO cache_entries (catalog, generation, variant, value, expires_at)
+    SELECT :catalog, :generation, :variant, :value, :expires_at
+    WHERE (SELECT COALESCE(MAX(generation), 0) FROM cache_generations WHERE catalog = :catalog) = :generation
+    ON CONFLICT (catalog, generation, variant) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at
+""")
+PURGE_SQL = text("DELETE FROM cache_entries WHERE catalog = :catalog AND expires_at <= :now")
+
+
+class SQLiteStore:
+    """Cache shared by the workers on one host, in its own SQLite file"""
+
+    name = "sqlite"
+
+    def __init__(self, url):
+        self.engine = get_engine(url)
+        self.read_engine = get_read_engine(url)
+        with self.engine.begin() as conn:
+            for sql in SHARED_SCHEMA:
+                conn.execute(text(sql))
+
+    def lookup(self, catalog, variant):
+        with self.read_engine.connect() as conn:
+            return tuple(conn.execute(LOOKUP_SQL, {"catalog": catalog, "variant": variant, "now": time.time()}).one())
+
+    def set(self, catalog, generation, variant, value, ttl):
+        # Expired entries of variants nobody asks for again would otherwise stay until bump()
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(PURGE_SQL, {"catalog": catalog, "now": now})
+            conn.execute(SET_SQL, {"catalog": catalog, "generation": generation, "variant": variant,
+                                   "value": value, "expires_at": now + ttl})
+
+    def bump(self, catalog):
+        with self.engine.begin() as conn:
+            conn.execute(BUMP_SQL, {"catalog": catalog})
+            conn.execute(text("DELETE FROM cache_entries WHERE catalog = :catalog AND generation < "
+                              "(SELECT generation FROM cache_generations WHERE catalog = :catalog)"),
+                         {"catalog": catalog})
+
+
+class RedisStore:
+    """Cache shared through Redis; entries of old generations expire by TTL"""
+
+    name = "redis"
+
+    def __init__(self, url, prefix=REDIS_PREFIX):
+        import redis  # optional dependency, only needed for this store
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def lookup(self, catalog, variant):
+        generation = int(self.client.get(f"{self.prefix}generation:{catalog}") or 0)
+        return generation, self.client.get(f"{self.prefix}{catalog}:{generation}:{variant}")
+
+    def set(self, catalog, generation, variant, value, ttl):
+        self.client.set(f"{self.prefix}{catalog}:{generation}:{variant}", value, px=max(1, int(ttl * 1000)))
+
+    def bump(self, catalog):
+        self.client.incr(f"{self.prefix}generation:{catalog}")
+
+
+class NearStore:
+    """A shared store with a short-lived per-process copy of its entries in front
+
+    Hits are served from memory for up to local_ttl seconds, so an admin write
+    in another worker reaches this one within local_ttl; the worker that made
+    the write drops its copy at once.
+    """
+
+    def __init__(self, shared, local_ttl=LOCAL_TTL, max_entries=MAX_ENTRIES):
+        self.shared = shared
+        self.local = MemoryStore(max_entries)
+        self.local_ttl = local_ttl
+        self.name = f"{shared.name} + memory"
+
+    def lookup(self, catalog, variant):
+        local_generation, entry = self.local.lookup(catalog, variant)
+        if entry is not None:
+            return entry
+        generation, value = self.shared.lookup(catalog, variant)
+        if value is not None:
+            self.local.set(catalog, local_generation, variant, (generation, value), self.local_ttl)
+        return generation, value
+
+    def set(self, catalog, generation, variant, value, ttl):
+        # Not copied locally: the next lookup reads it back only if it is still current
+        self.shared.set(catalog, generation, variant, value, ttl)
+
+    def bump(self, catalog):
+        self.shared.bump(catalog)
+        self.local.bump(catalog)
+
+
+def store_from_url(url=None, local_ttl=LOCAL_TTL):
+    """MemoryStore for "memory", otherwise the shared store (behind a NearStore unless local_ttl is 0)"""
+    url = url or CATALOG_CACHE_URL
+    if url == "memory":
+        return MemoryStore()
+    if url.startswith("sqlite"):
+        shared = SQLiteStore(url)
+    elif url.startswith(("redis://", "rediss://", "unix://")):
+        shared = RedisStore(url)
+    else:
+        raise ValueError(f"Unknown catalog cache store: {url}")
+    return NearStore(shared, local_ttl) if local_ttl else shared
+
+
+# -- cache -------------------------------------------------------------------
+
+class CatalogCache:
+    def __init__(self, store=None, ttl=DEFAULT_TTL, catalogs=None):
+        self.store = store or MemoryStore()
+        self.ttl = ttl
+        self.catalogs = catalogs or CATALOGS
+        self.requests = CounterMetric(
+            "catalog_cache_requests_total", "Catalog cache lookups by result", ("catalog", "result"))
+        self.invalidations = CounterMetric(
+            "catalog_cache_invalidations_total", "Catalog cache invalidations", ("catalog",))
+        self._builds = {}  # (catalog, variant) -> lock held while one request builds it
+        self._builds_lock = threading.Lock()
+
+    def get(self, catalog, build, **params):
+        """The catalog's JSON bytes; build() (JSON-able data) only runs on a miss"""
+        spec = self.catalogs[catalog]
+        variant = variant_key(params)
+        generation, value = self.store.lookup(catalog, variant)
+        if value is None:
+            with self._build_lock(catalog, variant):
+                # Another request may have built it while this one waited
+                generation, value = self.store.lookup(catalog, variant)
+                if value is None:
+                    self.requests.inc((catalog, "miss"))
+                    value = encode(build())
+                    self.store.set(catalog, generation, variant, value, spec.ttl or self.ttl)
+                    return value
+        self.requests.inc((catalog, "hit"))
+        return value
+
+    def fetch(self, db, catalog, **params):
+        """The catalog as listed by its CatalogSpec query"""
+        return self.get(catalog, lambda: self.catalogs[catalog].rows(db, params), **params)
+
+    def response(self, catalog, build, **params):
+        """FastAPI Response with the cached JSON; build may return ORM/pydantic objects"""
+        from fastapi.encoders import jsonable_encoder
+        from fastapi.responses import Response
+
+        body = self.get(catalog, lambda: jsonable_encoder(build()), **params)
+        return Response(content=body, media_type="application/json")
+
+    def invalidate(self, *catalogs):
+        for catalog in catalogs:
+            self.store.bump(catalog)
+            self.invalidations.inc((catalog,))
+
+    def invalidate_tables(self, *tables):
+        """Invalidate every catalog that reads one of `tables`; returns the catalogs"""
+        catalogs = [name for name, spec in self.catalogs.items() if set(spec.tables) & set(tables)]
+        self.invalidate(*catalogs)
+        return catalogs
+
+    def stats(self):
+        """{catalog: {"hit": n, "miss": n, "invalidations": n}} for this process"""
+        stats = {name: {"hit": 0, "miss": 0, "invalidations": 0} for name in self.catalogs}
+        for (catalog, result), count in self.requests.values().items():
+            stats[catalog][result] = count
+        for (catalog,), count in self.invalidations.values().items():
+            stats[catalog]["invalidations"] = count
+        return stats
+
+    def exposition(self):
+        return self.requests.exposition() + self.invalidations.exposition()
+
+    def _build_lock(self, catalog, variant):
+        with self._builds_lock:
+            return self._builds.setdefault((catalog, variant), threading.Lock())
+
+
+catalog_cache = CatalogCache(store_from_url())
+
+
+def install(session_class, cache=None, registry=None):
+    """Invalidate catalogs when a committed ORM flush touched their tables; expose the counters"""
+    cache = cache or catalog_cache
+    watched = {table for spec in cache.catalogs.values() for table in spec.tables}
+
+    @event.listens_for(session_class, "after_flush")
+    def collect_tables(session, flush_context):
+        touched = session.info.setdefault("catalog_tables", set())
+        for obj in (*session.new, *session.dirty, *session.deleted):
+            table = getattr(obj, "__tablename__", None)
+            if table in watched:
+                touched.add(table)
+
+    @event.listens_for(session_class, "after_commit")
+    def invalidate_committed(session):
+        tables = session.info.pop("catalog_tables", None)
+        if tables:
+            cache.invalidate_tables(*tables)
+
+    @event.listens_for(session_class, "after_rollback")
+    def forget_rolled_back(session):
+        session.info.pop("catalog_tables", None)
+
+    (registry or metrics).register(cache)
+    return cache
+
+
+# -- benchmark ---------------------------------------------------------------
+
+def run_benchmark(engine, cache, requests, write_rate, seed=42):
+    """Serve `requests` random catalog reads, invalidating a catalog with probability write_rate
+
+    cache=None serves every request from the database. Returns requests/second.
+    """
+    rng = random.Random(seed)
+    names = list(CATALOGS)
+
+    def rows(name):
+        with engine.connect() as conn:
+            return CATALOGS[name].rows(conn)
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        name = rng.choice(names)
+        if rng.random() < write_rate and cache is not None:
+            cache.invalidate(name)
+        if cache is None:
+            encode(rows(name))
+        else:
+            cache.get(name, lambda: rows(name))
+    return requests / (time.perf_counter() - started)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Catalog read-through cache: benchmark and invalidation")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--store', default=None, help="Cache store URL (default: $CATALOG_CACHE_URL or memory)")
+    parser.add_argument('--invalidate', nargs='+', metavar='CATALOG', choices=sorted(CATALOGS),
+                        help="Invalidate catalogs in a shared --store")
+    parser.add_argument('--benchmark', action='store_true', help="Requests per second without and with the cache")
+    parser.add_argument('--requests', type=int, default=5000, help="Catalog requests per benchmark run")
+    parser.add_argument('--write-rate', type=float, default=0.001, help="Fraction of requests preceded by an admin write")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.invalidate:
+            store = store_from_url(args.store)
+            CatalogCache(store).invalidate(*args.invalidate)
+            print(f"✅ Invalidated {', '.join(args.invalidate)} in the {store.name} store")
+        elif args.benchmark:
+            engine = get_read_engine(args.database_url)
+            # Each shared run starts from an empty store of its own
+            shared = [args.store or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'catalog_cache.db')}"
+                      for _ in range(2)]
+            stores = [store_from_url(shared[0], local_ttl=0), store_from_url(shared[1])]
+            runs = [("uncached", None), ("memory", CatalogCache(MemoryStore()))]
+            runs += [(store.name, CatalogCache(store)) for store in stores]
+            print(f"{args.requests:,} requests over {len(CATALOGS)} catalogs, "
+                  f"{args.write_rate:.1%} preceded by an admin write\n")
+            baseline = None
+            for label, cache in runs:
+                rate = run_benchmark(engine, cache, args.requests, args.write_rate)
+                baseline = baseline or rate
+                line = f"{label:<20} {rate:>10,.0f} req/s  {rate / baseline:>6.1f}x"
+                if cache is not None:
+                    stats = cache.stats().values()
+                    line += (f"  hits {sum(s['hit'] for s in stats):,}, misses {sum(s['miss'] for s in stats):,}, "
+                             f"invalidations {sum(s['invalidations'] for s in stats):,}")
+                print(line)
+        else:
+            parser.print_help()
+            return 1
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
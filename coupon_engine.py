@@ -0,0 +1,382 @@
+"""
+Bulk coupon generation, assignment, export and atomic redemption
+
+Vendors order MEGA/ALPHA codes by the tens of thousands, but /admin/coupons
+creates them one request (and one uniqueness check) at a time. This engine
+generates a whole pool in one transaction:
+
+  1. Reserve a block of N sequence numbers with a single UPDATE on
+     coupon_code_sequence (the row lock serialises concurrent batches).
+  2. Turn each number into a code with a keyed Feistel permutation over
+     40 bits. A permutation is a bijection, so distinct sequence numbers
+     always give distinct codes - no per-code SELECT, no retry loop - while
+     the secret key keeps consecutive codes unguessable.
+  3. Insert the batch with one executemany (COPY on PostgreSQL, see
+     db_backend.py).
+
+Codes look like MEGA-7K3QX9PDR: type prefix, 8 Crockford base32 characters
+and a check character, so typos are rejected before touching the database.
+Legacy codes (CPN000000001, hand-made codes) keep working; the unique index
+on coupons.code remains the safety net.
+
+Redemption is one conditional statement, so two registrations racing for
+the same code cannot both win:
+
+    UPDATE coupons SET status = 'USED', used_by = :user_id, used_at = :now
+    WHERE code = :code AND status = 'UNUSED' AND revoked_at IS NULL
+
+Backend wiring (registration, inside the transaction that creates the user):
+
+    from coupon_engine import CouponError, redeem_coupon
+
+    try:
+        coupon = redeem_coupon(db, user_data.coupon_code, new_user.id)
+    except CouponError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    credit(db, new_user.id, coupon["bonus_amount"], "ACTIVITY", "Registration coupon bonus",
+           reference=f"COUPON-{coupon['id']}")
+
+and for the admin bulk endpoint:
+
+    @router.post("/coupons/bulk")
+    def bulk_coupons(body: BulkCouponRequest, db=..., admin=...):
+        codes = generate_coupons(db, body.count, body.coupon_type, assigned_to=body.assigned_to)
+        db.commit()
+        return {"created": len(codes), "codes": codes}
+
+Requires the coupon_type column (python migrations.py).
+
+Usage:
+    python coupon_engine.py --generate 20000 --type mega --assign-to 12 --csv mega_vendor12.csv
+    python coupon_engine.py --assign 5000 --type alpha --assign-to 12
+    python coupon_engine.py --export coupons.csv --assign-to 12 --status unused
+    python coupon_engine.py --benchmark --count 50000      # run against a copy of the database
+"""
+import argparse
+import csv
+import hashlib
+import hmac
+import secrets
+import sys
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+from database import format_timestamp, get_engine
+from db_backend import backend_for
+from keyset_pagination import iter_all
+from money import from_stored, money_scale, to_kobo, to_naira, to_stored
+
+# Registration bonus per coupon type in kobo (MEGA was lowered to ₦500 by update_mega_bonus.py)
+COUPON_TYPES = {"mega": 50000, "alpha": 200000}
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"  # Crockford base32: no I, L, O, U
+CODE_CHARS = 8
+HALF_BITS = CODE_CHARS * 5 // 2
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+SEQUENCE_NAME = "coupon_codes"
+
+EXPORT_COLUMNS = ["code", "coupon_type", "bonus_amount", "status", "assigned_to", "used_by", "created_at", "used_at"]
+
+
+class CouponError(ValueError):
+    """Raised when a code cannot be redeemed (unknown, used or revoked)"""
+
+
+CREATE_SEQUENCE_SQL = """
+    CREATE TABLE IF NOT EXISTS coupon_code_sequence (
+        name VARCHAR(32) PRIMARY KEY,
+        next_value BIGINT NOT NULL,
+        secret VARCHAR(64) NOT NULL
+    )
+"""
+
+SEQUENCE_COLUMNS = ["name", "next_value", "secret"]
+
+RESERVE_SQL = text("UPDATE coupon_code_sequence SET next_value = next_value + :count WHERE name = :name")
+
+SEQUENCE_SQL = text("SELECT next_value, secret FROM coupon_code_sequence WHERE name = :name")
+
+INSERT_COLUMNS = ["code", "coupon_type", "assigned_to", "status", "bonus_amount", "created_at"]
+
+ASSIGN_SQL = text("""
+    UPDATE coupons SET assigned_to = :subadmin_id
+    WHERE id IN (
+        SELECT id FROM coupons
+        WHERE assigned_to IS NULL AND status = 'UNUSED' AND revoked_at IS NULL AND coupon_type = :coupon_type
+        ORDER BY id LIMIT :count
+    )
+""")
+
+SUBADMIN_SQL = text("SELECT role FROM users WHERE id = :user_id")
+
+REDEEM_SQL = text("""
+    UPDATE coupons SET status = 'USED', used_by = :user_id, used_at = :now
+    WHERE code = :code AND status = 'UNUSED' AND revoked_at IS NULL
+    RETURNING id, code, coupon_type, bonus_amount
+""")
+
+COUPON_STATE_SQL = text("SELECT status, revoked_at FROM coupons WHERE code = :code")
+
+
+# -- codes -------------------------------------------------------------------
+
+def _round(secret, round_index, half):
+    digest = hmac.new(secret, f"{round_index}:{half}".encode(), hashlib.sha256).digest()
+    return int.from_bytes(digest[:4], "big") & HALF_MASK
+
+
+def permute(value, secret):
+    """Keyed Feistel permutation of a 40-bit integer (a bijection on [0, 2**40))"""
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    for i in range(ROUNDS):
+        left, right = right, left ^ _round(secret, i, right)
+    return (left << HALF_BITS) | right
+
+
+def check_char(body):
+    total = sum((i + 1) * ALPHABET.index(c) for i, c in enumerate(body))
+    return ALPHABET[total % len(ALPHABET)]
+
+
+def make_code(sequence, secret, coupon_type):
+    value = permute(sequence, secret)
+    body = "".join(ALPHABET[(value >> (5 * i)) & 31] for i in reversed(range(CODE_CHARS)))
+    return f"{coupon_type.upper()}-{body}{check_char(body)}"
+
+
+def normalize_code(code):
+    """Upper-case and undo common misreadings (O -> 0, I/L -> 1) in generated codes"""
+    code = (code or "").strip().upper()
+    prefix, sep, body = code.partition("-")
+    if sep and prefix.lower() in COUPON_TYPES:
+        body = body.replace("O", "0").replace("I", "1").replace("L", "1")
+        return f"{prefix}-{body}"
+    return code
+
+
+def is_well_formed(code):
+    """False only for a generated-looking code whose check character is wrong"""
+    prefix, sep, body = code.partition("-")
+    if not (sep and prefix.lower() in COUPON_TYPES):
+        return True  # legacy code, let the database decide
+    return (len(body) == CODE_CHARS + 1 and all(c in ALPHABET for c in body)
+            and check_char(body[:-1]) == body[-1])
+
+
+# -- generation and assignment -----------------------------------------------
+
+def ensure_schema(db):
+    """Create the sequence table and check coupons has a coupon_type column"""
+    columns = set(db.execute(text("SELECT * FROM coupons LIMIT 0")).keys())
+    if "coupon_type" not in columns:
+        raise RuntimeError("coupons.coupon_type is missing - run migrations.py first")
+    db.execute(text(CREATE_SEQUENCE_SQL))
+    # ON CONFLICT DO NOTHING: two first-ever batches racing cannot both seed
+    db.execute(text(backend_for(db).upsert_sql("coupon_code_sequence", SEQUENCE_COLUMNS, ["name"], update=())),
+               {"name": SEQUENCE_NAME, "next_value": 1, "secret": secrets.token_hex(32)})
+
+
+def reserve_sequence(db, count):
+    """Reserve `count` sequence numbers; returns (first, secret)"""
+    db.execute(RESERVE_SQL, {"count": count, "name": SEQUENCE_NAME})
+    next_value, secret = db.execute(SEQUENCE_SQL, {"name": SEQUENCE_NAME}).one()
+    return next_value - count, bytes.fromhex(secret)
+
+
+def check_subadmin(db, user_id):
+    role = db.execute(SUBADMIN_SQL, {"user_id": user_id}).scalar()
+    if role is None:
+        raise ValueError(f"User {user_id} not found")
+    if str(role).upper() != "SUBADMIN":
+        raise ValueError(f"User {user_id} is not a sub-admin (role {role})")
+
+
+def generate_coupons(db, count, coupon_type, bonus_amount=None, assigned_to=None):
+    """Insert `count` new UNUSED coupons (bonus in kobo) in the caller's transaction; returns the codes
+
+    The bonus is stored in the column's unit: naira until migrate_money_to_kobo.py has run.
+    """
+    coupon_type = coupon_type.lower()
+    if coupon_type not in COUPON_TYPES:
+        raise ValueError(f"Unknown coupon type: {coupon_type}")
+    if count < 1:
+        raise ValueError("count must be positive")
+    if assigned_to is not None:
+        check_subadmin(db, assigned_to)
+    if bonus_amount is None:
+        bonus_amount = COUPON_TYPES[coupon_type]
+
+    ensure_schema(db)
+    bonus_amount = to_stored(bonus_amount, money_scale(db, "coupons", "bonus_amount"))
+    first, secret = reserve_sequence(db, count)
+    now = format_timestamp(datetime.utcnow())
+    codes = [make_code(first + i, secret, coupon_type) for i in range(count)]
+    backend_for(db).bulk_insert(db, "coupons", INSERT_COLUMNS, (
+        {"code": code, "coupon_type": coupon_type, "assigned_to": assigned_to, "status": "UNUSED",
+         "bonus_amount": bonus_amount, "created_at": now}
+        for code in codes
+    ))
+    return codes
+
+
+def assign_coupons(db, subadmin_id, count, coupon_type):
+    """Hand `count` unassigned unused coupons of a type to a sub-admin; returns how many moved"""
+    check_subadmin(db, subadmin_id)
+    result = db.execute(ASSIGN_SQL, {"subadmin_id": subadmin_id, "count": count,
+                                     "coupon_type": coupon_type.lower()})
+    return result.rowcount
+
+
+def export_csv(db, out, assigned_to=None, status=None, coupon_type=None):
+    """Write matching coupons to a CSV file object, newest first; returns the row count"""
+    writer = csv.writer(out)
+    writer.writerow(EXPORT_COLUMNS)
+    filters = {"assigned_to": assigned_to, "status": status, "coupon_type": coupon_type}
+    count = 0
+    scale = money_scale(db, "coupons", "bonus_amount")
+    for row in iter_all(db, "coupons", filters=filters):
+        # Vendors get naira, like the rest of the API
+        writer.writerow([to_naira(from_stored(row[column], scale)) if column == "bonus_amount" else row.get(column)
+                         for column in EXPORT_COLUMNS])
+        count += 1
+    return count
+
+
+# -- redemption --------------------------------------------------------------
+
+def redeem_coupon(db, code, user_id):
+    """Mark a coupon used by `user_id` in the caller's transaction
+
+    Returns {"id", "code", "coupon_type", "bonus_amount"}; raises
+    CouponError if the code is unknown, already used or revoked. The
+    conditional UPDATE is the only write, so concurrent redemptions of one
+    code resolve to exactly one winner.
+    """
+    code = normalize_code(code)
+    if not code or not is_well_formed(code):
+        raise CouponError("Invalid coupon code")
+
+    row = db.execute(REDEEM_SQL, {"code": code, "user_id": user_id,
+                                  "now": format_timestamp(datetime.utcnow())}).mappings().first()
+    if row is not None:
+        return dict(row)
+
+    # Lost (or never had) the race: only now look at why, for the error message
+    state = db.execute(COUPON_STATE_SQL, {"code": code}).first()
+    if state is None:
+        raise CouponError("Invalid coupon code")
+    if state[1] is not None:
+        raise CouponError("Coupon has been revoked")
+    raise CouponError("Coupon has already been used")
+
+
+# -- benchmark ---------------------------------------------------------------
+
+def race(engine, code, workers):
+    """Redeem one code from `workers` threads at once; returns the number of winners"""
+    barrier = threading.Barrier(workers)
+    winners = []
+
+    def attempt(user_id):
+        barrier.wait()
+        try:
+            with engine.begin() as conn:
+                redeem_coupon(conn, code, user_id)
+            winners.append(user_id)
+        except CouponError:
+            pass
+
+    threads = [threading.Thread(target=attempt, args=(i + 1,)) for i in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return len(winners)
+
+
+def run_benchmark(engine, count, workers=16):
+    results = {}
+    with engine.connect() as conn:
+        trans = conn.begin()
+        started = time.perf_counter()
+        codes = generate_coupons(conn, count, "mega")
+        results["generate_s"] = time.perf_counter() - started
+        results["unique"] = len(set(codes)) == len(codes)
+        trans.rollback()
+
+    with engine.begin() as conn:
+        code = generate_coupons(conn, 1, "alpha")[0]
+    try:
+        results["winners"] = race(engine, code, workers)
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM coupons WHERE code = :code"), {"code": code})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk coupon generation, assignment and export")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--generate', type=int, metavar='N', help="Create N new coupons")
+    parser.add_argument('--assign', type=int, metavar='N', help="Assign N unassigned unused coupons to --assign-to")
+    parser.add_argument('--export', metavar='PATH', help="Export coupons (filtered by --assign-to/--status/--type) as CSV")
+    parser.add_argument('--type', default=None, choices=sorted(COUPON_TYPES), help="Coupon type (default: mega; no filter for --export)")
+    parser.add_argument('--bonus', type=to_kobo, default=None, help="Bonus in naira (default: the type's standard bonus)")
+    parser.add_argument('--assign-to', type=int, default=None, help="Sub-admin user id")
+    parser.add_argument('--status', default=None, choices=['unused', 'used'], help="Status filter for --export")
+    parser.add_argument('--csv', default=None, help="Also write the generated codes to this CSV file")
+    parser.add_argument('--benchmark', action='store_true', help="Time bulk generation and race concurrent redemptions")
+    parser.add_argument('--count', type=int, default=50000, help="Codes to generate in the benchmark")
+    args = parser.parse_args(argv)
+
+    if args.assign and args.assign_to is None:
+        parser.error("--assign needs --assign-to")
+
+    coupon_type = args.type or "mega"
+    engine = get_engine(args.database_url)
+    try:
+        if args.generate:
+            with engine.begin() as conn:
+                codes = generate_coupons(conn, args.generate, coupon_type, args.bonus, args.assign_to)
+            owner = f" for sub-admin {args.assign_to}" if args.assign_to else ""
+            print(f"✅ Created {len(codes):,} {coupon_type.upper()} coupons{owner}")
+            if args.csv:
+                with open(args.csv, "w", newline="") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(["code", "coupon_type", "assigned_to"])
+                    writer.writerows([code, coupon_type, args.assign_to] for code in codes)
+                print(f"📦 Codes written to {args.csv}")
+
+        if args.assign:
+            with engine.begin() as conn:
+                moved = assign_coupons(conn, args.assign_to, args.assign, coupon_type)
+            print(f"✅ Assigned {moved:,} {coupon_type.upper()} coupons to sub-admin {args.assign_to}")
+            if moved < args.assign:
+                print(f"⚠️  Only {moved:,} unassigned {coupon_type.upper()} coupons were available")
+
+        if args.export:
+            with engine.connect() as conn, open(args.export, "w", newline="") as f:
+                count = export_csv(conn, f, args.assign_to, args.status, args.type)
+            print(f"📦 Exported {count:,} coupons to {args.export}")
+
+        if args.benchmark:
+            r = run_benchmark(engine, args.count)
+            print(f"✅ Generated {args.count:,} codes in {r['generate_s']:.2f}s "
+                  f"({args.count / r['generate_s']:,.0f}/s), unique: {r['unique']} (rolled back)")
+            check = "✅" if r["winners"] == 1 else "❌"
+            print(f"{check} 16 concurrent redemptions of one code: {r['winners']} winner(s)")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
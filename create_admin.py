@@ -81,10 +81,10 @@ def create_admin_user(username, password, email=None, full_name=None):
         # Create balance for user
         user_balance = Balance(
             user_id=new_user.id,
-            main_balance=0.0,
-            activity_balance=0.0,
-            affiliate_balance=0.0,
-            total_balance=0.0
+            main_balance=0,
+            activity_balance=0,
+            affiliate_balance=0,
+            total_balance=0
         )
         db.add(user_balance)
         db.commit()
@@ -7,6 +7,8 @@ sys.path.insert(0, os.getcwd())
 
 from app.database import get_db
 from app.models import User, Balance
+from leaderboard import get_top_earners, print_top_earners, rebuild_leaderboard
+from money import format_naira, from_stored, money_scale, to_kobo, to_stored
 from datetime import datetime
 import random
 
@@ -25,14 +27,15 @@ def create_test_data():
         # Pick first 3 users to be top earners
         top_earners = users[:3]
         
-        # Set affiliate earnings for top earners
+        # Set affiliate earnings for top earners (naira or kobo, whichever balances holds)
+        scale = money_scale(db, "balances", "affiliate_balance")
         for idx, user in enumerate(top_earners):
             balance = db.query(Balance).filter(Balance.user_id == user.id).first()
             if balance:
                 # Set affiliate earnings (decreasing)
-                balance.affiliate_balance = 50000 - (idx * 10000)
+                balance.affiliate_balance = to_stored(to_kobo(50000 - (idx * 10000)), scale)
                 balance.total_balance = balance.main_balance + balance.affiliate_balance + balance.activity_balance
-                print(f"Updated {user.username}: ₦{balance.affiliate_balance:,.2f} affiliate earnings")
+                print(f"Updated {user.username}: {format_naira(from_stored(balance.affiliate_balance, scale))} affiliate earnings")
         
         # Create some referred users for the top earners
         for idx, referrer in enumerate(top_earners):
@@ -57,10 +60,10 @@ def create_test_data():
                 # Create balance for referred user
                 referred_balance = Balance(
                     user_id=referred_user.id,
-                    main_balance=0.0,
-                    affiliate_balance=0.0,
-                    activity_balance=0.0,
-                    total_balance=0.0
+                    main_balance=0,
+                    affiliate_balance=0,
+                    activity_balance=0,
+                    total_balance=0
                 )
                 db.add(referred_balance)
             
@@ -69,33 +72,12 @@ def create_test_data():
         db.commit()
         print("\n✅ Test data created successfully!")
         
-        # Show results
+        # Refresh the precomputed leaderboard and show results
+        rebuild_leaderboard(db)
+        db.commit()
+
         print("\n=== Current Top Earners ===")
-        from sqlalchemy import func
-        
-        referral_counts = db.query(
-            User.referral_code,
-            func.count(User.id).label('referral_count')
-        ).filter(
-            User.referred_by.isnot(None)
-        ).group_by(User.referral_code).subquery()
-        
-        top_users = db.query(
-            User.username,
-            User.full_name,
-            Balance.affiliate_balance,
-            func.coalesce(referral_counts.c.referral_count, 0).label('referral_count')
-        ).join(Balance).outerjoin(
-            referral_counts,
-            User.referral_code == referral_counts.c.referral_code
-        ).filter(
-            User.is_active == True
-        ).order_by(Balance.affiliate_balance.desc()).limit(10).all()
-        
-        print(f"\n{'Username':<20} {'Affiliate Earnings':<20} {'Referrals':<10}")
-        print("-" * 50)
-        for username, full_name, affiliate, referrals in top_users:
-            print(f"{username:<20} ₦{affiliate:<19,.2f} {referrals:<10}")
+        print_top_earners(get_top_earners(db, 10), scale)
         
     except Exception as e:
         db.rollback()
@@ -0,0 +1,241 @@
+"""
+Database connections: SQLite production profile, pooled readers, one writer
+
+Every script used to build its own engine with
+create_engine(DATABASE_URL, connect_args={"check_same_thread": False}) and
+SQLite's defaults: rollback journal (readers and the writer block each
+other), synchronous=FULL, a 2 MB page cache and no busy timeout beyond
+pysqlite's 5 s. Task claims, stream progress flushes and admin actions
+then serialize on the file lock and fail with "database is locked" -
+especially when a deferred transaction that has read tries to upgrade to a
+write lock, which SQLite reports immediately instead of waiting.
+
+For SQLite this module opens every connection with:
+
+    journal_mode=WAL        readers never block the writer and vice versa
+    synchronous=NORMAL      fsync at checkpoints, not every commit (safe in WAL)
+    mmap_size=256 MB        reads are served from the page cache mapping
+    cache_size=-32000       32 MB page cache per connection
+    temp_store=MEMORY       sorts/temp b-trees stay off disk
+    busy_timeout=15000      wait up to 15 s for the lock instead of failing
+
+and splits the engines by role:
+
+    get_engine()       the writer: ONE pooled connection (pool_size=1), and
+                       every transaction starts with BEGIN IMMEDIATE, so
+                       writers queue on the pool in-process instead of
+                       racing for the file lock; DDL is transactional too
+    get_read_engine()  READ_POOL_SIZE pooled connections with
+                       PRAGMA query_only=ON, for list pages, exports and
+                       reports; in WAL they run alongside the writer
+
+Engines are cached per URL, so the app and its background threads (audit
+writer, stream flusher) share the one writer. Other databases get a plain
+pooled engine (pool_pre_ping) and, for Postgres, read-only transactions on
+the read engine.
+
+Backend wiring (backend/app/database.py):
+
+    from database import get_engine, get_read_engine
+
+    engine = get_engine()
+    SessionLocal = sessionmaker(bind=engine, autoflush=False)
+    ReadSessionLocal = sessionmaker(bind=get_read_engine(), autoflush=False)
+
+Usage:
+    python database.py --pragmas
+    python database.py --benchmark --readers 8 --writers 4 --seconds 5 --database-url sqlite:////tmp/perf.db   # use a copy
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+
+DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///backend/affluence.db')
+
+READ_POOL_SIZE = 8
+BUSY_TIMEOUT_MS = 15000
+
+SQLITE_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("mmap_size", 256 * 1024 * 1024),
+    ("cache_size", -32000),
+    ("temp_store", "MEMORY"),
+    ("busy_timeout", BUSY_TIMEOUT_MS),
+)
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def _tune_sqlite(engine, begin, pragmas, readonly=False):
+    """Apply the connection pragmas and take over transaction control from pysqlite"""
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        # pysqlite would otherwise BEGIN lazily (and never before DDL); SQLAlchemy's
+        # begin event below issues BEGIN itself so every transaction is explicit
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute(f"PRAGMA {name} = {value}")
+        if readonly:
+            cursor.execute("PRAGMA query_only = ON")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def on_begin(conn):
+        conn.exec_driver_sql(begin)
+
+    return engine
+
+
+def _create(url, role, tuned=True):
+    if not url.startswith('sqlite'):
+        engine = create_engine(url, pool_pre_ping=True)
+        if role == "read" and url.startswith('postgresql'):
+            engine = engine.execution_options(postgresql_readonly=True)
+        return engine
+    if not tuned:
+        # What every script used to do
+        return create_engine(url, connect_args={"check_same_thread": False})
+    connect_args = {"check_same_thread": False, "timeout": BUSY_TIMEOUT_MS / 1000.0}
+    if role == "write":
+        engine = create_engine(url, connect_args=connect_args, pool_size=1, max_overflow=0, pool_timeout=60)
+        return _tune_sqlite(engine, "BEGIN IMMEDIATE", SQLITE_PRAGMAS)
+    engine = create_engine(url, connect_args=connect_args, pool_size=READ_POOL_SIZE, max_overflow=0)
+    return _tune_sqlite(engine, "BEGIN", SQLITE_PRAGMAS, readonly=True)
+
+
+def _cached(url, role):
+    url = url or DATABASE_URL
+    with _engines_lock:
+        if (url, role) not in _engines:
+            _engines[(url, role)] = _create(url, role)
+        return _engines[(url, role)]
+
+
+def get_engine(database_url=None):
+    """The writer engine for a URL (defaults to DATABASE_URL); use it for anything that writes"""
+    return _cached(database_url, "write")
+
+
+def get_read_engine(database_url=None):
+    """The pooled read-only engine for a URL; writes through it fail"""
+    return _cached(database_url, "read")
+
+
+def format_timestamp(value):
+    # Same text layout SQLAlchemy's DateTime uses on SQLite, so ordering and
+    # comparisons behave exactly like the legacy system_logs.created_at
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def pragmas(engine):
+    """{pragma: current value} as seen by a connection of the engine"""
+    names = [name for name, _ in SQLITE_PRAGMAS] + ["query_only"]
+    with engine.connect() as conn:
+        return {name: conn.exec_driver_sql(f"PRAGMA {name}").scalar() for name in names}
+
+
+# -- benchmark ---------------------------------------------------------------
+
+def _reader(engine, user_ids, stop, counts, rng):
+    while not stop.is_set():
+        try:
+            with engine.connect() as conn:
+                user_id = rng.choice(user_ids)
+                conn.execute(text("SELECT total_balance FROM balances WHERE user_id = :user_id"),
+                             {"user_id": user_id}).scalar()
+                conn.execute(text("SELECT id, amount FROM transactions WHERE user_id = :user_id "
+                                  "ORDER BY created_at DESC LIMIT 20"), {"user_id": user_id}).all()
+            counts["reads"] += 1
+        except OperationalError:
+            counts["read_errors"] += 1
+
+
+def _writer(engine, user_ids, stop, counts, rng):
+    """A claim-sized write: read the balance, then update it, in one transaction"""
+    while not stop.is_set():
+        try:
+            with engine.begin() as conn:
+                user_id = rng.choice(user_ids)
+                conn.execute(text("SELECT updated_at FROM balances WHERE user_id = :user_id"),
+                             {"user_id": user_id}).scalar()
+                conn.execute(text("UPDATE balances SET updated_at = CURRENT_TIMESTAMP WHERE user_id = :user_id"),
+                             {"user_id": user_id})
+            counts["writes"] += 1
+        except OperationalError:
+            counts["write_errors"] += 1
+
+
+def run_benchmark(url, readers, writers, seconds, tuned):
+    if tuned:
+        read_engine, write_engine = _create(url, "read"), _create(url, "write")
+    else:
+        read_engine = write_engine = _create(url, "write", tuned=False)
+        with write_engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode = DELETE")
+    with read_engine.connect() as conn:
+        user_ids = [row[0] for row in conn.execute(text("SELECT user_id FROM balances LIMIT 5000"))]
+
+    counts = {"reads": 0, "writes": 0, "read_errors": 0, "write_errors": 0}
+    stop = threading.Event()
+    threads = [threading.Thread(target=_reader, args=(read_engine, user_ids, stop, counts, random.Random(n)))
+               for n in range(readers)]
+    threads += [threading.Thread(target=_writer, args=(write_engine, user_ids, stop, counts, random.Random(100 + n)))
+                for n in range(writers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    read_engine.dispose()
+    write_engine.dispose()
+    return {key: value / seconds if not key.endswith("errors") else value for key, value in counts.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SQLite connection profile and read/write concurrency benchmark")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--pragmas', action='store_true', help="Show the pragmas of the writer and reader connections")
+    parser.add_argument('--benchmark', action='store_true', help="Compare default vs tuned connections under concurrent load")
+    parser.add_argument('--readers', type=int, default=8, help="Reader threads")
+    parser.add_argument('--writers', type=int, default=4, help="Writer threads")
+    parser.add_argument('--seconds', type=float, default=5.0, help="Duration of each run")
+    args = parser.parse_args(argv)
+
+    url = args.database_url or DATABASE_URL
+    try:
+        if args.pragmas:
+            for label, engine in (("writer", get_engine(url)), ("reader", get_read_engine(url))):
+                print(f"{label}: " + ", ".join(f"{k}={v}" for k, v in pragmas(engine).items()))
+        elif args.benchmark:
+            if not url.startswith('sqlite'):
+                print("❌ The benchmark compares SQLite connection settings; pass a sqlite:/// URL")
+                return 2
+            print(f"{args.readers} readers + {args.writers} writers, {args.seconds:.0f}s per run\n")
+            for label, tuned in (("default", False), ("WAL + reader pool + one writer", True)):
+                r = run_benchmark(url, args.readers, args.writers, args.seconds, tuned)
+                print(f"{label:<32} reads {r['reads']:8,.0f}/s  writes {r['writes']:6,.0f}/s  "
+                      f"errors: {r['read_errors']} read, {r['write_errors']} write")
+        else:
+            parser.print_help()
+            return 1
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
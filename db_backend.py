@@ -0,0 +1,177 @@
+"""
+Dialect-aware data access: PostgreSQL fast paths with SQLite fallbacks
+
+The scripts were written against SQLite (sqlite_master, strftime, PRAGMA,
+row-level triggers) while the backend can also run on PostgreSQL, where
+they fail. Code that needs dialect-specific SQL asks the backend for the
+connection instead of hard-coding either:
+
+    from db_backend import backend_for
+
+    backend = backend_for(conn)
+    backend.bulk_insert(conn, "coupons", columns, rows)   # COPY on Postgres
+    conn.execute(text(backend.upsert_sql("table_versions", ["table_name", "version"], ["table_name"])), rows)
+    conn.execute(text(f"SELECT id FROM withdrawals WHERE status = 'PENDING' "
+                      f"ORDER BY created_at LIMIT :n{backend.skip_locked()}"), {"n": 50})
+
+What each backend does:
+
+                        PostgreSQL                          SQLite
+    bulk_insert         COPY ... FROM STDIN (csv)           executemany
+    upsert_sql          INSERT ... ON CONFLICT              same (3.24+), else INSERT OR IGNORE/REPLACE
+    skip_locked         FOR UPDATE SKIP LOCKED              nothing: BEGIN IMMEDIATE already
+                                                            serializes writers (database.py)
+    materialized views  yes (leaderboard.py)                no: incrementally maintained table
+    month_key           to_char(col, 'YYYYMM')              strftime('%Y%m', col)
+    serial_pk           BIGSERIAL PRIMARY KEY               INTEGER PRIMARY KEY
+    table_names         information_schema (via inspect)    sqlite_master (via inspect)
+
+Other databases get the generic Backend (portable SQL only). A new dialect
+is supported by subclassing Backend and calling register_backend().
+"""
+import csv
+import io
+import sqlite3
+
+from sqlalchemy import inspect, text
+
+COPY_CHUNK_ROWS = 10000
+COPY_NULL = r"\N"
+
+
+class Backend:
+    """Portable SQL; subclasses override what their database does better"""
+
+    name = "generic"
+    supports_materialized_views = False
+    serial_pk = "INTEGER PRIMARY KEY"
+
+    def table_names(self, conn, prefix=None):
+        names = inspect(connection_of(conn)).get_table_names()
+        return sorted(n for n in names if prefix is None or n.startswith(prefix))
+
+    def has_table(self, conn, name):
+        return inspect(connection_of(conn)).has_table(name)
+
+    def materialized_view_names(self, conn):
+        return []
+
+    def month_key(self, column):
+        """SQL for the 'YYYYMM' of a timestamp column"""
+        return f"CAST(EXTRACT(YEAR FROM {column}) * 100 + EXTRACT(MONTH FROM {column}) AS INTEGER)"
+
+    def skip_locked(self):
+        """Suffix for a SELECT that claims rows for processing"""
+        return ""
+
+    def upsert_sql(self, table, columns, key, update=None):
+        """INSERT of :columns that updates `update` (default: all non-key columns) on a key conflict
+
+        update=() inserts only rows whose key is new (DO NOTHING).
+        """
+        update = [c for c in columns if c not in key] if update is None else list(update)
+        values = ", ".join(f":{c}" for c in columns)
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({values}) ON CONFLICT ({', '.join(key)}) "
+        if not update:
+            return sql + "DO NOTHING"
+        return sql + "DO UPDATE SET " + ", ".join(f"{c} = excluded.{c}" for c in update)
+
+    def bulk_insert(self, conn, table, columns, rows):
+        """Insert an iterable of dicts in the caller's transaction; returns the row count"""
+        statement = text(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})")
+        count = 0
+        for batch in _batches(rows, COPY_CHUNK_ROWS):
+            conn.execute(statement, batch)
+            count += len(batch)
+        return count
+
+
+class SQLiteBackend(Backend):
+    name = "sqlite"
+
+    def month_key(self, column):
+        return f"strftime('%Y%m', {column})"
+
+    def upsert_sql(self, table, columns, key, update=None):
+        if sqlite3.sqlite_version_info >= (3, 24, 0):
+            return super().upsert_sql(table, columns, key, update)
+        # Before 3.24: REPLACE deletes and re-inserts, fine for the derived tables that use this
+        verb = "INSERT OR IGNORE" if update == () else "INSERT OR REPLACE"
+        return f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})"
+
+
+class PostgresBackend(Backend):
+    name = "postgresql"
+    supports_materialized_views = True
+    serial_pk = "BIGSERIAL PRIMARY KEY"
+
+    def materialized_view_names(self, conn):
+        return inspect(connection_of(conn)).get_materialized_view_names()
+
+    def month_key(self, column):
+        return f"to_char({column}, 'YYYYMM')"
+
+    def skip_locked(self):
+        return " FOR UPDATE SKIP LOCKED"
+
+    def bulk_insert(self, conn, table, columns, rows):
+        """COPY FROM STDIN in CSV chunks; falls back to executemany on drivers without COPY"""
+        cursor = connection_of(conn).connection.driver_connection.cursor()
+        copy_expert = getattr(cursor, "copy_expert", None)  # psycopg2
+        copy = getattr(cursor, "copy", None)  # psycopg 3
+        if copy_expert is None and copy is None:
+            cursor.close()
+            return super().bulk_insert(conn, table, columns, rows)
+        sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+        count = 0
+        try:
+            for batch in _batches(rows, COPY_CHUNK_ROWS):
+                data = _csv(batch, columns)
+                if copy_expert is not None:
+                    copy_expert(sql, io.StringIO(data))
+                else:
+                    with copy(sql) as pipe:
+                        pipe.write(data)
+                count += len(batch)
+        finally:
+            cursor.close()
+        return count
+
+
+BACKENDS = {"sqlite": SQLiteBackend(), "postgresql": PostgresBackend()}
+_generic = Backend()
+
+
+def register_backend(dialect_name, backend):
+    BACKENDS[dialect_name] = backend
+
+
+def backend_for(bind):
+    """The Backend for a Connection, Session or Engine"""
+    if hasattr(bind, "get_bind"):
+        bind = bind.get_bind()
+    return BACKENDS.get(bind.dialect.name, _generic)
+
+
+def connection_of(bind):
+    """The Connection behind a Session (in its current transaction), or the bind itself"""
+    return bind.connection() if hasattr(bind, "get_bind") else bind
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _csv(batch, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for row in batch:
+        writer.writerow([COPY_NULL if row[c] is None else row[c] for c in columns])
+    return buffer.getvalue()
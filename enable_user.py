@@ -14,6 +14,8 @@ sys.path.insert(0, str(backend_dir))
 
 from app.database import SessionLocal
 from app.models.user import User
+from db_backend import backend_for
+from leaderboard import record_user_active
 
 def set_user_active(username: str, active: bool = True):
     db = SessionLocal()
@@ -24,6 +26,9 @@ def set_user_active(username: str, active: bool = True):
             return 1
         prev = user.is_active
         user.is_active = active
+        db.flush()
+        if backend_for(db).has_table(db, "leaderboard"):
+            record_user_active(db, user.id, active)
         db.commit()
         state = 'ENABLED' if active else 'DISABLED'
         print(f"✅ {state} user '{username}' (was: {'ENABLED' if prev else 'DISABLED'})")
@@ -1,66 +1,189 @@
-"""Fix user balances where total doesn't match activity + affiliate"""
-import sys
+"""Fix user balances where total is larger than activity + affiliate
+
+The orphaned amount (total - activity - affiliate) is moved into
+activity_balance. Balances are read in one streaming pass over
+balances JOIN users (no per-row user lookup), the orphaned amounts are
+computed in SQL, and the correction is a single set-based UPDATE in the same
+transaction. Every change is written to a CSV or JSONL audit file.
+
+Usage:
+    python fix_orphaned_balances.py [--dry-run] [--audit changes.csv] [--database-url URL]
+"""
+import argparse
+import csv
+import json
 import os
+import sys
+from datetime import datetime
+
+from sqlalchemy import text
+
+from balance_reconciliation import has_version
+from database import get_engine
+from money import format_naira, from_stored, money_scale, stored_tolerance
+
+TOLERANCE = 0  # kobo: any orphaned amount is real (half a kobo of float noise on naira columns)
+STREAM_BATCH_SIZE = 10000
+
+ORPHANED = "(COALESCE(b.total_balance, 0) - COALESCE(b.activity_balance, 0) - COALESCE(b.affiliate_balance, 0))"
+
+ORPHANED_ROWS_SQL = text(f"""
+    SELECT b.id AS balance_id, b.user_id, u.username,
+           b.activity_balance, b.affiliate_balance, b.total_balance,
+           {ORPHANED} AS orphaned
+    FROM balances b
+    LEFT JOIN users u ON u.id = b.user_id
+    WHERE {ORPHANED} > :tolerance
+    ORDER BY b.id
+""")
+
+FIX_SQL = f"""
+    UPDATE balances AS b
+    SET activity_balance = COALESCE(b.activity_balance, 0) + {ORPHANED},{{bump}}
+        updated_at = CURRENT_TIMESTAMP
+    WHERE {ORPHANED} > :tolerance
+"""
+
+
+def fix_sql(versioned):
+    """The fix statement, bumping balances.version only where migration 8 installed it"""
+    return text(FIX_SQL.format(bump="\n        version = version + 1," if versioned else ""))
+
+AUDIT_FIELDS = [
+    "balance_id", "user_id", "username", "orphaned",
+    "activity_before", "activity_after", "affiliate_balance", "total_balance",
+]
+
+
+class AuditWriter:
+    """Writes one audit record per change, as CSV or JSONL depending on the file extension
+
+    Records go to a temporary file next to `path`; publish() moves it into
+    place once the changes it describes are committed, discard() removes it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.format = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+        self._tmp_path = path + '.tmp'
+        self._file = open(self._tmp_path, 'w', encoding='utf-8', newline='')
+        self._csv = None
+        if self.format == 'csv':
+            self._csv = csv.DictWriter(self._file, fieldnames=AUDIT_FIELDS)
+            self._csv.writeheader()
+
+    def write(self, record):
+        if self._csv:
+            self._csv.writerow(record)
+        else:
+            self._file.write(json.dumps(record) + "\n")
 
-os.chdir('backend')
-sys.path.insert(0, os.getcwd())
-
-from app.database import get_db
-from app.models import Balance, User
-
-db = next(get_db())
-
-try:
-    # Get all balances
-    balances = db.query(Balance).all()
-    
-    print("=== Current Balances ===")
-    print(f"{'User ID':<10} {'Username':<15} {'Activity':<12} {'Affiliate':<12} {'Total':<12} {'Expected':<12}")
-    print("-" * 85)
-    
-    for balance in balances:
-        user = db.query(User).filter(User.id == balance.user_id).first()
-        expected = balance.activity_balance + balance.affiliate_balance
-        username = user.username if user else "N/A"
-        
-        print(f"{balance.user_id:<10} {username:<15} ₦{balance.activity_balance:<11.2f} ₦{balance.affiliate_balance:<11.2f} ₦{balance.total_balance:<11.2f} ₦{expected:<11.2f}")
-    
-    # Fix balances where total > activity + affiliate
-    print("\n=== Fixing Orphaned Totals ===")
+    def publish(self):
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+def audit_record(row):
+    activity = row.activity_balance or 0
+    return {
+        "balance_id": row.balance_id,
+        "user_id": row.user_id,
+        "username": row.username or "N/A",
+        "orphaned": row.orphaned,
+        "activity_before": activity,
+        "activity_after": activity + row.orphaned,
+        "affiliate_balance": row.affiliate_balance or 0,
+        "total_balance": row.total_balance or 0,
+    }
+
+
+def fix_orphaned_balances(engine, audit_path, dry_run=False, tolerance=TOLERANCE,
+                          batch_size=STREAM_BATCH_SIZE, preview=10):
+    """Stream orphaned balances into the audit file, then fix them in one UPDATE
+
+    Returns (found, fixed, orphaned_total). The UPDATE uses the same predicate
+    as the streamed SELECT inside one transaction; if its row count differs
+    from the audited count (rows changed concurrently) the transaction is
+    rolled back and the audit file is discarded, so it never disagrees with
+    the database. `tolerance` and orphaned_total are kobo; the audit file
+    holds the amounts as stored (naira until migrate_money_to_kobo.py ran).
+    """
+    audit = AuditWriter(audit_path)
+    found = 0
     fixed = 0
-    for balance in balances:
-        expected = balance.activity_balance + balance.affiliate_balance
-        orphaned = balance.total_balance - expected
-        
-        if orphaned > 0.01:  # Has orphaned money
-            user = db.query(User).filter(User.id == balance.user_id).first()
-            print(f"\nUser {balance.user_id} ({user.username if user else 'N/A'}):")
-            print(f"  Orphaned amount: ₦{orphaned:.2f}")
-            print(f"  Moving to activity balance...")
-            
-            balance.activity_balance += orphaned
-            # Total stays the same (it's already correct)
-            fixed += 1
-    
-    if fixed > 0:
-        db.commit()
-        print(f"\n✅ Fixed {fixed} balance(s)")
-        
-        print("\n=== Updated Balances ===")
-        print(f"{'User ID':<10} {'Username':<15} {'Activity':<12} {'Affiliate':<12} {'Total':<12}")
-        print("-" * 73)
-        
-        for balance in db.query(Balance).all():
-            user = db.query(User).filter(User.id == balance.user_id).first()
-            username = user.username if user else "N/A"
-            print(f"{balance.user_id:<10} {username:<15} ₦{balance.activity_balance:<11.2f} ₦{balance.affiliate_balance:<11.2f} ₦{balance.total_balance:<11.2f}")
-    else:
+    orphaned_total = 0
+
+    try:
+        with engine.begin() as conn:
+            scale = money_scale(conn, "balances", "total_balance")
+            tolerance = stored_tolerance(tolerance, scale)
+            result = conn.execution_options(yield_per=batch_size).execute(
+                ORPHANED_ROWS_SQL, {"tolerance": tolerance}
+            )
+            for partition in result.partitions():
+                for row in partition:
+                    record = audit_record(row)
+                    audit.write(record)
+                    found += 1
+                    orphaned_total += from_stored(row.orphaned, scale)
+                    if found <= preview:
+                        print(f"User {record['user_id']} ({record['username']}): "
+                              f"orphaned {format_naira(from_stored(row.orphaned, scale))} → activity")
+            if found > preview:
+                print(f"... and {found - preview:,} more (see {audit_path})")
+
+            if not dry_run and found:
+                fixed = conn.execute(fix_sql(has_version(conn)), {"tolerance": tolerance}).rowcount
+                if fixed != found:
+                    raise RuntimeError(
+                        f"Balances changed during the run ({fixed} updated vs {found} audited); rolled back, please re-run"
+                    )
+    except BaseException:
+        # Nothing was changed, so there is nothing to audit
+        audit.discard()
+        raise
+    # Only after the commit: the audit file lists changes that really happened
+    audit.publish()
+    return found, fixed, orphaned_total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move orphaned total_balance amounts into activity_balance")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--dry-run', action='store_true', help="Write the audit file without changing balances")
+    parser.add_argument('--audit', default=None, help="Audit file path (.csv or .jsonl, default: timestamped .jsonl)")
+    parser.add_argument('--batch-size', type=int, default=STREAM_BATCH_SIZE, help="Rows fetched per streaming batch")
+    args = parser.parse_args(argv)
+
+    audit_path = os.path.abspath(
+        args.audit or f"orphaned_balances_audit_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+    )
+
+    print("=== Fixing Orphaned Totals ===")
+    try:
+        found, fixed, orphaned_total = fix_orphaned_balances(
+            get_engine(args.database_url), audit_path, dry_run=args.dry_run, batch_size=args.batch_size
+        )
+    except Exception as e:
+        print(f"Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+    if found == 0:
         print("\n✅ All balances are correct!")
-        
-except Exception as e:
-    db.rollback()
-    print(f"Error: {e}")
-    import traceback
-    traceback.print_exc()
-finally:
-    db.close()
+    elif args.dry_run:
+        print(f"\nDry run: {found:,} balance(s) with {format_naira(orphaned_total)} orphaned, nothing changed")
+    else:
+        print(f"\n✅ Fixed {fixed:,} balance(s), moved {format_naira(orphaned_total)} to activity balance")
+    print(f"Audit file: {audit_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,354 @@
+"""
+Synthetic large-scale dataset generator for affluence.db performance testing
+
+Builds a production-sized SQLite database (same schema as affluence.db) so
+index, query and reconciliation changes can be benchmarked locally:
+
+  - users with a preferential-attachment referral tree (a few big referrers,
+    a long tail) and signups skewed towards recent days and daytime hours
+  - balances that agree with the generated transactions ledger
+    (optionally with injected drift for the reconciliation tools)
+  - transactions, user_tasks, streams, withdrawals, coupons and notifications
+
+The run is deterministic for a given --seed. Rows are bulk-loaded with
+executemany in chunks under load-time PRAGMAs (no journal, no fsync).
+
+Usage:
+    python generate_test_dataset.py perf.db --users 1000000
+    python generate_test_dataset.py perf.db --users 200000 --with-indexes --drift-rate 0.01 --force
+    python migrate_money_to_kobo.py --database-url sqlite:///perf.db   # amounts are generated in naira
+"""
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+from array import array
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from migrate_add_indexes import index_statements
+
+SCHEMA_TEMPLATE = Path(__file__).parent / "affluence.db"
+CHUNK_SIZE = 50000
+PASSWORD_HASH = "$2b$12$dummy_hash_for_testing"
+
+REFERRAL_BONUS = 1000.0
+TASK_REWARDS = [200.0, 500.0, 700.0, 1000.0, 2000.0]
+STREAM_REWARDS = [50.0, 100.0, 150.0]
+# Relative signup/activity weight per hour of day (quiet at night, busy in the evening)
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 2, 3, 5, 6, 7, 7, 7, 8, 8, 7, 7, 8, 9, 10, 10, 9, 7, 4, 2]
+
+# Store datetimes the way SQLAlchemy's SQLite DATETIME type does (the implicit
+# sqlite3 adapter is deprecated as of Python 3.12)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+
+
+class Generator:
+    def __init__(self, conn, args):
+        self.conn = conn
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.end = datetime(2025, 10, 23)
+        self.start = self.end - timedelta(days=args.days)
+        self.hours = list(range(24))
+        self.hour_weights = list(itertools.accumulate(HOUR_WEIGHTS))
+        self.counts = {}
+        # Per-user running balances, indexed by user id
+        self.activity = array('d', [0.0]) * (args.users + 1)
+        self.affiliate = array('d', [0.0]) * (args.users + 1)
+        self.signup = []
+
+    # -- helpers -------------------------------------------------------------
+
+    def timestamp(self, after, days_span=None):
+        """A time after `after`, within days_span days, on a weighted hour of day"""
+        span = days_span if days_span is not None else max((self.end - after).days, 0)
+        day = after.date() + timedelta(days=self.rng.randint(0, span)) if span else after.date()
+        hour = self.rng.choices(self.hours, cum_weights=self.hour_weights)[0]
+        moment = datetime(day.year, day.month, day.day, hour, self.rng.randint(0, 59), self.rng.randint(0, 59))
+        return max(moment, after) if moment <= self.end else self.end
+
+    def insert(self, table, columns, rows):
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        batch = []
+        total = 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= CHUNK_SIZE:
+                self.conn.executemany(sql, batch)
+                total += len(batch)
+                batch.clear()
+        if batch:
+            self.conn.executemany(sql, batch)
+            total += len(batch)
+        self.counts[table] = self.counts.get(table, 0) + total
+        return total
+
+    # -- generators ----------------------------------------------------------
+
+    def signup_times(self):
+        """Sorted signup times, skewed towards the end of the window (growth)"""
+        offsets = sorted(self.rng.random() ** 0.5 for _ in range(self.args.users))
+        seconds = self.args.days * 86400
+        self.signup = [self.start + timedelta(seconds=int(o * seconds)) for o in offsets]
+
+    def users(self, referrers):
+        """Users in signup order; referrers drawn by preferential attachment"""
+        # Every user appears once, plus once per referral made -> P(pick) ~ degree
+        pool = []
+        for user_id in range(1, self.args.users + 1):
+            created = self.signup[user_id - 1]
+            referrer = None
+            if pool and self.rng.random() < self.args.referral_rate:
+                referrer = pool[self.rng.randrange(len(pool))]
+                pool.append(referrer)
+            pool.append(user_id)
+            referrers[user_id] = referrer or 0
+            yield (
+                user_id, f"user{user_id}", f"user{user_id}@example.com", f"Test User {user_id}",
+                f"080{self.rng.randint(10000000, 99999999)}", PASSWORD_HASH,
+                f"AFF{user_id:08d}", f"AFF{referrer:08d}" if referrer else None,
+                f"CPN{user_id:09d}", "USER", 1, 1, created,
+            )
+
+    def referral_transactions(self, referrers):
+        for user_id in range(1, self.args.users + 1):
+            referrer = referrers[user_id]
+            if referrer:
+                self.affiliate[referrer] += REFERRAL_BONUS
+                yield (referrer, "CREDIT", REFERRAL_BONUS, "REFERRAL",
+                       f"Referral bonus for user{user_id}", f"REF-{user_id}", self.signup[user_id - 1])
+
+    def task_activity(self, task_ids):
+        """user_tasks rows; claimed ones are credited via self.task_credits"""
+        self.task_credits = []
+        avg = self.args.tasks_per_user
+        for user_id in range(1, self.args.users + 1):
+            joined = self.signup[user_id - 1]
+            for _ in range(self.rng.randint(0, 2 * avg)):
+                task_id, amount = self.rng.choice(task_ids)
+                taken = self.timestamp(joined)
+                status = self.rng.choices(["CLAIMED", "COMPLETED", "TAKEN"], weights=[80, 10, 10])[0]
+                completed = taken + timedelta(minutes=self.rng.randint(1, 30)) if status != "TAKEN" else None
+                claimed = completed + timedelta(minutes=self.rng.randint(0, 120)) if status == "CLAIMED" else None
+                if claimed:
+                    self.activity[user_id] += amount
+                    self.task_credits.append((user_id, amount, claimed))
+                yield (user_id, task_id, status, taken, completed, claimed)
+
+    def stream_activity(self, audio_ids):
+        self.stream_credits = []
+        avg = self.args.streams_per_user
+        for user_id in range(1, self.args.users + 1):
+            joined = self.signup[user_id - 1]
+            for _ in range(self.rng.randint(0, 2 * avg)):
+                audio_id, duration, amount = self.rng.choice(audio_ids)
+                started = self.timestamp(joined)
+                status = self.rng.choices(["CLAIMED", "COMPLETED", "STARTED"], weights=[75, 10, 15])[0]
+                listened = duration if status != "STARTED" else self.rng.randint(0, duration - 1)
+                completed = started + timedelta(seconds=duration) if status != "STARTED" else None
+                claimed = completed + timedelta(minutes=self.rng.randint(0, 60)) if status == "CLAIMED" else None
+                if claimed:
+                    self.activity[user_id] += amount
+                    self.stream_credits.append((user_id, amount, claimed))
+                yield (user_id, audio_id, listened, amount, status, started, completed, claimed)
+
+    def activity_transactions(self):
+        for user_id, amount, at in self.task_credits:
+            yield (user_id, "CREDIT", amount, "ACTIVITY", "Task reward", None, at)
+        for user_id, amount, at in self.stream_credits:
+            yield (user_id, "CREDIT", amount, "ACTIVITY", "Stream reward", None, at)
+
+    def withdrawals(self):
+        """Withdrawals (and their debits) for users with enough balance"""
+        self.withdrawal_debits = []
+        for user_id in range(1, self.args.users + 1):
+            if self.rng.random() >= self.args.withdrawal_rate:
+                continue
+            for balances, balance_type in ((self.activity, "ACTIVITY"), (self.affiliate, "REFERRAL")):
+                available = balances[user_id]
+                if available < 1000:
+                    continue
+                amount = float(int(available * self.rng.uniform(0.3, 0.9)))
+                created = self.timestamp(self.signup[user_id - 1])
+                status = self.rng.choices(["APPROVED", "PENDING", "REJECTED"], weights=[70, 20, 10])[0]
+                processed = created + timedelta(hours=self.rng.randint(1, 72)) if status != "PENDING" else None
+                if status != "REJECTED":
+                    balances[user_id] -= amount
+                    self.withdrawal_debits.append((user_id, amount, balance_type, created))
+                yield (user_id, amount, balance_type, status, None, created, processed)
+
+    def withdrawal_transactions(self):
+        for user_id, amount, balance_type, at in self.withdrawal_debits:
+            yield (user_id, "DEBIT", amount, balance_type, "Withdrawal", None, at)
+
+    def coupons(self):
+        """One used registration coupon per user plus an unused pool assigned to sub-admins"""
+        subadmins = max(1, self.args.users // 10000)
+        for user_id in range(1, self.args.users + 1):
+            used_at = self.signup[user_id - 1]
+            yield (f"CPN{user_id:09d}", None, user_id, "USED", self.rng.choice([500.0, 2000.0]),
+                   used_at - timedelta(days=self.rng.randint(0, 7)), used_at)
+        for n in range(self.args.users // 5):
+            yield (f"NEW{n:09d}", self.rng.randint(1, subadmins), None, "UNUSED", self.rng.choice([500.0, 2000.0]),
+                   self.timestamp(self.end - timedelta(days=30), 30), None)
+
+    def notifications(self):
+        avg = self.args.notifications_per_user
+        kinds = ["task", "withdrawal", "referral", "announcement"]
+        for user_id in range(1, self.args.users + 1):
+            joined = self.signup[user_id - 1]
+            for _ in range(self.rng.randint(0, 2 * avg)):
+                kind = self.rng.choice(kinds)
+                yield (user_id, f"{kind.title()} update", f"You have a new {kind} notification",
+                       kind, self.rng.random() < 0.7, self.timestamp(joined))
+
+    def balances(self):
+        drift_rate = self.args.drift_rate
+        for user_id in range(1, self.args.users + 1):
+            activity = self.activity[user_id]
+            affiliate = self.affiliate[user_id]
+            total = activity + affiliate
+            if drift_rate and self.rng.random() < drift_rate:
+                total += self.rng.choice([-500.0, 250.0, 1000.0])
+            yield (user_id, 0.0, affiliate, activity, total, self.end)
+
+    # -- driver --------------------------------------------------------------
+
+    def run(self):
+        step = self.step
+        step("catalog", self.catalog)
+        step("signup times", self.signup_times)
+        referrers = array('i', [0]) * (self.args.users + 1)
+        step("users", lambda: self.insert("users", [
+            "id", "username", "email", "full_name", "phone", "password_hash", "referral_code",
+            "referred_by", "coupon_code", "role", "is_active", "is_verified", "created_at"], self.users(referrers)))
+        txn_cols = ["user_id", "type", "amount", "balance_type", "description", "reference", "created_at"]
+        step("referral credits", lambda: self.insert("transactions", txn_cols, self.referral_transactions(referrers)))
+        step("user_tasks", lambda: self.insert("user_tasks", [
+            "user_id", "task_id", "status", "taken_at", "completed_at", "claimed_at"], self.task_activity(self.task_ids)))
+        step("streams", lambda: self.insert("streams", [
+            "user_id", "audio_id", "duration_listened", "amount", "status", "started_at", "completed_at", "claimed_at"],
+            self.stream_activity(self.audio_ids)))
+        step("activity credits", lambda: self.insert("transactions", txn_cols, self.activity_transactions()))
+        self.task_credits = self.stream_credits = None
+        step("withdrawals", lambda: self.insert("withdrawals", [
+            "user_id", "amount", "balance_type", "status", "admin_note", "created_at", "processed_at"], self.withdrawals()))
+        step("withdrawal debits", lambda: self.insert("transactions", txn_cols, self.withdrawal_transactions()))
+        step("balances", lambda: self.insert("balances", [
+            "user_id", "main_balance", "affiliate_balance", "activity_balance", "total_balance", "updated_at"], self.balances()))
+        step("coupons", lambda: self.insert("coupons", [
+            "code", "assigned_to", "used_by", "status", "bonus_amount", "created_at", "used_at"], self.coupons()))
+        step("notifications", lambda: self.insert("notifications", [
+            "user_id", "title", "message", "notification_type", "is_read", "created_at"], self.notifications()))
+
+    def catalog(self):
+        self.task_ids = []
+        for task_id in range(1, 51):
+            amount = self.rng.choice(TASK_REWARDS)
+            self.conn.execute(
+                "INSERT INTO tasks (id, title, description, amount, link, task_type, icon, is_active, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)",
+                (task_id, f"Task {task_id}", "Generated task", amount, f"https://example.com/t/{task_id}",
+                 self.rng.choice(["link", "text", "image"]), "fa-tasks", self.start),
+            )
+            self.task_ids.append((task_id, amount))
+        self.audio_ids = []
+        for audio_id in range(1, 31):
+            duration = self.rng.randint(120, 300)
+            amount = self.rng.choice(STREAM_REWARDS)
+            self.conn.execute(
+                "INSERT INTO audios (id, title, artist, duration_seconds, amount, is_active, created_at) "
+                "VALUES (?, ?, ?, ?, ?, 1, ?)",
+                (audio_id, f"Track {audio_id}", f"Artist {audio_id % 7}", duration, amount, self.start),
+            )
+            self.audio_ids.append((audio_id, duration, amount))
+        self.counts["tasks"] = len(self.task_ids)
+        self.counts["audios"] = len(self.audio_ids)
+
+    def step(self, label, fn):
+        started = time.perf_counter()
+        result = fn()
+        self.conn.commit()
+        rows = f"{result:,} rows, " if isinstance(result, int) else ""
+        print(f"  ✓ {label:<18} {rows}{time.perf_counter() - started:.1f}s")
+
+
+def create_schema(conn, template):
+    """Copy table and index definitions from the template database"""
+    source = sqlite3.connect(template)
+    try:
+        statements = [row[0] for row in source.execute(
+            "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY CASE type WHEN 'table' THEN 0 ELSE 1 END"
+        )]
+    finally:
+        source.close()
+    for sql in statements:
+        conn.execute(sql)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a large, deterministic affluence.db for benchmarking")
+    parser.add_argument('output', help="Path of the SQLite database to create")
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--days', type=int, default=365, help="Length of the signup window")
+    parser.add_argument('--referral-rate', type=float, default=0.7, help="Share of users who signed up with a referral code")
+    parser.add_argument('--tasks-per-user', type=int, default=8, help="Average user_tasks rows per user")
+    parser.add_argument('--streams-per-user', type=int, default=5, help="Average streams rows per user")
+    parser.add_argument('--notifications-per-user', type=int, default=4)
+    parser.add_argument('--withdrawal-rate', type=float, default=0.3, help="Share of users who withdraw")
+    parser.add_argument('--drift-rate', type=float, default=0.0, help="Share of balances with a wrong total_balance")
+    parser.add_argument('--schema-from', default=str(SCHEMA_TEMPLATE), help="Database to copy the schema from")
+    parser.add_argument('--with-indexes', action='store_true', help="Also create the migrate_add_indexes.py indexes")
+    parser.add_argument('--force', action='store_true', help="Overwrite the output file if it exists")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.output):
+        if not args.force:
+            print(f"❌ {args.output} already exists (use --force to overwrite)")
+            return 1
+        os.remove(args.output)
+
+    print(f"=== Generating {args.users:,} users into {args.output} (seed {args.seed}) ===")
+    started = time.perf_counter()
+    conn = sqlite3.connect(args.output)
+    try:
+        # Load-time tuning: this is a throwaway file until the run completes
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA cache_size = -262144")  # 256 MiB
+
+        create_schema(conn, args.schema_from)
+        generator = Generator(conn, args)
+        generator.run()
+
+        if args.with_indexes:
+            index_started = time.perf_counter()
+            for sql in index_statements():
+                conn.execute(sql)
+            conn.commit()
+            print(f"  ✓ {'secondary indexes':<18} {time.perf_counter() - index_started:.1f}s")
+
+        conn.execute("ANALYZE")
+        conn.commit()
+        conn.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        conn.close()
+
+    print("\n=== Row counts ===")
+    for table, count in generator.counts.items():
+        print(f"{table:<15} {count:>12,}")
+    size_mb = os.path.getsize(args.output) / (1024 * 1024)
+    print(f"\n✅ Done in {time.perf_counter() - started:.1f}s ({size_mb:,.1f} MiB)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,18 @@
+"""
+HTTP validator helpers shared by the static server and the API
+
+serve_frontend.py (static files) and table_versions.py (API conditional
+GET) both answer If-None-Match; this module has no dependencies so either
+side can import it without pulling in the other.
+"""
+
+
+def etag_matches(header, etag):
+    """True if an If-None-Match header value matches `etag`"""
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    candidates = [tag.strip() for tag in header.split(',')]
+    # If-None-Match uses weak comparison
+    return any(tag[2:] == etag if tag.startswith('W/') else tag == etag for tag in candidates)
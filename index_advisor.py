@@ -0,0 +1,188 @@
+"""
+Index advisor for affluence.db
+
+Runs EXPLAIN QUERY PLAN over a catalogue of the queries the app issues on its
+hot paths (dashboard, referrals, tasks, streams, admin lists, top earners) and
+flags full table scans and temporary sort b-trees. Scans of tables smaller
+than --min-rows are reported but not flagged: the planner rightly prefers
+them there, so point the advisor at a production-sized database.
+
+Usage:
+    python index_advisor.py [--database-url sqlite:///backend/affluence.db] [--json]
+
+Exits with status 1 if any query does a full table scan, so it can run in CI
+after migrate_add_indexes.py.
+"""
+import argparse
+import json
+import re
+import sys
+
+from sqlalchemy import text
+
+from database import DATABASE_URL, get_read_engine
+
+# name -> (sql, sample params). Enum columns hold the enum names (e.g. 'PENDING').
+QUERY_CATALOGUE = {
+    "dashboard.balance": (
+        "SELECT * FROM balances WHERE user_id = :user_id",
+        {"user_id": 1},
+    ),
+    "dashboard.recent_transactions": (
+        "SELECT * FROM transactions WHERE user_id = :user_id ORDER BY created_at DESC LIMIT 10",
+        {"user_id": 1},
+    ),
+    "dashboard.referral_earnings": (
+        "SELECT SUM(amount) FROM transactions WHERE user_id = :user_id AND balance_type = 'REFERRAL'",
+        {"user_id": 1},
+    ),
+    "dashboard.unread_notifications": (
+        "SELECT COUNT(*) FROM notifications WHERE user_id = :user_id AND is_read = 0",
+        {"user_id": 1},
+    ),
+    "users.referrals": (
+        "SELECT id, username, full_name, created_at FROM users WHERE referred_by = :code ORDER BY created_at DESC",
+        {"code": "REF12345"},
+    ),
+    "users.top_earners": (
+        """
+        SELECT users.username, users.full_name, balances.affiliate_balance
+        FROM balances JOIN users ON users.id = balances.user_id
+        WHERE users.is_active = 1
+        ORDER BY balances.affiliate_balance DESC LIMIT 20
+        """,
+        {},
+    ),
+    "tasks.user_task": (
+        "SELECT * FROM user_tasks WHERE user_id = :user_id AND task_id = :task_id AND status = 'TAKEN'",
+        {"user_id": 1, "task_id": 1},
+    ),
+    "tasks.my_tasks": (
+        "SELECT * FROM user_tasks WHERE user_id = :user_id",
+        {"user_id": 1},
+    ),
+    "streams.active": (
+        "SELECT * FROM streams WHERE user_id = :user_id AND status = 'STARTED'",
+        {"user_id": 1},
+    ),
+    "withdrawals.user_history": (
+        "SELECT * FROM withdrawals WHERE user_id = :user_id ORDER BY created_at DESC LIMIT 50",
+        {"user_id": 1},
+    ),
+    "admin.pending_withdrawals": (
+        "SELECT * FROM withdrawals WHERE status = 'PENDING' ORDER BY created_at DESC LIMIT 50",
+        {},
+    ),
+    "admin.logs": (
+        "SELECT * FROM system_logs ORDER BY created_at DESC LIMIT 50",
+        {},
+    ),
+    "admin.transactions_since": (
+        "SELECT * FROM transactions WHERE created_at >= :since ORDER BY created_at",
+        {"since": "2025-01-01"},
+    ),
+    # Keyset pages (keyset_pagination.py): must stay index seeks at any depth
+    "admin.withdrawals_page": (
+        "SELECT * FROM withdrawals WHERE status = 'PENDING' AND (created_at, id) < (:k0, :k1) ORDER BY created_at DESC, id DESC LIMIT 51",
+        {"k0": "2030-01-01", "k1": 0},
+    ),
+    "admin.logs_page": (
+        "SELECT * FROM system_logs WHERE (created_at, id) < (:k0, :k1) ORDER BY created_at DESC, id DESC LIMIT 51",
+        {"k0": "2030-01-01", "k1": 0},
+    ),
+    "admin.transactions_page": (
+        "SELECT * FROM transactions WHERE (created_at, id) < (:k0, :k1) ORDER BY created_at DESC, id DESC LIMIT 51",
+        {"k0": "2030-01-01", "k1": 0},
+    ),
+    "admin.coupons_page": (
+        "SELECT * FROM coupons WHERE status = 'UNUSED' AND id < :k0 ORDER BY id DESC LIMIT 51",
+        {"k0": 10 ** 9},
+    ),
+    "subadmin.coupons": (
+        "SELECT * FROM coupons WHERE assigned_to = :admin_id AND status = 'UNUSED'",
+        {"admin_id": 1},
+    ),
+}
+
+DEFAULT_MIN_ROWS = 1000
+
+FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?!.*\bUSING\b)")
+TEMP_SORT = re.compile(r"USE TEMP B-TREE")
+
+
+def explain(conn, sql, params):
+    """Return the EXPLAIN QUERY PLAN detail lines for one query"""
+    rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params).fetchall()
+    return [row[-1] for row in rows]
+
+
+def analyze_plan(plan):
+    """Return (full_scans, temp_sorts) found in a query plan"""
+    scans = [m.group(1) for m in (FULL_SCAN.match(line) for line in plan) if m]
+    sorts = [line for line in plan if TEMP_SORT.search(line)]
+    return scans, sorts
+
+
+def is_small_table(conn, table, min_rows):
+    """True if the table has fewer than min_rows rows (counts at most min_rows)"""
+    count = conn.execute(text(f"SELECT COUNT(*) FROM (SELECT 1 FROM {table} LIMIT :n)"), {"n": min_rows}).scalar()
+    return count < min_rows
+
+
+def run_advisor(engine, catalogue=QUERY_CATALOGUE, min_rows=DEFAULT_MIN_ROWS):
+    results = []
+    with engine.connect() as conn:
+        for name, (sql, params) in catalogue.items():
+            plan = explain(conn, " ".join(sql.split()), params)
+            scans, sorts = analyze_plan(plan)
+            flagged = [table for table in scans if not is_small_table(conn, table, min_rows)]
+            results.append({
+                "query": name,
+                "plan": plan,
+                "full_scans": scans,
+                "temp_sorts": sorts,
+                "ok": not flagged,
+            })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Flag full table scans in the app's hot queries")
+    parser.add_argument('--database-url', default=None, help="SQLite database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--min-rows', type=int, default=DEFAULT_MIN_ROWS, help="Ignore full scans of tables smaller than this")
+    parser.add_argument('--json', action='store_true', help="Print machine-readable results")
+    args = parser.parse_args(argv)
+
+    url = args.database_url or DATABASE_URL
+    if not url.startswith('sqlite'):
+        print("❌ The index advisor uses SQLite's EXPLAIN QUERY PLAN; pass a sqlite:/// URL")
+        return 2
+    engine = get_read_engine(url)
+
+    results = run_advisor(engine, min_rows=args.min_rows)
+    flagged = [r for r in results if not r["ok"]]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("=== Index Advisor ===\n")
+        for r in results:
+            status = "✅" if r["ok"] else "❌"
+            if r["ok"] and r["full_scans"]:
+                status = "⚠️ "
+            print(f"{status} {r['query']}")
+            for line in r["plan"]:
+                print(f"     {line}")
+            for table in r["full_scans"]:
+                print(f"     → full table scan on {table}" + ("" if not r["ok"] else " (small table)"))
+            if r["temp_sorts"]:
+                print("     → sorts in a temp b-tree (no index covers the ORDER BY)")
+        print(f"\n{len(results) - len(flagged)}/{len(results)} queries use an index")
+        if flagged:
+            print("Run: python migrate_add_indexes.py")
+
+    return 1 if flagged else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
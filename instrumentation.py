@@ -0,0 +1,446 @@
+"""
+Request and SQL instrumentation with a Prometheus /api/metrics endpoint
+
+/api/health only says the process is up. This module records what the
+backend is actually doing:
+
+  - per-route latency histograms (route template, method, status)
+  - per-request SQL statement counts and SQL time, via SQLAlchemy engine
+    events, so an N+1 loop shows up as a route with 400 statements
+  - a slow-query log (logger "affluence.slow_query") with the statement,
+    the shape of its bound parameters (types and lengths, not values: they
+    include password hashes, tokens and emails) and the route that issued
+    it; install(..., log_params=True) logs the values on a trusted box
+  - an opt-in sampling profiler: an admin adding ?profile=1 to any request
+    gets a folded stack dump (flamegraph.pl / speedscope format) instead of
+    the response body. The sampler sees the whole process, not one request:
+    a sync endpoint runs on a threadpool thread that is not known in
+    advance, and async endpoints share the event loop thread, so concurrent
+    requests show up in the dump too (X-Profile-Scope: process). Profile on
+    an otherwise idle worker.
+
+Backend wiring (main.py, after the routers are included):
+
+    from instrumentation import install
+    install(app, engine, is_admin_request=lambda request: admin_from_bearer(request) is not None)
+
+is_admin_request may be a plain function (it is run in the threadpool, as it
+usually queries the database) or an async one (awaited).
+
+GET /api/metrics returns the Prometheus text format; restrict it to the
+scraper at the proxy if the API is public.
+
+Usage (no server needed - instruments a database and prints the exposition):
+    python instrumentation.py --database-url sqlite:////tmp/perf.db --demo
+"""
+import argparse
+import contextvars
+import inspect
+import logging
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from urllib.parse import parse_qs
+
+from sqlalchemy import event, text
+
+from database import get_engine
+
+SLOW_QUERY_SECONDS = 0.2
+PROFILE_INTERVAL = 0.001
+MAX_LOGGED_PARAMS = 500  # characters of bound parameters kept in the slow-query log
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Leaf frames of threads that are just waiting; left out of profiles
+IDLE_FUNCTIONS = {"wait", "select", "poll", "_worker", "get", "accept", "_wait_for_tstate_lock", "sleep"}
+
+slow_query_log = logging.getLogger("affluence.slow_query")
+
+
+class RequestStats:
+    """SQL work done on behalf of one request (shared with its worker thread)"""
+
+    __slots__ = ("route", "statements", "sql_seconds")
+
+    def __init__(self, route):
+        self.route = route
+        self.statements = 0
+        self.sql_seconds = 0.0
+
+
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a label tuple"""
+
+    def __init__(self, name, help, label_names, buckets):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            base = _labels(self.label_names, labels)
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="+Inf"}} {values[-1]}')
+            lines.append(f"{_series(self.name + '_sum', base)} {values[-2]:.6f}")
+            lines.append(f"{_series(self.name + '_count', base)} {values[-1]}")
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name, help, label_names):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            lines.append(f"{_series(self.name, _labels(self.label_names, labels))} {value}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _series(name, labels):
+    return f"{name}{{{labels}}}" if labels else name
+
+
+class Metrics:
+    def __init__(self):
+        self.request_seconds = Histogram(
+            "http_request_duration_seconds", "Request latency by route", ("method", "route", "status"), LATENCY_BUCKETS)
+        self.request_statements = Histogram(
+            "db_statements_per_request", "SQL statements issued per request", ("route",), STATEMENT_BUCKETS)
+        self.request_sql_seconds = Histogram(
+            "db_time_per_request_seconds", "Time spent in SQL per request", ("route",), LATENCY_BUCKETS)
+        self.statement_seconds = Histogram(
+            "db_statement_duration_seconds", "Duration of individual SQL statements", (), LATENCY_BUCKETS)
+        self.slow_queries = CounterMetric(
+            "db_slow_queries_total", f"Statements slower than {SLOW_QUERY_SECONDS}s", ("route",))
+        self.collectors = []  # other modules' metrics (anything with exposition() -> lines)
+
+    def register(self, collector):
+        self.collectors.append(collector)
+        return collector
+
+    def exposition(self):
+        lines = []
+        for metric in (self.request_seconds, self.request_statements, self.request_sql_seconds,
+                       self.statement_seconds, self.slow_queries, *self.collectors):
+            lines.extend(metric.exposition())
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+# -- SQL ---------------------------------------------------------------------
+
+def _redact(value):
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (str, bytes)):
+        return f"<{type(value).__name__}:{len(value)}>"
+    return f"<{type(value).__name__}>"
+
+
+def redact_parameters(parameters, executemany=False):
+    """Bound parameters with every string replaced by its type and length"""
+    if executemany:
+        return f"<{len(parameters)} rows>"
+    if isinstance(parameters, dict):
+        return {key: _redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [_redact(value) for value in parameters]
+    return _redact(parameters)
+
+
+def instrument_engine(engine, registry=None, slow_seconds=SLOW_QUERY_SECONDS, log_params=False):
+    """Time every statement on `engine` and attribute it to the current request
+
+    Slow statements are logged with redacted parameters unless `log_params`.
+    """
+    registry = registry or metrics
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        registry.statement_seconds.observe((), elapsed)
+        stats = current_request.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.sql_seconds += elapsed
+        if elapsed >= slow_seconds:
+            route = stats.route if stats else "-"
+            registry.slow_queries.inc((route,))
+            params = parameters if log_params else redact_parameters(parameters, executemany)
+            slow_query_log.warning("%.3fs %s | %s | params=%s", elapsed, route,
+                                   " ".join(statement.split()), repr(params)[:MAX_LOGGED_PARAMS])
+
+    return engine
+
+
+# -- sampling profiler -------------------------------------------------------
+
+class SamplingProfiler:
+    """Samples every thread's stack each `interval` seconds into folded-stack counts (process-wide)"""
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me or frame.f_code.co_name in IDLE_FUNCTIONS:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def folded(self):
+        """flamegraph.pl input: 'outer;inner;leaf count' per line, heaviest first"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+# -- ASGI middleware ---------------------------------------------------------
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def route_label(scope):
+    """Route template (/api/tasks/{task_id}) so label cardinality stays bounded"""
+    route = scope.get("route")
+    if route is not None and getattr(route, "path", None):
+        return scope.get("root_path", "") + route.path
+    return _ID_SEGMENT.sub("/{id}", scope.get("path", ""))
+
+
+def wants_profile(scope):
+    """True when the query string has profile=1 (not xprofile=1 or profile=10)"""
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    return query.get("profile", [""])[-1] == "1"
+
+
+class InstrumentationMiddleware:
+    """Pure ASGI middleware: latency/SQL metrics for every request, ?profile=1 for admins"""
+
+    def __init__(self, app, registry=None, is_admin_request=None):
+        self.app = app
+        self.registry = registry or metrics
+        self.is_admin_request = is_admin_request
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats(route_label(scope))
+        token = current_request.set(stats)
+        status = {"code": 500}
+        profiler = None
+        if self.is_admin_request is not None and wants_profile(scope):
+            from starlette.concurrency import run_in_threadpool
+            from starlette.requests import Request
+            if inspect.iscoroutinefunction(self.is_admin_request):
+                is_admin = await self.is_admin_request(Request(scope))
+            else:
+                # Usually a token check against the database; keep it off the event loop
+                is_admin = await run_in_threadpool(self.is_admin_request, Request(scope))
+            if is_admin:
+                profiler = SamplingProfiler().start()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            if profiler is None:
+                await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_request.reset(token)
+            route = route_label(scope)  # the router has resolved the template by now
+            self.registry.request_seconds.observe((scope["method"], route, str(status["code"])), elapsed)
+            self.registry.request_statements.observe((route,), stats.statements)
+            self.registry.request_sql_seconds.observe((route,), stats.sql_seconds)
+
+        if profiler is not None:
+            profiler.stop()
+            body = profiler.folded().encode("utf-8")
+            await send({"type": "http.response.start", "status": 200, "headers": [
+                (b"content-type", b"text/plain; charset=utf-8"),
+                (b"x-profile-samples", str(profiler.samples).encode()),
+                (b"x-profile-scope", b"process"),
+                (b"x-original-status", str(status["code"]).encode()),
+                (b"x-sql-statements", str(stats.statements).encode()),
+            ]})
+            await send({"type": "http.response.body", "body": body})
+
+
+def create_router(registry=None):
+    """FastAPI router exposing GET /metrics in the Prometheus text format"""
+    from fastapi import APIRouter
+    from fastapi.responses import PlainTextResponse
+
+    registry = registry or metrics
+    router = APIRouter()
+
+    @router.get("/metrics")
+    def prometheus_metrics():
+        return PlainTextResponse(registry.exposition(), media_type="text/plain; version=0.0.4")
+
+    return router
+
+
+def install(app, engine, is_admin_request=None, registry=None, log_params=False):
+    """Instrument the engine, add the middleware and mount /api/metrics"""
+    registry = registry or metrics
+    instrument_engine(engine, registry, log_params=log_params)
+    app.add_middleware(InstrumentationMiddleware, registry=registry, is_admin_request=is_admin_request)
+    app.include_router(create_router(registry), prefix="/api")
+    return registry
+
+
+# -- demo --------------------------------------------------------------------
+
+DEMO_ROUTES = {
+    "/api/users/dashboard": [
+        "SELECT * FROM users WHERE id = :user_id",
+        "SELECT * FROM balances WHERE user_id = :user_id",
+        "SELECT COUNT(*) FROM users WHERE referred_by = (SELECT referral_code FROM users WHERE id = :user_id)",
+        "SELECT * FROM transactions WHERE user_id = :user_id ORDER BY created_at DESC LIMIT 10",
+    ],
+    "/api/users/top-earners": [
+        "SELECT u.username, b.affiliate_balance FROM users u JOIN balances b ON b.user_id = u.id "
+        "ORDER BY b.affiliate_balance DESC LIMIT 20",
+    ],
+    "/api/admin/transactions": [
+        "SELECT balance_type, SUM(amount) FROM transactions GROUP BY balance_type",
+    ],
+}
+
+
+def run_demo(engine, requests=20):
+    """Replay a few backend-shaped requests through the SQL hooks and return the metrics"""
+    registry = Metrics()
+    instrument_engine(engine, registry)
+    for i in range(requests):
+        for route, statements in DEMO_ROUTES.items():
+            stats = RequestStats(route)
+            token = current_request.set(stats)
+            started = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    for sql in statements:
+                        conn.execute(text(sql), {"user_id": i + 1}).all()
+            finally:
+                current_request.reset(token)
+            registry.request_seconds.observe(("GET", route, "200"), time.perf_counter() - started)
+            registry.request_statements.observe((route,), stats.statements)
+            registry.request_sql_seconds.observe((route,), stats.sql_seconds)
+    return registry
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show the metrics exposition for a replay of backend queries")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--demo', action='store_true', help="Replay sample requests and print /api/metrics")
+    parser.add_argument('--requests', type=int, default=20, help="Replays per route")
+    parser.add_argument('--profile', action='store_true', help="Also print a folded-stack profile of the replay")
+    args = parser.parse_args(argv)
+
+    if not args.demo:
+        parser.print_help()
+        return 0
+
+    logging.basicConfig(level=logging.WARNING, format="%(name)s %(message)s")
+    engine = get_engine(args.database_url)
+    try:
+        profiler = SamplingProfiler().start() if args.profile else None
+        registry = run_demo(engine, args.requests)
+        if profiler is not None:
+            profiler.stop()
+        print(registry.exposition())
+        if profiler is not None:
+            print(f"📦 {profiler.samples} samples; heaviest stacks:")
+            for line in profiler.folded().splitlines()[:5]:
+                stack, count = line.rsplit(" ", 1)
+                print(f"   {count:>5}  ...{stack[-110:]}")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -229,6 +229,74 @@ const adminAPI = {
     updateClickToEarnTask: async (data) => { return await api.put(adminPath(`/click-to-earn`), data); }
 };
 
+// Cursor (keyset) pages for the long lists: each resolves to { items, next_cursor }.
+// Pass next_cursor back as `after` for the next page; it is null on the last one.
+// With `skip` (or from a backend without cursors) they resolve to a bare array.
+// `search` matches the withdrawal id, username or email on the server (keyset_pagination.py).
+adminAPI.getWithdrawalsPage = async (after = null, limit = 50, status = null, skip = null, search = null) => {
+    try {
+        return await api.get(adminPath(`/withdrawals${cursorQuery(after, limit, { status, search }, skip)}`));
+    } catch (error) {
+        showBackendConnectionError(error);
+        throw error;
+    }
+};
+adminAPI.getLogsPage = async (after = null, limit = 50, action = null, skip = null) => {
+    return await api.get(adminPath(`/logs${cursorQuery(after, limit, { action }, skip)}`));
+};
+adminAPI.getUsersPage = async (after = null, limit = 100, role = null, skip = null) => {
+    return await api.get(adminPath(`/users${cursorQuery(after, limit, { role }, skip)}`));
+};
+adminAPI.getCouponsPage = async (after = null, limit = 100, status = null, skip = null) => {
+    return await api.get(adminPath(`/coupons${cursorQuery(after, limit, { status }, skip)}`));
+};
+/**
+ * Generate a pool of coupons in one request (see coupon_engine.py)
+ * @param {{count: number, coupon_type: string, assigned_to?: number}} batch
+ * @returns {Promise<{created: number, codes: string[]}>} rejects with status 404/405 on
+ *   backends without the bulk endpoint, so callers can fall back to createCoupon()
+ */
+adminAPI.bulkCreateCoupons = async (batch) => {
+    try {
+        return await api.post(adminPath(`/coupons/bulk`), batch);
+    } catch (error) {
+        if (error.status !== 404 && error.status !== 405) showBackendConnectionError(error);
+        throw error;
+    }
+};
+/**
+ * URL of a streaming report export (see admin_export.py). A plain link starts the
+ * download, so its query string carries a short-lived, single-use export token
+ * fetched for this report - never the admin's bearer token.
+ * @param {string} name - users | withdrawals | transactions | coupons | logs
+ * @param {Object} options - format ('csv' | 'ndjson'), gzip, since, until, search and column filters
+ * @returns {Promise<string>} rejects with status 404/405 on backends without the export endpoints
+ */
+adminAPI.exportUrl = async (name, options = {}) => {
+    const { token } = await api.post(adminPath(`/export/${name}/token`), {});
+    const params = new URLSearchParams({ token, format: options.format || 'csv' });
+    Object.entries(options).forEach(([key, value]) => {
+        if (key === 'format' || value === null || value === undefined || value === '') return;
+        params.set(key, typeof value === 'boolean' ? (value ? '1' : '0') : value);
+    });
+    return `${api.baseURL}${adminPath(`/export/${name}`)}?${params.toString()}`;
+};
+
+/**
+ * Start a streaming export download; the browser writes it straight to disk
+ */
+adminAPI.downloadExport = async (name, options = {}) => {
+    const link = document.createElement('a');
+    link.href = await adminAPI.exportUrl(name, options);
+    link.rel = 'noopener';
+    document.body.appendChild(link);
+    link.click();
+    document.body.removeChild(link);
+};
+adminAPI.getTransactionsPage = async (after = null, limit = 100, filters = {}, skip = null) => {
+    return await api.get(adminPath(`/transactions${cursorQuery(after, limit, filters, skip)}`));
+};
+
 // Regular task management
 adminAPI.getTasks = async (skip = 0, limit = 100) => {
     try {
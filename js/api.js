@@ -52,8 +52,72 @@ const API_CONFIG = {
     RETRY_COUNT: 2,
     REFRESH_TOKEN_URL: '/auth/refresh',
     STORAGE_KEY: 'affluence_token',
+    CACHE_STORAGE_KEY: 'affluence_response_cache',
+    CACHE_MAX_ENTRIES: 50,
 };
 
+/**
+ * Conditional-GET response cache
+ * Keeps GET bodies with their ETag in memory and localStorage so repeat
+ * reads send If-None-Match and reuse the body on 304 Not Modified.
+ * Entries are keyed by URL and by the current token, so users never see
+ * each other's data.
+ */
+class ResponseCache {
+    constructor(storageKey = API_CONFIG.CACHE_STORAGE_KEY, maxEntries = API_CONFIG.CACHE_MAX_ENTRIES) {
+        this.storageKey = storageKey;
+        this.maxEntries = maxEntries;
+        this.entries = new Map();
+        try {
+            const stored = JSON.parse(localStorage.getItem(storageKey) || '[]');
+            stored.forEach(([key, entry]) => this.entries.set(key, entry));
+        } catch (e) {
+            // Corrupt or unavailable storage just means a cold cache
+        }
+    }
+
+    key(url, token) {
+        // Short non-cryptographic fingerprint; the token itself is not stored twice
+        let hash = 5381;
+        const value = token || '';
+        for (let i = 0; i < value.length; i++) hash = ((hash << 5) + hash + value.charCodeAt(i)) | 0;
+        return `${hash >>> 0}|${url}`;
+    }
+
+    get(key) {
+        const entry = this.entries.get(key);
+        if (!entry) return null;
+        // Refresh recency
+        this.entries.delete(key);
+        this.entries.set(key, entry);
+        return entry;
+    }
+
+    set(key, etag, data) {
+        this.entries.delete(key);
+        // Store a copy: the caller keeps (and may mutate) the original
+        this.entries.set(key, { etag, data: JSON.parse(JSON.stringify(data)) });
+        while (this.entries.size > this.maxEntries) {
+            this.entries.delete(this.entries.keys().next().value);
+        }
+        this.persist();
+    }
+
+    clear() {
+        this.entries.clear();
+        try { localStorage.removeItem(this.storageKey); } catch (e) { /* ignore */ }
+    }
+
+    persist() {
+        try {
+            localStorage.setItem(this.storageKey, JSON.stringify([...this.entries]));
+        } catch (e) {
+            // Quota exceeded: keep the in-memory copy only
+            console.warn('[api.js] Could not persist response cache:', e);
+        }
+    }
+}
+
 /**
  * Affluence API Client
  */
@@ -63,6 +127,7 @@ class AffluenceAPI {
         this.baseURL = detectApiBase();
         this.token = null;
         this.debug = API_CONFIG.DEBUG;
+        this.cache = new ResponseCache();
         
         // Try to restore token from localStorage
         this.token = this.getToken();
@@ -106,6 +171,7 @@ class AffluenceAPI {
      */
     removeToken() { 
         this.token = null; 
+        this.cache.clear();
         try { 
             localStorage.removeItem('affluence_token'); 
             if (this.debug) console.log('[api.js] Token removed from localStorage');
@@ -249,6 +315,15 @@ class AffluenceAPI {
             headers['Authorization'] = `Bearer ${this.getToken()}`;
         }
         
+        // Revalidate cached GET responses instead of downloading them again
+        const method = (options.method || 'GET').toUpperCase();
+        const cacheable = method === 'GET' && !options.noCache && !options.rawResponse && options.responseType !== 'blob';
+        const cacheKey = cacheable ? this.cache.key(url, headers['Authorization']) : null;
+        const cached = cacheKey ? this.cache.get(cacheKey) : null;
+        if (cached) {
+            headers['If-None-Match'] = cached.etag;
+        }
+        
         const config = {
             ...options,
             headers,
@@ -286,6 +361,12 @@ class AffluenceAPI {
                 return response;
             }
             
+            if (response.status === 304 && cached) {
+                if (this.debug) console.log(`[api.js] Not modified, using cached response for ${url}`);
+                // Hand out a copy so callers cannot mutate the cached body
+                return JSON.parse(JSON.stringify(cached.data));
+            }
+            
             // Parse JSON for all other requests
             let data;
             try {
@@ -306,6 +387,11 @@ class AffluenceAPI {
                 throw error;
             }
             
+            const etag = cacheKey ? response.headers.get('ETag') : null;
+            if (etag) {
+                this.cache.set(cacheKey, etag, data);
+            }
+            
             return data;
         } catch (err) {
             clearTimeout(timeoutId);
@@ -876,6 +962,17 @@ class AffluenceAPI {
         }
     }
     
+    /**
+     * Get one cursor page of withdrawal history (newest first)
+     * @param {string|null} after - next_cursor from the previous page, or null for the first page
+     * @param {number} limit - Page size
+     * @param {number|null} skip - Row offset instead of a cursor (see CursorPager)
+     * @returns {Promise<{items: Array, next_cursor: string|null}|Array>}
+     */
+    async getWithdrawalsPage(after = null, limit = 20, skip = null) {
+        return this.get(`/withdrawals/${cursorQuery(after, limit, {}, skip)}`);
+    }
+    
     /**
      * Generate mock withdrawal history data for development purposes
      * @private
@@ -963,6 +1060,287 @@ class AffluenceAPI {
 // Create global API instance
 const api = new AffluenceAPI();
 
+/**
+ * Build the query string for a cursor-paginated list
+ * @param {string|null} after - Opaque next_cursor from the previous page
+ * @param {number} limit - Page size
+ * @param {Object} filters - Extra equality filters; empty values are skipped
+ * @param {number|null} skip - Row offset, for backends without cursors and for jumping to a page
+ * @returns {string} e.g. "?limit=50&after=eyJs...&status=pending"
+ */
+function cursorQuery(after, limit, filters = {}, skip = null) {
+    const params = new URLSearchParams({ limit: String(limit) });
+    if (after) params.set('after', after);
+    if (skip !== null && skip !== undefined) params.set('skip', String(skip));
+    Object.entries(filters).forEach(([key, value]) => {
+        if (value !== null && value !== undefined && value !== '') params.set(key, value);
+    });
+    return `?${params.toString()}`;
+}
+
+/**
+ * Infinite scroll over a cursor-paginated endpoint (see keyset_pagination.py)
+ * fetchPage(after, skip) resolves to { items, next_cursor } from a backend with
+ * cursors, or from one without them (the legacy ?skip= list) to a bare array
+ * or an envelope such as { logs, total }; on those the pager keeps paging by
+ * offset. onItems(items, first) is called per page; first is true when the
+ * list should be replaced.
+ */
+const LEGACY_LIST_KEYS = ['logs', 'withdrawals', 'transactions', 'users', 'coupons', 'data', 'results'];
+
+function legacyListOf(page) {
+    if (Array.isArray(page)) return page;
+    const key = page && LEGACY_LIST_KEYS.find(k => Array.isArray(page[k]));
+    return key ? page[key] : null;
+}
+
+class CursorPager {
+    constructor(fetchPage, onItems, pageSize = null) {
+        this.fetchPage = fetchPage;
+        this.onItems = onItems;
+        this.pageSize = pageSize;
+        this.after = null;
+        this.byOffset = false;
+        this.start = 0;
+        this.offset = 0;
+        this.done = false;
+        this.loading = false;
+        this.generation = 0;
+        this.observer = null;
+    }
+
+    /** Start again from the newest rows (e.g. after a filter change) */
+    reset() {
+        return this.seek(0, false);
+    }
+
+    /** Start from row `offset` (jump to a page); later pages continue by offset */
+    seek(offset, byOffset = true) {
+        this.after = null;
+        this.byOffset = byOffset;
+        this.start = offset;
+        this.offset = offset;
+        this.done = false;
+        this.loading = false;
+        this.generation++;
+        return this.loadMore();
+    }
+
+    async loadMore() {
+        if (this.loading || this.done) return;
+        const generation = this.generation;
+        const first = this.after === null && this.offset === this.start;
+        this.loading = true;
+        try {
+            const page = await this.fetchPage(this.after, this.byOffset ? this.offset : null);
+            // A reset while this page was in flight makes it stale
+            if (generation !== this.generation) return;
+            let items;
+            const legacy = page && Array.isArray(page.items) ? null : legacyListOf(page);
+            if (legacy) {
+                // No cursors from this backend: continue with ?skip=
+                items = legacy;
+                this.byOffset = true;
+                this.after = null;
+                this.done = items.length === 0 || (this.pageSize !== null && items.length < this.pageSize)
+                    || (typeof page.total === 'number' && this.offset + items.length >= page.total);
+            } else {
+                items = (page && page.items) || [];
+                this.after = (page && page.next_cursor) || null;
+                this.done = !this.after;
+            }
+            this.offset += items.length;
+            this.onItems(items, first);
+        } finally {
+            if (generation === this.generation) this.loading = false;
+        }
+    }
+
+    /** Load the next page whenever `sentinel` scrolls into view */
+    observe(sentinel) {
+        if (!sentinel || typeof IntersectionObserver === 'undefined') return;
+        if (this.observer) this.observer.disconnect();
+        this.observer = new IntersectionObserver((entries) => {
+            if (entries.some(e => e.isIntersecting)) {
+                this.loadMore().catch(err => console.error('[api.js] Loading next page failed:', err));
+            }
+        }, { rootMargin: '200px' });
+        this.observer.observe(sentinel);
+    }
+}
+
+/**
+ * Server-push channel (Server-Sent Events from /api/events, see push_channel.py)
+ *
+ * Pages subscribe to events with on(type, handler) and register their refresh
+ * function with watch(poll, intervalMs). The poll functions only run on a
+ * timer while the stream is down, and once after a reconnect to catch up on
+ * anything missed. If the stream keeps failing (e.g. a host without streaming
+ * support) the channel gives up and polling simply continues.
+ *
+ * EventSource cannot send an Authorization header, so each connection first
+ * trades the JWT for a short-lived, single-use stream token (POST
+ * /events/token) and only that token goes into the URL. Because the token
+ * cannot be replayed, reconnects are done here with a fresh token rather
+ * than by EventSource itself.
+ */
+const PUSH_CONFIG = {
+    ENDPOINT: '/events',
+    EVENT_TYPES: ['balance', 'task', 'notification', 'leaderboard', 'resync'],
+    MAX_FAILURES: 3,
+    RETRY_MS: 5000,
+};
+
+class PushChannel {
+    constructor(client) {
+        this.client = client;
+        this.source = null;
+        this.handlers = {};
+        this.watchers = [];
+        this.connected = false;
+        this.everConnected = false;
+        this.failures = 0;
+        this.disabled = false;
+        this.connecting = false;
+        this.retryTimer = null;
+        this.generation = 0;
+    }
+
+    /**
+     * Register a handler for a pushed event type
+     * @param {string} type - balance | task | notification | leaderboard | resync
+     * @param {Function} handler - Called with the parsed event data
+     */
+    on(type, handler) {
+        (this.handlers[type] = this.handlers[type] || []).push(handler);
+        this.connect();
+        return this;
+    }
+
+    /**
+     * Register a polling fallback; it only runs while push is unavailable
+     * @param {Function} poll - Async function that reloads the page's data
+     * @param {number} intervalMs - Polling interval used while disconnected
+     */
+    watch(poll, intervalMs) {
+        const watcher = { poll, intervalMs, timer: null };
+        this.watchers.push(watcher);
+        if (!this.connected) this._startPolling(watcher);
+        this.connect();
+        return watcher;
+    }
+
+    connect() {
+        if (this.source || this.connecting || this.disabled) return;
+        if (typeof EventSource === 'undefined' || !this.client.isAuthenticated()) {
+            this.disabled = true;
+            return;
+        }
+
+        const generation = this.generation;
+        this.connecting = true;
+        this.client.post(`${PUSH_CONFIG.ENDPOINT}/token`, {})
+            .then(({ token }) => {
+                // close() was called while the token was being fetched
+                if (generation === this.generation) this._open(token);
+            })
+            .catch(() => this._failed())
+            .finally(() => { this.connecting = false; });
+    }
+
+    _open(token) {
+        const url = `${this.client.baseURL}${PUSH_CONFIG.ENDPOINT}?token=${encodeURIComponent(token)}`;
+        const source = new EventSource(url);
+        this.source = source;
+
+        source.onopen = () => {
+            const reconnected = this.everConnected;
+            this.connected = true;
+            this.everConnected = true;
+            this.failures = 0;
+            if (this.client.debug) console.log('[api.js] Push channel connected; polling paused');
+            this.watchers.forEach(w => {
+                this._stopPolling(w);
+                if (reconnected) this._runPoll(w);
+            });
+        };
+
+        source.onerror = () => {
+            // EventSource would retry with the same, already used token
+            source.close();
+            if (this.source === source) this.source = null;
+            this._failed();
+        };
+
+        PUSH_CONFIG.EVENT_TYPES.forEach(type => {
+            source.addEventListener(type, (event) => this._dispatch(type, event));
+        });
+    }
+
+    _failed() {
+        this.connected = false;
+        this.failures++;
+        this.watchers.forEach(w => this._startPolling(w));
+        if (this.failures >= PUSH_CONFIG.MAX_FAILURES) {
+            console.warn('[api.js] Push channel unavailable; falling back to polling');
+            this.disabled = true;
+            return;
+        }
+        clearTimeout(this.retryTimer);
+        this.retryTimer = setTimeout(() => {
+            this.retryTimer = null;
+            this.connect();
+        }, PUSH_CONFIG.RETRY_MS);
+    }
+
+    close() {
+        this.generation++;
+        clearTimeout(this.retryTimer);
+        this.retryTimer = null;
+        if (this.source) this.source.close();
+        this.source = null;
+        this.connected = false;
+        this.watchers.forEach(w => this._stopPolling(w));
+    }
+
+    _dispatch(type, event) {
+        let data;
+        try {
+            data = JSON.parse(event.data);
+        } catch (e) {
+            console.warn('[api.js] Ignoring malformed push event:', type, event.data);
+            return;
+        }
+        if (type === 'resync') this.watchers.forEach(w => this._runPoll(w));
+        (this.handlers[type] || []).forEach(handler => {
+            try {
+                handler(data);
+            } catch (e) {
+                console.error(`[api.js] Push handler for "${type}" failed:`, e);
+            }
+        });
+    }
+
+    _runPoll(watcher) {
+        Promise.resolve()
+            .then(() => watcher.poll())
+            .catch(e => console.warn('[api.js] Refresh after push event failed:', e));
+    }
+
+    _startPolling(watcher) {
+        if (watcher.timer) return;
+        watcher.timer = setInterval(() => this._runPoll(watcher), watcher.intervalMs);
+    }
+
+    _stopPolling(watcher) {
+        if (!watcher.timer) return;
+        clearInterval(watcher.timer);
+        watcher.timer = null;
+    }
+}
+
+api.push = new PushChannel(api);
+
 // Make sure it's available globally
 if (typeof window !== 'undefined') {
     window.api = api;
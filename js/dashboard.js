@@ -329,7 +329,16 @@ function showLoadingState() {
     });
 }
 
-// Auto-refresh dashboard every 30 seconds
-setInterval(async () => {
-    await loadDashboardData();
-}, 30000);
+// Apply a pushed balance delta (only the changed fields) without a round trip
+function applyBalanceDelta(delta) {
+    if (!dashboardData) {
+        loadDashboardData();
+        return;
+    }
+    dashboardData.balance = { ...(dashboardData.balance || {}), ...delta };
+    updateBalanceCards(dashboardData);
+}
+
+// Live updates over the push channel; the 30 second reload only runs while it is down
+api.push.on('balance', applyBalanceDelta);
+api.push.watch(loadDashboardData, 30000);
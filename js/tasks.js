@@ -612,13 +612,24 @@ if (typeof showToast !== 'function') {
     document.head.appendChild(styleEl);
 }
 
-// Auto-refresh tasks every minute to update timers
-setInterval(async () => {
+// Re-render every minute so claim timers count down (no request needed)
+setInterval(() => {
     if (userTasks.some(t => t.status === 'taken')) {
-        await loadTasks();
+        renderTasks();
     }
 }, 60000);
 
+// Task status changes are pushed; reload from the API only then, or on a
+// timer while the push channel is down
+if (getApiClient() && getApiClient().push) {
+    getApiClient().push.on('task', () => loadTasks());
+    getApiClient().push.watch(async () => {
+        if (userTasks.some(t => t.status === 'taken')) {
+            await loadTasks();
+        }
+    }, 60000);
+}
+
 // Debug function to help diagnose task loading issues
 function debugTasks() {
     console.log('Debug - allTasks:', allTasks);
@@ -84,7 +84,6 @@ function showErrorState() {
     }
 }
 
-// Auto-refresh every 60 seconds
-setInterval(async () => {
-    await loadTopEarners();
-}, 60000);
+// Rank changes are pushed; the 60 second reload only runs while the push channel is down
+api.push.on('leaderboard', (data) => renderTopEarners(data.top || []));
+api.push.watch(loadTopEarners, 60000);
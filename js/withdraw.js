@@ -106,10 +106,24 @@ function setupBalanceDropdown() {
     }
 }
 
+// History is loaded a cursor page at a time as the user scrolls
+const HISTORY_PAGE_SIZE = 20;
+let withdrawalHistory = [];
+let historyPager = null;
+
 async function loadWithdrawalHistory() {
     try {
-        const withdrawals = await api.getWithdrawals(0, 20);
-        renderWithdrawalHistory(withdrawals);
+        if (!historyPager) {
+            historyPager = new CursorPager(
+                (after, skip) => api.getWithdrawalsPage(after, HISTORY_PAGE_SIZE, skip),
+                (items, first) => {
+                    withdrawalHistory = first ? items : withdrawalHistory.concat(items);
+                    renderWithdrawalHistory(withdrawalHistory);
+                },
+                HISTORY_PAGE_SIZE
+            );
+        }
+        await historyPager.reset();
     } catch (error) {
         console.error('Error loading withdrawal history:', error);
     }
@@ -140,7 +154,9 @@ function renderWithdrawalHistory(withdrawals) {
                 <button class="view-receipt-btn btn-primary" data-id="${w.id}" style="padding:8px 12px;border-radius:8px;">View</button>
             </div>
         </div>
-    `).join('');
+    `).join('') + (historyPager && !historyPager.done ? '<div id="withdrawalHistoryMore" style="height:1px;"></div>' : '');
+
+    if (historyPager) historyPager.observe(document.getElementById('withdrawalHistoryMore'));
 
     // Attach click handlers for view buttons
     const viewButtons = historyContainer.querySelectorAll('.view-receipt-btn');
@@ -0,0 +1,228 @@
+"""
+Keyset (cursor) pagination for the long admin and history lists
+
+?skip=N&limit=M is OFFSET pagination: the database reads and throws away N
+rows for every page, so page 10,000 of system_logs is 10,000x slower than
+page 1. Keyset pagination remembers where the last page ended and asks for
+rows strictly after it:
+
+    WHERE (created_at, id) < (:last_created_at, :last_id)
+    ORDER BY created_at DESC, id DESC LIMIT :limit
+
+With an index on the sort key (see migrate_add_indexes.py) every page is
+an index seek, so any page of a 10M-row log costs the same as the first.
+
+Cursors are opaque to clients (base64url JSON of the list name and the last
+row's key). Responses look like:
+
+    {"items": [...], "next_cursor": "eyJsIjoid2l0aGRyYXdhbHMiLCJrIjpbIjIwMjQ..."}
+
+next_cursor is null on the last page. Backend wiring (the legacy ?skip=
+form keeps returning a bare list for older clients):
+
+    from keyset_pagination import InvalidCursor, fetch_page
+
+    @router.get("/withdrawals")
+    def admin_withdrawals(after: str = None, limit: int = 50, status: str = None, search: str = None,
+                          skip: int = None, db=...):
+        if skip is not None:
+            return legacy_offset_list(...)
+        try:
+            return fetch_page(db, "withdrawals", limit, after, {"status": status}, search)
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+Usage (deep-page benchmark, offset vs keyset):
+    python keyset_pagination.py --database-url sqlite:////tmp/perf.db --list transactions --depth 500000
+"""
+import argparse
+import base64
+import json
+import sys
+import time
+
+from sqlalchemy import text
+
+from database import get_read_engine
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+class InvalidCursor(ValueError):
+    """Raised for a cursor that was tampered with or belongs to another list"""
+
+
+class ListSpec:
+    """A paginated list: table, sort key (newest first), allowed equality filters and search
+
+    `search` is a SQL predicate over :search (a lower-case LIKE pattern) and
+    :search_exact (the search text itself), for lists the UI can search.
+    """
+
+    def __init__(self, table, key, filters=(), enum_filters=(), search=None):
+        self.table = table
+        self.key = key
+        self.filters = set(filters) | set(enum_filters)
+        # Enum columns are stored as upper-case names ('PENDING'); the UI sends 'pending'
+        self.enum_filters = set(enum_filters)
+        self.search = search
+
+
+LISTS = {
+    "system_logs": ListSpec("system_logs", ("created_at", "id"), filters=("action", "performed_by", "target_user")),
+    "transactions": ListSpec("transactions", ("created_at", "id"), filters=("user_id",), enum_filters=("type", "balance_type")),
+    "withdrawals": ListSpec(
+        "withdrawals", ("created_at", "id"), filters=("user_id",), enum_filters=("status",),
+        search="""(CAST(id AS TEXT) = :search_exact OR user_id IN (
+            SELECT id FROM users WHERE LOWER(username) LIKE :search ESCAPE '\\' OR LOWER(email) LIKE :search ESCAPE '\\'))""",
+    ),
+    "users": ListSpec("users", ("id",), enum_filters=("role",)),
+    "coupons": ListSpec("coupons", ("id",), filters=("assigned_to", "used_by", "coupon_type"), enum_filters=("status",)),
+}
+
+
+def encode_cursor(list_name, key_values):
+    payload = json.dumps({"l": list_name, "k": list(key_values)}, default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(list_name, cursor):
+    """Return the key values stored in a cursor, validating it belongs to list_name"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = payload["k"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor(f"Malformed cursor: {e}")
+    if payload.get("l") != list_name or len(values) != len(LISTS[list_name].key):
+        raise InvalidCursor("Cursor does not belong to this list")
+    return values
+
+
+def like_pattern(value):
+    """Case-insensitive substring LIKE pattern, with the user's % and _ matched literally"""
+    escaped = value.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def build_page_sql(list_name, filters, has_cursor, search=False):
+    """SQL for one page: equality filters and search, then the keyset predicate on the sort key"""
+    spec = LISTS[list_name]
+    where = [f"{column} = :f_{column}" for column in sorted(filters)]
+    if search:
+        where.append(spec.search)
+    if has_cursor:
+        columns = ", ".join(spec.key)
+        params = ", ".join(f":k{i}" for i in range(len(spec.key)))
+        # Row-value comparison: SQLite >= 3.15 and Postgres both use the index for it
+        where.append(f"({columns}) < ({params})" if len(spec.key) > 1 else f"{spec.key[0]} < :k0")
+    order = ", ".join(f"{column} DESC" for column in spec.key)
+    return (f"SELECT * FROM {spec.table}"
+            + (f" WHERE {' AND '.join(where)}" if where else "")
+            + f" ORDER BY {order} LIMIT :limit")
+
+
+def fetch_page(db, list_name, limit=DEFAULT_LIMIT, after=None, filters=None, search=None):
+    """Return {"items": [...], "next_cursor": str|None} for one page of a list
+
+    `filters` maps column -> value; None values are ignored and unknown
+    columns are rejected, so request parameters can be passed straight in.
+    `search` is free text matched by the list's search predicate.
+    """
+    spec = LISTS.get(list_name)
+    if spec is None:
+        raise ValueError(f"Unknown list: {list_name}")
+    limit = max(1, min(int(limit or DEFAULT_LIMIT), MAX_LIMIT))
+
+    active = {}
+    for column, value in (filters or {}).items():
+        if value is None or value == "":
+            continue
+        if column not in spec.filters:
+            raise ValueError(f"Cannot filter {list_name} by {column}")
+        active[column] = value.upper() if column in spec.enum_filters and isinstance(value, str) else value
+
+    params = {f"f_{column}": value for column, value in active.items()}
+    search = (search or "").strip()
+    if search:
+        if spec.search is None:
+            raise ValueError(f"Cannot search {list_name}")
+        params.update({"search": like_pattern(search), "search_exact": search})
+    if after:
+        params.update({f"k{i}": value for i, value in enumerate(decode_cursor(list_name, after))})
+    # One extra row tells us whether another page exists without a COUNT(*)
+    params["limit"] = limit + 1
+
+    sql = build_page_sql(list_name, active, bool(after), bool(search))
+    rows = [dict(row) for row in db.execute(text(sql), params).mappings()]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(list_name, [rows[-1][column] for column in spec.key])
+    return {"items": rows, "next_cursor": next_cursor}
+
+
+def iter_all(db, list_name, page_size=MAX_LIMIT, filters=None, search=None):
+    """Yield every row of a list, newest first, one keyset page at a time"""
+    after = None
+    while True:
+        page = fetch_page(db, list_name, page_size, after, filters, search)
+        yield from page["items"]
+        after = page["next_cursor"]
+        if after is None:
+            return
+
+
+def benchmark(conn, list_name, depth, limit=DEFAULT_LIMIT, repeat=5):
+    """Time fetching the page that starts `depth` rows in, by OFFSET and by cursor"""
+    spec = LISTS[list_name]
+    order = ", ".join(f"{column} DESC" for column in spec.key)
+    offset_sql = text(f"SELECT * FROM {spec.table} ORDER BY {order} LIMIT :limit OFFSET :offset")
+
+    # The row just before the page gives the cursor a client would hold
+    anchor = conn.execute(text(f"SELECT {', '.join(spec.key)} FROM {spec.table} ORDER BY {order} LIMIT 1 OFFSET :offset"),
+                          {"offset": depth - 1}).first()
+    if anchor is None:
+        raise ValueError(f"{list_name} has fewer than {depth} rows")
+    cursor = encode_cursor(list_name, list(anchor))
+
+    def best_of(fn):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = fn()
+            timings.append(time.perf_counter() - started)
+        return min(timings) * 1000.0, result
+
+    offset_ms, offset_rows = best_of(lambda: [dict(r) for r in conn.execute(offset_sql, {"limit": limit, "offset": depth}).mappings()])
+    keyset_ms, page = best_of(lambda: fetch_page(conn, list_name, limit, cursor))
+    return {"offset_ms": offset_ms, "keyset_ms": keyset_ms, "same_rows": offset_rows == page["items"]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare OFFSET and keyset pagination on a deep page")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--list', default="transactions", choices=sorted(LISTS), help="List to page through")
+    parser.add_argument('--depth', type=int, default=100000, help="How many rows in the page starts")
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT)
+    args = parser.parse_args(argv)
+
+    engine = get_read_engine(args.database_url)
+    try:
+        with engine.connect() as conn:
+            print(f"📄 {args.list}: page of {args.limit} starting {args.depth:,} rows in")
+            for depth in sorted({1, args.depth // 100 or 1, args.depth // 10 or 1, args.depth}):
+                r = benchmark(conn, args.list, depth, args.limit)
+                check = "✓" if r["same_rows"] else "✗ rows differ"
+                print(f"   depth {depth:>10,}: OFFSET {r['offset_ms']:8.2f} ms   keyset {r['keyset_ms']:6.2f} ms   {check}")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
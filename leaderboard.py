@@ -0,0 +1,231 @@
+"""
+Precomputed top-earners leaderboard
+
+/users/top-earners used to run a GROUP BY over every user on each call (and
+js/top-earners.js polls it every 60 seconds per open tab). This module keeps
+a materialized `leaderboard` snapshot instead:
+
+    leaderboard(user_id, username, full_name, referral_code,
+                affiliate_balance, referral_count, updated_at)
+
+Only scores are stored. Ranks are assigned at read time by walking the
+(affiliate_balance DESC, user_id) index, so reads are an O(limit) scan and
+every write touches exactly one row. The snapshot is maintained
+incrementally by the backend write paths and can be rebuilt on demand:
+
+    record_user_signup(db, user_id)             # after a user registers
+    record_referral_signup(db, referral_code)   # when the user was referred
+    record_referral_credit(db, user_id, amount) # after a referral credit/debit (kobo)
+    record_user_active(db, user_id, active)     # after enabling/disabling an account
+    rebuild_leaderboard(db)                     # full rebuild
+
+All functions take a SQLAlchemy Session or Connection and run inside the
+caller's transaction, so the snapshot commits together with the change.
+
+On PostgreSQL the snapshot is a materialized view instead: the record_*
+calls are no-ops and rebuild_leaderboard() runs REFRESH MATERIALIZED VIEW
+CONCURRENTLY, which readers never wait for. Schedule it (e.g. every
+minute with `python leaderboard.py --rebuild`).
+
+Usage:
+    python leaderboard.py --rebuild
+    python leaderboard.py --top 20
+"""
+import argparse
+import sys
+
+from sqlalchemy import text
+
+from database import get_engine
+from db_backend import backend_for
+from money import KOBO_PER_NAIRA, format_naira, from_stored, money_scale, to_stored
+
+CREATE_TABLE_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS leaderboard (
+        user_id INTEGER PRIMARY KEY,
+        username VARCHAR(50) NOT NULL,
+        full_name VARCHAR(100),
+        referral_code VARCHAR(20),
+        affiliate_balance BIGINT NOT NULL DEFAULT 0,
+        referral_count INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_leaderboard_referral_code ON leaderboard (referral_code)",
+    "CREATE INDEX IF NOT EXISTS ix_leaderboard_order ON leaderboard (affiliate_balance DESC, user_id)",
+]
+
+SNAPSHOT_SQL = """
+    SELECT u.id AS user_id, u.username, u.full_name, u.referral_code,
+           COALESCE(b.affiliate_balance, 0) AS affiliate_balance,
+           COALESCE(rc.referral_count, 0) AS referral_count,
+           CURRENT_TIMESTAMP AS updated_at
+    FROM users u
+    LEFT JOIN balances b ON b.user_id = u.id
+    LEFT JOIN (
+        SELECT referred_by, COUNT(*) AS referral_count
+        FROM users
+        WHERE referred_by IS NOT NULL
+        GROUP BY referred_by
+    ) rc ON rc.referred_by = u.referral_code
+    WHERE u.is_active = {active}
+"""
+
+REBUILD_SQL = text("""
+    INSERT INTO leaderboard (user_id, username, full_name, referral_code,
+                             affiliate_balance, referral_count, updated_at)
+""" + SNAPSHOT_SQL.format(active=":active"))
+
+# One user's row, for signups and re-enabled accounts
+INSERT_USER_SQL = text("""
+    INSERT INTO leaderboard (user_id, username, full_name, referral_code,
+                             affiliate_balance, referral_count, updated_at)
+    SELECT u.id, u.username, u.full_name, u.referral_code,
+           COALESCE(b.affiliate_balance, 0),
+           (SELECT COUNT(*) FROM users r WHERE r.referred_by = u.referral_code),
+           CURRENT_TIMESTAMP
+    FROM users u
+    LEFT JOIN balances b ON b.user_id = u.id
+    WHERE u.id = :user_id
+      AND u.is_active = :active
+      AND NOT EXISTS (SELECT 1 FROM leaderboard WHERE user_id = :user_id)
+""")
+
+# PostgreSQL: the snapshot is a materialized view; the unique index lets
+# REFRESH ... CONCURRENTLY swap in new scores without blocking readers
+MATVIEW_SQL = [
+    "CREATE MATERIALIZED VIEW IF NOT EXISTS leaderboard AS" + SNAPSHOT_SQL.format(active="TRUE"),
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_leaderboard_user ON leaderboard (user_id)",
+    "CREATE INDEX IF NOT EXISTS ix_leaderboard_order ON leaderboard (affiliate_balance DESC, user_id)",
+]
+
+# Ranks are a total order: affiliate_balance DESC, then user_id ASC for ties
+TOP_SQL = text("""
+    SELECT user_id, username, full_name, referral_code, affiliate_balance, referral_count
+    FROM leaderboard
+    ORDER BY affiliate_balance DESC, user_id
+    LIMIT :limit
+""")
+
+
+def is_materialized(db):
+    return backend_for(db).supports_materialized_views
+
+
+def ensure_table(db):
+    if not is_materialized(db):
+        backend = backend_for(db)
+        if backend.has_table(db, "leaderboard") and "rank" in db.execute(text("SELECT * FROM leaderboard LIMIT 0")).keys():
+            # Snapshot from when ranks were stored; it is derived data
+            db.execute(text("DROP TABLE leaderboard"))
+        for sql in CREATE_TABLE_SQL:
+            db.execute(text(sql))
+        return
+    backend = backend_for(db)
+    if backend.has_table(db, "leaderboard") and "leaderboard" not in backend.materialized_view_names(db):
+        # A table snapshot from before the view existed; it is derived data
+        db.execute(text("DROP TABLE leaderboard"))
+    for sql in MATVIEW_SQL:
+        db.execute(text(sql))
+
+
+def rebuild_leaderboard(db):
+    """Recompute the whole snapshot from users and balances; returns the row count"""
+    ensure_table(db)
+    if is_materialized(db):
+        db.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY leaderboard"))
+    else:
+        db.execute(text("DELETE FROM leaderboard"))
+        db.execute(REBUILD_SQL, {"active": True})
+    return db.execute(text("SELECT COUNT(*) FROM leaderboard")).scalar()
+
+
+def get_top_earners(db, limit=20):
+    """Return the top `limit` earners as dicts, ranked 1..limit"""
+    return [
+        dict(row, rank=rank)
+        for rank, row in enumerate(db.execute(TOP_SQL, {"limit": limit}).mappings(), 1)
+    ]
+
+
+def record_user_signup(db, user_id):
+    """Add a newly registered user to the snapshot
+
+    Inactive users are left out, as in rebuild_leaderboard().
+    """
+    if is_materialized(db):
+        return
+    db.execute(INSERT_USER_SQL, {"user_id": user_id, "active": True})
+
+
+def record_user_active(db, user_id, active):
+    """Add a re-enabled user back to the snapshot or drop a disabled one"""
+    if is_materialized(db):
+        return
+    if active:
+        record_user_signup(db, user_id)
+    else:
+        db.execute(text("DELETE FROM leaderboard WHERE user_id = :user_id"), {"user_id": user_id})
+
+
+def record_referral_signup(db, referral_code):
+    """Count a new referral for the user who owns referral_code"""
+    if is_materialized(db):
+        return
+    if not referral_code:
+        return
+    db.execute(
+        text("UPDATE leaderboard SET referral_count = referral_count + 1, updated_at = CURRENT_TIMESTAMP WHERE referral_code = :code"),
+        {"code": referral_code},
+    )
+
+
+def record_referral_credit(db, user_id, amount):
+    """Apply a referral credit (positive) or debit (negative) to the user's score"""
+    if is_materialized(db):
+        return
+    updated = db.execute(
+        text("UPDATE leaderboard SET affiliate_balance = affiliate_balance + :amount, updated_at = CURRENT_TIMESTAMP WHERE user_id = :user_id"),
+        {"amount": to_stored(amount, money_scale(db, "balances", "affiliate_balance")), "user_id": user_id},
+    ).rowcount
+    if not updated:
+        # User predates the snapshot; add them with their current balance
+        record_user_signup(db, user_id)
+
+
+def print_top_earners(rows, scale=KOBO_PER_NAIRA):
+    """`scale` is money_scale() of balances.affiliate_balance (the snapshot copies it)"""
+    print(f"\n{'Rank':<6} {'Username':<20} {'Full Name':<25} {'Affiliate':<15} {'Referrals':<10}")
+    print("-" * 90)
+    for row in rows:
+        print(f"{row['rank']:<6} {row['username']:<20} {row['full_name'] or '':<25} {format_naira(from_stored(row['affiliate_balance'], scale)):<15} {row['referral_count']:<10}")
+    if not rows:
+        print("No users found!")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the precomputed top-earners leaderboard")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild the snapshot from users and balances")
+    parser.add_argument('--top', type=int, default=10, help="Number of top earners to show")
+    args = parser.parse_args(argv)
+
+    engine = get_engine(args.database_url)
+    try:
+        if args.rebuild:
+            with engine.begin() as conn:
+                count = rebuild_leaderboard(conn)
+            print(f"✅ Leaderboard rebuilt with {count:,} user(s)")
+        with engine.connect() as conn:
+            print_top_earners(get_top_earners(conn, args.top), money_scale(conn, "balances", "affiliate_balance"))
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""
+Ledger-derived balance materialization
+
+Keeps per-user, per-balance_type running sums of the transactions ledger in
+the ledger_balances table and diffs them against the stored balances.
+
+A high-water mark on transactions.id (ledger_watermarks) means each
+incremental run only folds in ledger rows added since the last run, so drift
+detection can run every few minutes instead of as a full-table scan.
+
+Usage:
+    python ledger_materializer.py --rebuild      # full rebuild from the ledger
+    python ledger_materializer.py                # fold in new transactions, then diff
+    python ledger_materializer.py --report drift.json
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+from balance_reconciliation import DEFAULT_TOLERANCE
+from database import get_engine
+from money import BALANCE_COLUMNS, format_naira, from_stored, money_scale, stored_tolerance
+
+WATERMARK_NAME = 'transactions'
+DEFAULT_BATCH_SIZE = 50000
+
+CREATE_TABLES_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS ledger_balances (
+        user_id INTEGER NOT NULL,
+        balance_type VARCHAR(8) NOT NULL,
+        net_amount BIGINT NOT NULL DEFAULT 0,
+        transaction_count INTEGER NOT NULL DEFAULT 0,
+        last_transaction_id INTEGER,
+        updated_at TIMESTAMP,
+        PRIMARY KEY (user_id, balance_type)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ledger_watermarks (
+        name VARCHAR(50) PRIMARY KEY,
+        last_transaction_id INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP
+    )
+    """,
+]
+
+# Folds the ledger rows in (lo, hi] into the running sums
+FOLD_SQL = text("""
+    INSERT INTO ledger_balances (user_id, balance_type, net_amount, transaction_count, last_transaction_id, updated_at)
+    SELECT user_id,
+           UPPER(balance_type),
+           SUM(CASE WHEN UPPER(type) = 'CREDIT' THEN amount ELSE -amount END),
+           COUNT(*),
+           MAX(id),
+           CURRENT_TIMESTAMP
+    FROM transactions
+    WHERE id > :lo AND id <= :hi AND user_id IS NOT NULL
+    GROUP BY user_id, UPPER(balance_type)
+    ON CONFLICT (user_id, balance_type) DO UPDATE SET
+        net_amount = ledger_balances.net_amount + excluded.net_amount,
+        transaction_count = ledger_balances.transaction_count + excluded.transaction_count,
+        last_transaction_id = excluded.last_transaction_id,
+        updated_at = excluded.updated_at
+""")
+
+SET_WATERMARK_SQL = text("""
+    INSERT INTO ledger_watermarks (name, last_transaction_id, updated_at)
+    VALUES (:name, :last_id, CURRENT_TIMESTAMP)
+    ON CONFLICT (name) DO UPDATE SET
+        last_transaction_id = excluded.last_transaction_id,
+        updated_at = excluded.updated_at
+""")
+
+
+def ensure_tables(conn):
+    for sql in CREATE_TABLES_SQL:
+        conn.execute(text(sql))
+
+
+def get_watermark(conn):
+    value = conn.execute(
+        text("SELECT last_transaction_id FROM ledger_watermarks WHERE name = :name"),
+        {"name": WATERMARK_NAME},
+    ).scalar()
+    return value or 0
+
+
+def _fold_range(conn, lo, hi):
+    conn.execute(FOLD_SQL, {"lo": lo, "hi": hi})
+    conn.execute(SET_WATERMARK_SQL, {"name": WATERMARK_NAME, "last_id": hi})
+
+
+def rebuild(engine):
+    """Recompute every running sum from the whole ledger in one transaction"""
+    with engine.begin() as conn:
+        ensure_tables(conn)
+        max_id = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM transactions")).scalar()
+        conn.execute(text("DELETE FROM ledger_balances"))
+        _fold_range(conn, 0, max_id)
+    return {"mode": "rebuild", "from_id": 0, "to_id": max_id, "batches": 1}
+
+
+def refresh(engine, batch_size=DEFAULT_BATCH_SIZE):
+    """Fold in transactions added since the last run
+
+    New rows are folded in id ranges of batch_size, each range and its
+    watermark update committed together, so an interrupted run resumes
+    exactly where it stopped.
+    """
+    with engine.begin() as conn:
+        ensure_tables(conn)
+        start = get_watermark(conn)
+        max_id = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM transactions")).scalar()
+
+    lo = start
+    batches = 0
+    while lo < max_id:
+        hi = min(lo + batch_size, max_id)
+        with engine.begin() as conn:
+            _fold_range(conn, lo, hi)
+        batches += 1
+        lo = hi
+    return {"mode": "incremental", "from_id": start, "to_id": max(max_id, start), "batches": batches}
+
+
+def find_drift(conn, tolerance=DEFAULT_TOLERANCE, limit=None):
+    """Return balances whose stored value differs from the ledger-derived sum (amounts in kobo)"""
+    drift = []
+    for balance_type, column in BALANCE_COLUMNS.items():
+        scale = money_scale(conn, "balances", column)
+        sql = f"""
+            SELECT b.user_id,
+                   COALESCE(b.{column}, 0) AS stored,
+                   COALESCE(l.net_amount, 0) AS ledger
+            FROM balances b
+            LEFT JOIN ledger_balances l
+                   ON l.user_id = b.user_id AND l.balance_type = :balance_type
+            WHERE ABS(COALESCE(b.{column}, 0) - COALESCE(l.net_amount, 0)) > :tolerance
+            ORDER BY b.user_id
+        """
+        params = {"balance_type": balance_type, "tolerance": stored_tolerance(tolerance, scale)}
+        if limit:
+            sql += " LIMIT :limit"
+            params["limit"] = limit
+        for row in conn.execute(text(sql), params).mappings():
+            stored, ledger = from_stored(row["stored"], scale), from_stored(row["ledger"], scale)
+            drift.append({
+                "user_id": row["user_id"],
+                "balance_type": balance_type,
+                "column": column,
+                "stored": stored,
+                "ledger": ledger,
+                "difference": stored - ledger,
+            })
+    return drift
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Materialize balances from the transactions ledger and report drift")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--rebuild', action='store_true', help="Full rebuild instead of an incremental refresh")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Transaction ids folded per commit")
+    parser.add_argument('--tolerance', type=int, default=DEFAULT_TOLERANCE, help="Allowed drift in kobo")
+    parser.add_argument('--limit', type=int, default=None, help="Max drifted rows per balance type")
+    parser.add_argument('--report', default=None, help="Write a JSON report to this path ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    engine = get_engine(args.database_url)
+    started = time.perf_counter()
+
+    try:
+        run = rebuild(engine) if args.rebuild else refresh(engine, args.batch_size)
+        with engine.connect() as conn:
+            drift = find_drift(conn, args.tolerance, args.limit)
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+    run["duration_seconds"] = round(time.perf_counter() - started, 3)
+    print(f"=== Ledger {run['mode']}: transactions {run['from_id']} → {run['to_id']} in {run['duration_seconds']}s ===")
+
+    if drift:
+        print(f"\n❌ {len(drift)} balance(s) differ from the ledger:")
+        for item in drift[:20]:
+            print(f"- user_id={item['user_id']} {item['column']}: stored={format_naira(item['stored'])}, ledger={format_naira(item['ledger'])} ({item['difference']:+} kobo)")
+        if len(drift) > 20:
+            print(f"  ... and {len(drift) - 20} more")
+    else:
+        print("\n✅ Stored balances match the ledger")
+
+    if args.report:
+        report = {**run, "generated_at": datetime.utcnow().isoformat(), "drift_count": len(drift), "drift": drift}
+        payload = json.dumps(report, indent=2, default=str)
+        if args.report == '-':
+            print(payload)
+        else:
+            with open(args.report, 'w', encoding='utf-8') as f:
+                f.write(payload + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+Migration script to add secondary indexes for the hot query paths
+
+The original schema only indexes primary keys plus username, email,
+referral_code, coupon code and transaction reference. Dashboard, referral,
+task and admin list queries all filter or sort on other columns; these
+composite/covering indexes serve them. Uses CREATE INDEX IF NOT EXISTS, so it
+is idempotent and safe to re-run.
+
+Run index_advisor.py afterwards to check the query plans.
+"""
+from sqlalchemy import text
+
+from database import get_engine
+
+# (index name, table, columns) - columns are listed in equality-then-range/sort order
+INDEXES = [
+    # /users/referrals and referral counts: users WHERE referred_by = :code
+    ("ix_users_referred_by", "users", "referred_by, created_at"),
+    # Dashboard / history: transactions for one user, newest first, optionally by balance type
+    ("ix_transactions_user_created", "transactions", "user_id, created_at"),
+    ("ix_transactions_user_type_created", "transactions", "user_id, balance_type, created_at"),
+    ("ix_transactions_created_at", "transactions", "created_at"),
+    # Task take/claim checks and /tasks/my-tasks
+    ("ix_user_tasks_user_task_status", "user_tasks", "user_id, task_id, status"),
+    # Active stream lookups per user
+    ("ix_streams_user_status", "streams", "user_id, status"),
+    # Admin withdrawals list filtered by status, newest first
+    ("ix_withdrawals_status_created", "withdrawals", "status, created_at"),
+    # User withdrawal history
+    ("ix_withdrawals_user_created", "withdrawals", "user_id, created_at"),
+    # Admin withdrawals list, unfiltered (keyset pages on created_at, id)
+    ("ix_withdrawals_created_id", "withdrawals", "created_at, id"),
+    # Unread notification counts / lists
+    ("ix_notifications_user_is_read", "notifications", "user_id, is_read, created_at"),
+    # Admin logs page, newest first
+    ("ix_system_logs_created_at", "system_logs", "created_at"),
+    # Sub-admin coupon lists
+    ("ix_coupons_assigned_status", "coupons", "assigned_to, status"),
+    # Admin coupon list filtered by status (keyset pages on id)
+    ("ix_coupons_status_id", "coupons", "status, id"),
+    # Admin users list filtered by role (keyset pages on id)
+    ("ix_users_role_id", "users", "role, id"),
+    # Top earners: covering index for ORDER BY affiliate_balance DESC
+    ("ix_balances_affiliate_user", "balances", "affiliate_balance DESC, user_id"),
+]
+
+
+def index_statements():
+    return [
+        f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"
+        for name, table, columns in INDEXES
+    ]
+
+
+def migrate(database_url=None):
+    engine = get_engine(database_url)
+
+    try:
+        print("Adding secondary indexes...")
+        with engine.begin() as conn:
+            for (name, table, columns), sql in zip(INDEXES, index_statements()):
+                conn.execute(text(sql))
+                print(f"✓ {name} on {table} ({columns})")
+            # Refresh planner statistics so the new indexes are picked up
+            conn.execute(text("ANALYZE"))
+        print("\n✅ Migration completed successfully")
+    except Exception as e:
+        print(f"\n❌ Migration failed: {e}")
+        import traceback
+        traceback.print_exc()
+
+if __name__ == "__main__":
+    migrate()
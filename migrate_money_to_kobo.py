@@ -0,0 +1,145 @@
+"""
+Migration script to store all money columns as integer kobo (BIGINT)
+
+Every amount column was FLOAT, so sums drift by fractions of a kobo and the
+repair scripts compare against 0.01 epsilons. This converts each column in
+money.MONEY_COLUMNS to BIGINT kobo (ROUND(naira * 100)):
+
+  - SQLite: one table rebuild per table (migrations.rebuild_table) that
+    converts all of its money columns while copying, with progress output
+  - Postgres: ALTER COLUMN ... TYPE BIGINT USING ROUND(col * 100)
+
+Each table is converted in its own transaction and checked: the SUM of the
+new column must equal the SUM of the rounded old values exactly. Columns
+that are already integer are skipped, so it is safe to re-run. The same
+conversion is schema version 7 in migrations.py, which is opt-in there
+(python migrations.py --include 7) for the reason below.
+
+The API keeps speaking naira; see money.py for the conversion helpers and
+the Kobo column type for the backend models. The backend model change
+(money columns declared as money.Kobo, request amounts passed through
+to_kobo()) must ship in the same release as this migration: code that still
+writes naira floats would store amounts 100x too small.
+
+Usage:
+    python migrate_money_to_kobo.py --dry-run
+    python migrate_money_to_kobo.py --database-url sqlite:////tmp/perf.db
+"""
+import argparse
+import sys
+import time
+
+from sqlalchemy import inspect, text
+from sqlalchemy.types import BigInteger, Integer
+
+from database import get_engine
+from migrations import Progress, rebuild_table, transaction
+from money import KOBO_PER_NAIRA, MONEY_COLUMNS
+
+TIMING_SQL = "SELECT user_id, SUM(amount) FROM transactions GROUP BY user_id"
+
+
+def pending_columns(conn):
+    """{table: [column info]} for money columns that are not integer yet"""
+    inspector = inspect(conn)
+    tables = set(inspector.get_table_names())
+    pending = {}
+    for table, columns in MONEY_COLUMNS.items():
+        if table not in tables:
+            continue
+        existing = {c["name"]: c for c in inspector.get_columns(table)}
+        todo = [existing[c] for c in columns if c in existing and not isinstance(existing[c]["type"], Integer)]
+        if todo:
+            pending[table] = todo
+    return pending
+
+
+def _convert_sqlite(conn, table, columns, progress=None):
+    """All of a table's money columns in one table rebuild"""
+    rebuild_table(
+        conn, table,
+        {c["name"]: BigInteger() for c in columns},
+        {c["name"]: f"CAST(ROUND({c['name']} * {KOBO_PER_NAIRA}) AS INTEGER)" for c in columns},
+        progress=progress,
+    )
+
+
+def _convert_postgres(conn, table, columns, progress=None):
+    for info in columns:
+        column = info["name"]
+        conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE BIGINT "
+                          f"USING ROUND({column} * {KOBO_PER_NAIRA})::BIGINT"))
+
+
+def convert_table(conn, table, columns, progress=None):
+    """Convert one table's money columns; returns {column: kobo sum} after checking it"""
+    expected = {
+        c["name"]: conn.execute(text(
+            f"SELECT COALESCE(SUM(CAST(ROUND({c['name']} * {KOBO_PER_NAIRA}) AS BIGINT)), 0) FROM {table}")).scalar()
+        for c in columns
+    }
+    convert = _convert_postgres if conn.dialect.name == "postgresql" else _convert_sqlite
+    convert(conn, table, columns, progress)
+    for column, total in expected.items():
+        actual = conn.execute(text(f"SELECT COALESCE(SUM({column}), 0) FROM {table}")).scalar()
+        if actual != total:
+            raise RuntimeError(f"{table}.{column}: kobo sum {actual} != expected {total}")
+    return expected
+
+
+def time_aggregate(conn, repeat=3):
+    """Best-of-n milliseconds for the per-user ledger sum, or None without transactions"""
+    if not inspect(conn).has_table("transactions"):
+        return None
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(text(TIMING_SQL)).all()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert money columns from FLOAT naira to BIGINT kobo")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--dry-run', action='store_true', help="List the columns that would be converted")
+    args = parser.parse_args(argv)
+
+    engine = get_engine(args.database_url)
+    try:
+        with engine.connect() as conn:
+            pending = pending_columns(conn)
+            before_ms = time_aggregate(conn)
+        if not pending:
+            print("✅ All money columns are already integer kobo")
+            return 0
+
+        print("⚠️  Deploy together with the backend models declaring money columns as money.Kobo")
+        for table, columns in pending.items():
+            print(f"📦 {table}: {', '.join(c['name'] for c in columns)}")
+        if args.dry_run:
+            print(f"\nDry run: {sum(len(c) for c in pending.values())} column(s) would be converted")
+            return 0
+
+        for table, columns in pending.items():
+            started = time.perf_counter()
+            with transaction(engine) as conn:
+                convert_table(conn, table, columns, progress=Progress())
+            print(f"✅ {table} converted and verified in {time.perf_counter() - started:.1f}s")
+
+        with engine.connect() as conn:
+            after_ms = time_aggregate(conn)
+        if before_ms is not None and after_ms is not None:
+            print(f"\nPer-user ledger SUM: {before_ms:.1f} ms (float) → {after_ms:.1f} ms (integer)")
+        if engine.dialect.name == "sqlite":
+            print("⚠️  Run VACUUM to reclaim the space left by the rebuilt tables")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
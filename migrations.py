@@ -0,0 +1,477 @@
+"""
+Versioned, transactional schema migrations
+
+The migrate_*.py scripts each hard-coded their own database URL (or chdir'd
+into backend/ for the app engine), re-inspected PRAGMA table_info on every
+run and committed after every statement, so a failure half way left the
+schema half migrated and nothing recorded what had already been applied.
+
+Here every migration is a numbered function registered with @migration.
+Applied versions are recorded in
+
+    schema_version(version, name, applied_at, duration_ms)
+
+and each pending migration runs in ONE transaction together with its
+schema_version row: it is either fully applied and recorded, or not at all.
+On SQLite the transaction is an explicit BEGIN IMMEDIATE (database.py
+engines do this for every transaction), because pysqlite on its own
+autocommits DDL that comes before the first DML.
+
+Helpers for the migrations:
+
+  - add_column: idempotent ADD COLUMN (the old scripts may already have run)
+  - backfill: set-based UPDATE over primary key ranges of BATCH_ROWS rows,
+    with progress output, instead of one UPDATE per row (inside the
+    migration's transaction; large tables the app is writing to should be
+    filled afterwards with online_backfill.py)
+  - rebuild_table: SQLite's table-rebuild strategy for column type changes
+    (create <table>__new, copy in batches, drop, rename, recreate indexes,
+    triggers and views, then foreign_key_check for new violations) - one rewrite per table, where
+    ALTER TABLE DROP COLUMN rewrites it once per column
+
+Adding a migration: append a function with the next version number. Never
+renumber or edit a migration that has shipped.
+
+Opt-in migrations (registered with opt_in="<reason>") are skipped unless
+named with --include; they stay pending and can run later, out of order.
+Version 7 (money as integer kobo) is one: it must be deployed together with
+the backend models declaring money columns as money.Kobo, otherwise the
+running API keeps writing naira into kobo columns.
+
+Usage:
+    python migrations.py --status
+    python migrations.py --dry-run
+    python migrations.py                          # apply everything pending
+    python migrations.py --target 4 --database-url sqlite:////tmp/perf.db
+    python migrations.py --include 7              # also the kobo conversion, with the model release
+"""
+import argparse
+import re
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from sqlalchemy import MetaData, Table, inspect, text
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.types import Integer
+
+from database import get_engine
+from db_backend import backend_for
+from money import KOBO_PER_NAIRA
+
+BATCH_ROWS = 20000
+
+SCHEMA_VERSION_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        duration_ms INTEGER
+    )
+"""
+
+RECORD_SQL = text("INSERT INTO schema_version (version, name, duration_ms) VALUES (:version, :name, :duration_ms)")
+
+MIGRATIONS = []
+# version -> why it is left out of the default run
+OPT_IN = {}
+
+
+def migration(version, name, opt_in=None):
+    """Register fn(conn, progress) as schema version `version`
+
+    `opt_in` (the reason, printed when it is skipped) keeps it out of the
+    default run.
+    """
+    def register(fn):
+        if any(v == version for v, _, _ in MIGRATIONS):
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS.append((version, name, fn))
+        if opt_in:
+            OPT_IN[version] = opt_in
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+# -- transactions and bookkeeping -------------------------------------------
+
+def _foreign_key_violations(conn):
+    """Counter of (child table, parent table) for rows failing PRAGMA foreign_key_check"""
+    return Counter((row[0], row[2]) for row in conn.exec_driver_sql("PRAGMA foreign_key_check"))
+
+
+@contextmanager
+def transaction(engine):
+    """One real transaction, DDL included, committed only if the block succeeds"""
+    with engine.connect() as conn:
+        sqlite = conn.dialect.name == "sqlite"
+        if sqlite:
+            driver = conn.connection.driver_connection
+            isolation_level = driver.isolation_level
+            driver.isolation_level = None
+            # Must be set outside the transaction; table rebuilds drop parent tables
+            driver.execute("PRAGMA foreign_keys = OFF")
+        conn.begin()
+        if sqlite and not driver.in_transaction:
+            # Engines from database.get_engine already issued BEGIN IMMEDIATE
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        if sqlite:
+            # Orphans that predate the migration (see fix_orphaned_balances.py) are not its fault
+            orphans = _foreign_key_violations(conn)
+        try:
+            yield conn
+            if sqlite:
+                introduced = _foreign_key_violations(conn) - orphans
+                if introduced:
+                    raise RuntimeError(f"Foreign key check failed: {dict(introduced)}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            if sqlite:
+                driver.isolation_level = isolation_level
+
+
+def applied_versions(conn):
+    """{version: (name, applied_at)} of the migrations already applied"""
+    if not inspect(conn).has_table("schema_version"):
+        return {}
+    return {row[0]: (row[1], row[2]) for row in
+            conn.execute(text("SELECT version, name, applied_at FROM schema_version"))}
+
+
+def pending_migrations(conn, target=None, include=()):
+    """Migrations to apply; opt-in ones only when their version is in `include`"""
+    applied = applied_versions(conn)
+    return [m for m in MIGRATIONS if m[0] not in applied and (target is None or m[0] <= target)
+            and (m[0] not in OPT_IN or m[0] in include)]
+
+
+def skipped_migrations(conn, target=None, include=()):
+    """Pending opt-in migrations left out of this run"""
+    applied = applied_versions(conn)
+    return [m for m in MIGRATIONS if m[0] in OPT_IN and m[0] not in applied and m[0] not in include
+            and (target is None or m[0] <= target)]
+
+
+class Progress:
+    """Rows-done / rate / ETA line for long batched statements"""
+
+    def __init__(self, quiet=False):
+        self.quiet = quiet
+
+    def start(self, label, total):
+        self.label, self.total, self.done = label, total, 0
+        self.started = time.perf_counter()
+
+    def advance(self, rows):
+        self.done += rows
+        if self.quiet:
+            return
+        elapsed = time.perf_counter() - self.started
+        rate = self.done / elapsed if elapsed else 0.0
+        line = f"   {self.label}: {self.done:,}/{self.total:,} rows"
+        if self.total:
+            line += f" ({100.0 * self.done / self.total:.0f}%)"
+        if rate and self.total > self.done:
+            line += f", {rate:,.0f} rows/s, ETA {(self.total - self.done) / rate:.0f}s"
+        print(line.ljust(78), end="\r", flush=True)
+
+    def finish(self):
+        if not self.quiet and self.total:
+            elapsed = time.perf_counter() - self.started
+            print(f"   {self.label}: {self.done:,} rows in {elapsed:.1f}s".ljust(78))
+
+
+# -- helpers for migrations -------------------------------------------------
+
+def columns(conn, table):
+    """{name: column info} for a table, or {} if it does not exist"""
+    inspector = inspect(conn)
+    if not inspector.has_table(table):
+        return {}
+    return {c["name"]: c for c in inspector.get_columns(table)}
+
+
+def add_column(conn, table, column, ddl):
+    """ADD COLUMN unless it is already there; returns True when it was added"""
+    if column in columns(conn, table):
+        return False
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return True
+
+
+def _key_range(conn, table, key):
+    return conn.execute(text(f"SELECT MIN({key}), MAX({key}), COUNT(*) FROM {table}")).one()
+
+
+def backfill(conn, table, assignments, where=None, params=None, progress=None, key="id", batch=None):
+    """UPDATE table SET assignments [WHERE where] in primary key ranges; returns rows updated"""
+    batch = batch or BATCH_ROWS
+    low, high, total = _key_range(conn, table, key)
+    progress = progress or Progress(quiet=True)
+    progress.start(f"{table} backfill", total)
+    span = (high - low + 1) if low is not None else 1
+    condition = f" AND ({where})" if where else ""
+    statement = text(f"UPDATE {table} SET {assignments} WHERE {key} >= :lo AND {key} < :hi{condition}")
+    updated = 0
+    if low is not None:
+        for lo in range(low, high + 1, batch):
+            updated += conn.execute(statement, {**(params or {}), "lo": lo, "hi": lo + batch}).rowcount
+            # Rows scanned so far, estimated from the key range covered
+            progress.advance(min(total, total * (lo + batch - low) // span) - progress.done)
+    progress.finish()
+    return updated
+
+
+def _dependents(conn, table):
+    """CREATE statements of the indexes, triggers and views that must survive a rebuild"""
+    rows = conn.execute(text(
+        "SELECT type, name, tbl_name, sql FROM sqlite_master "
+        "WHERE type IN ('index', 'trigger', 'view') AND sql IS NOT NULL")).all()
+    mentions = re.compile(rf"\b{re.escape(table)}\b", re.IGNORECASE)
+    return [(kind, name, sql) for kind, name, tbl_name, sql in rows
+            if tbl_name == table or (kind == "view" and mentions.search(sql))]
+
+
+def rebuild_table(conn, table, column_types, expressions=None, progress=None, batch=None):
+    """Change column types on SQLite by rebuilding the table
+
+    column_types maps column -> new SQLAlchemy type; expressions maps column ->
+    the SQL that computes its new value from the old row (default: the column).
+    Must run inside transaction(), which turns foreign key enforcement off and
+    runs foreign_key_check before committing.
+    """
+    batch = batch or BATCH_ROWS
+    expressions = expressions or {}
+    metadata = MetaData()
+    old = Table(table, metadata, autoload_with=conn)
+    new = old.to_metadata(metadata, name=f"{table}__new")
+    new.indexes.clear()
+    for column, type_ in column_types.items():
+        new.c[column].type = type_
+    names = [c.name for c in old.columns]
+    select = ", ".join(expressions.get(name, name) for name in names)
+
+    dependents = _dependents(conn, table)
+    for kind, name, _ in dependents:
+        if kind == "view":
+            conn.execute(text(f"DROP VIEW {name}"))
+    conn.execute(text(f"DROP TABLE IF EXISTS {new.name}"))
+    conn.execute(CreateTable(new))
+
+    low, high, total = _key_range(conn, table, "rowid")
+    progress = progress or Progress(quiet=True)
+    progress.start(f"{table} rebuild", total)
+    copy = text(f"INSERT INTO {new.name} ({', '.join(names)}) "
+                f"SELECT {select} FROM {table} WHERE rowid >= :lo AND rowid < :hi")
+    if low is not None:
+        for lo in range(low, high + 1, batch):
+            progress.advance(conn.execute(copy, {"lo": lo, "hi": lo + batch}).rowcount)
+    progress.finish()
+    if progress.done != total:
+        raise RuntimeError(f"{table}: copied {progress.done} of {total} rows")
+
+    conn.execute(text(f"DROP TABLE {table}"))
+    conn.execute(text(f"ALTER TABLE {new.name} RENAME TO {table}"))
+    for kind, _, sql in sorted(dependents, key=lambda d: d[0] == "view"):
+        conn.execute(text(sql))
+    conn.execute(text(f"ANALYZE {table}"))
+
+
+# -- migrations -------------------------------------------------------------
+
+@migration(1, "task types")
+def _task_types(conn, progress):
+    """Image/text/link tasks (was migrate_task_types.py)"""
+    add_column(conn, "tasks", "task_url", "VARCHAR(500)")
+    add_column(conn, "tasks", "instructions", "TEXT")
+    if "link" in columns(conn, "tasks"):
+        backfill(conn, "tasks", "task_url = link", "link IS NOT NULL AND task_url IS NULL", progress=progress)
+    backfill(conn, "tasks", "task_type = 'link'", "task_type IS NULL OR task_type = ''", progress=progress)
+    add_column(conn, "user_tasks", "submission", "TEXT")
+
+
+@migration(2, "click to earn task")
+def _click_to_earn_task(conn, progress):
+    """Single-row click_to_earn_task table (was migrate_click_to_earn_task.py)"""
+    existing = columns(conn, "click_to_earn_task")
+    if not existing:
+        conn.execute(text(f"""
+            CREATE TABLE click_to_earn_task (
+                id {backend_for(conn).serial_pk},
+                link VARCHAR(500) NOT NULL,
+                task_type VARCHAR(10) NOT NULL DEFAULT 'mega',
+                amount FLOAT NOT NULL DEFAULT 500.0,
+                updated_at TIMESTAMP
+            )
+        """))
+    amount = 500 * KOBO_PER_NAIRA if existing and isinstance(existing["amount"]["type"], Integer) else 500.0
+    conn.execute(text("""
+        INSERT INTO click_to_earn_task (link, task_type, amount, updated_at)
+        SELECT 'https://example.com', 'mega', :amount, CURRENT_TIMESTAMP
+        WHERE NOT EXISTS (SELECT 1 FROM click_to_earn_task)
+    """), {"amount": amount})
+
+
+@migration(3, "task tiers")
+def _task_tiers(conn, progress):
+    """Per-tier task rewards (was scripts/migrate_add_task_columns.py)"""
+    add_column(conn, "tasks", "tier", "VARCHAR(10) DEFAULT 'both'")
+    add_column(conn, "tasks", "amount_alpha", "FLOAT NULL")
+    add_column(conn, "tasks", "amount_mega", "FLOAT NULL")
+
+
+@migration(4, "coupon types")
+def _coupon_types(conn, progress):
+    """MEGA/ALPHA coupons (was migrate_coupon_types.py)
+
+    Classifies existing coupons by bonus once, when the column is added; a
+    database where the old script already ran keeps its coupon types.
+    """
+    info = columns(conn, "coupons")
+    if not add_column(conn, "coupons", "coupon_type", "VARCHAR(10) DEFAULT 'mega' NOT NULL"):
+        return
+    scale = KOBO_PER_NAIRA if isinstance(info["bonus_amount"]["type"], Integer) else 1
+    backfill(conn, "coupons",
+             "coupon_type = CASE WHEN bonus_amount >= :threshold THEN 'alpha' ELSE 'mega' END, "
+             "bonus_amount = CASE WHEN bonus_amount >= :threshold THEN :alpha ELSE :mega END",
+             params={"threshold": 1500 * scale, "alpha": 2000 * scale, "mega": 700 * scale},
+             progress=progress)
+
+
+@migration(5, "admins table")
+def _admins_table(conn, progress):
+    """Copy admin/sub-admin users into their own table (was migrate_admins_to_table.py)
+
+    One INSERT ... SELECT; usernames already in admins are skipped.
+    """
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS admins (
+            id {backend_for(conn).serial_pk},
+            username VARCHAR(50) NOT NULL UNIQUE,
+            email VARCHAR(100) UNIQUE,
+            full_name VARCHAR(100),
+            password_hash VARCHAR(255) NOT NULL,
+            role VARCHAR(8) NOT NULL,
+            is_active BOOLEAN,
+            created_at TIMESTAMP,
+            last_login TIMESTAMP
+        )
+    """))
+    conn.execute(text("""
+        INSERT INTO admins (username, email, full_name, password_hash, role, is_active, created_at)
+        SELECT u.username, u.email, u.full_name, u.password_hash, u.role, u.is_active, u.created_at
+        FROM users u
+        WHERE u.role IN ('ADMIN', 'SUBADMIN')
+          AND NOT EXISTS (SELECT 1 FROM admins a WHERE a.username = u.username)
+    """))
+
+
+@migration(6, "secondary indexes")
+def _secondary_indexes(conn, progress):
+    """Hot-path indexes (migrate_add_indexes.INDEXES)"""
+    from migrate_add_indexes import INDEXES, index_statements
+
+    tables = set(inspect(conn).get_table_names())
+    for (name, table, _), sql in zip(INDEXES, index_statements()):
+        if table in tables:
+            conn.execute(text(sql))
+    conn.execute(text("ANALYZE"))
+
+
+@migration(7, "money as integer kobo",
+           opt_in="deploy together with the backend models declaring money columns as money.Kobo")
+def _money_to_kobo(conn, progress):
+    """FLOAT naira -> BIGINT kobo (migrate_money_to_kobo.py), verified per table"""
+    from migrate_money_to_kobo import convert_table, pending_columns
+
+    for table, cols in pending_columns(conn).items():
+        convert_table(conn, table, cols, progress=progress)
+
+
+@migration(8, "balance version")
+def _balance_version(conn, progress):
+    """balances.version for optimistic locking (balance_service.py)"""
+    from balance_service import install
+
+    install(conn)
+
+
+# -- runner -----------------------------------------------------------------
+
+def print_opt_in(version, name):
+    print(f"⏸️  {version:03d} {name} is opt-in (--include {version}): {OPT_IN[version]}")
+
+
+def migrate(engine, target=None, progress=None, include=()):
+    """Apply pending migrations in order, one transaction each; returns the versions applied"""
+    progress = progress or Progress()
+    with transaction(engine) as conn:
+        conn.execute(text(SCHEMA_VERSION_SQL))
+    with engine.connect() as conn:
+        pending = pending_migrations(conn, target, include)
+        skipped = skipped_migrations(conn, target, include)
+    for version, name, _ in skipped:
+        print_opt_in(version, name)
+    applied = []
+    for version, name, fn in pending:
+        if version in OPT_IN:
+            print(f"⚠️  {version:03d} {name}: {OPT_IN[version]}")
+        print(f"📦 {version:03d} {name}")
+        started = time.perf_counter()
+        with transaction(engine) as conn:
+            fn(conn, progress)
+            duration_ms = int((time.perf_counter() - started) * 1000)
+            conn.execute(RECORD_SQL, {"version": version, "name": name, "duration_ms": duration_ms})
+        print(f"✅ {version:03d} {name} ({duration_ms / 1000.0:.1f}s)")
+        applied.append(version)
+    return applied
+
+
+def main(argv=None):
+    global BATCH_ROWS
+    parser = argparse.ArgumentParser(description="Apply versioned schema migrations")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--status', action='store_true', help="Show applied and pending migrations")
+    parser.add_argument('--dry-run', action='store_true', help="List the migrations that would be applied")
+    parser.add_argument('--target', type=int, default=None, help="Stop after this version")
+    parser.add_argument('--batch-size', type=int, default=BATCH_ROWS, help="Rows per backfill/rebuild batch")
+    parser.add_argument('--include', type=int, action='append', default=[], metavar='VERSION',
+                        help="Also apply this opt-in migration (repeatable)")
+    args = parser.parse_args(argv)
+
+    BATCH_ROWS = args.batch_size
+    engine = get_engine(args.database_url)
+    try:
+        if args.status or args.dry_run:
+            with engine.connect() as conn:
+                applied = applied_versions(conn)
+                pending = pending_migrations(conn, args.target, args.include)
+                skipped = skipped_migrations(conn, args.target, args.include)
+            if args.status:
+                for version, (name, applied_at) in sorted(applied.items()):
+                    print(f"✅ {version:03d} {name} (applied {applied_at})")
+            for version, name, _ in pending:
+                print(f"⏳ {version:03d} {name}")
+            for version, name, _ in skipped:
+                print_opt_in(version, name)
+            if not pending:
+                print("✅ Schema is up to date")
+            return 0
+
+        applied = migrate(engine, args.target, include=args.include)
+        print(f"\n✅ Applied {len(applied)} migration(s)" if applied else "✅ Schema is up to date")
+    except Exception as e:
+        print(f"\n❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
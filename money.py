@@ -0,0 +1,174 @@
+"""
+Integer kobo money
+
+Every amount is stored as a whole number of kobo (1 naira = 100 kobo) in a
+BIGINT column. Sums, comparisons and reconciliation are exact integer
+arithmetic; there is no 0.01 epsilon anywhere because there is nothing to
+round. Conversion to and from naira happens at the API boundary only:
+
+    amount = to_kobo(body.amount)                  # request body (naira) -> kobo
+    return {"balance": to_naira(balance.total_balance)}   # kobo -> JSON naira
+
+Money is an int subclass, so it costs nothing to carry around and works
+anywhere an int does, but prints as naira:
+
+    >>> Money(123450)
+    Money(₦1,234.50)
+    >>> Money.from_naira("19.99") + 1
+    Money(₦20.00)
+
+Backend models declare money columns with the Kobo type, which refuses
+floats so an unconverted naira value cannot slip into the database:
+
+    from money import Kobo
+    activity_balance = Column(Kobo, default=0, nullable=False)
+
+Existing databases are converted by migrate_money_to_kobo.py (schema version 7
+in migrations.py, opt-in with --include 7), in the same release as the
+models switch to Kobo. Until then a database still holds FLOAT naira, so
+scripts that read or write money columns ask for the column's scale first,
+as migrations 2 and 4 do, and work in kobo on their side:
+
+    scale = money_scale(conn, "coupons", "bonus_amount")   # 100 (kobo) or 1 (naira)
+    conn.execute(..., {"bonus": to_stored(to_kobo(500), scale)})
+    print(format_naira(from_stored(row.bonus_amount, scale)))
+"""
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from sqlalchemy import inspect
+from sqlalchemy.types import BigInteger, Integer, TypeDecorator
+
+from db_backend import connection_of
+
+KOBO_PER_NAIRA = 100
+
+# Every money column, by table (derived tables included so they stay integer too)
+MONEY_COLUMNS = {
+    "balances": ("main_balance", "affiliate_balance", "activity_balance", "total_balance"),
+    "transactions": ("amount",),
+    "withdrawals": ("amount",),
+    "coupons": ("bonus_amount",),
+    "tasks": ("amount", "amount_alpha", "amount_mega"),
+    "click_to_earn_task": ("amount",),
+    "audios": ("amount",),
+    "streams": ("amount",),
+    "articles": ("earning_amount",),
+    "cards": ("price", "benefit_amount"),
+    "card_purchases": ("amount_paid", "benefit_received"),
+    "loans": ("amount", "total_amount"),
+    "leaderboard": ("affiliate_balance",),
+    "ledger_balances": ("net_amount",),
+}
+
+# transactions.balance_type / withdrawals.balance_type -> balances column
+BALANCE_COLUMNS = {
+    'ACTIVITY': 'activity_balance',
+    'REFERRAL': 'affiliate_balance',
+    'MAIN': 'main_balance',
+}
+
+
+def to_kobo(naira):
+    """Naira (int, float, str or Decimal) -> int kobo, rounding half up"""
+    if naira is None:
+        return None
+    try:
+        value = Decimal(str(naira)) * KOBO_PER_NAIRA
+    except InvalidOperation:
+        raise ValueError(f"Not an amount: {naira!r}")
+    return int(value.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def to_naira(kobo):
+    """Int kobo -> naira for JSON responses (exact for any realistic amount)"""
+    if kobo is None:
+        return None
+    return kobo / KOBO_PER_NAIRA
+
+
+def format_naira(kobo):
+    """Int kobo -> '₦1,234.50'"""
+    sign = "-" if kobo < 0 else ""
+    naira, kobo = divmod(abs(int(kobo)), KOBO_PER_NAIRA)
+    return f"{sign}₦{naira:,}.{kobo:02d}"
+
+
+def money_scale(bind, table, column):
+    """Stored units per naira: KOBO_PER_NAIRA once the column is integer kobo, 1 while it is FLOAT naira"""
+    for info in inspect(connection_of(bind)).get_columns(table):
+        if info["name"] == column:
+            return KOBO_PER_NAIRA if isinstance(info["type"], Integer) else 1
+    raise ValueError(f"No money column {table}.{column}")
+
+
+def to_stored(kobo, scale):
+    """Int kobo -> the value to write into a column of that scale"""
+    if kobo is None or scale == KOBO_PER_NAIRA:
+        return kobo
+    return kobo / KOBO_PER_NAIRA
+
+
+def from_stored(value, scale):
+    """A value read from a column of that scale -> int kobo"""
+    if value is None:
+        return None
+    return int(value) if scale == KOBO_PER_NAIRA else to_kobo(value)
+
+
+def stored_tolerance(kobo, scale):
+    """A tolerance in kobo in the column's units; on FLOAT naira at least half a kobo,
+    so float rounding noise is not reported as drift"""
+    if scale == KOBO_PER_NAIRA:
+        return kobo
+    return max(kobo, 0.5) / KOBO_PER_NAIRA
+
+
+class Money(int):
+    """An amount in kobo that behaves as an int and prints as naira"""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_naira(cls, naira):
+        return cls(to_kobo(naira))
+
+    @property
+    def naira(self):
+        return to_naira(int(self))
+
+    def __add__(self, other):
+        return Money(int(self) + other) if isinstance(other, int) else NotImplemented
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return Money(int(self) - other) if isinstance(other, int) else NotImplemented
+
+    def __rsub__(self, other):
+        return Money(other - int(self)) if isinstance(other, int) else NotImplemented
+
+    def __neg__(self):
+        return Money(-int(self))
+
+    def __str__(self):
+        return format_naira(self)
+
+    def __repr__(self):
+        return f"Money({format_naira(self)})"
+
+
+class Kobo(TypeDecorator):
+    """BIGINT money column: binds ints, returns Money, rejects floats"""
+
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, float):
+            raise TypeError(f"Money columns take int kobo, got float {value!r} - use to_kobo()")
+        return int(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else Money(value)
@@ -0,0 +1,353 @@
+"""
+Online backfills in small committed chunks
+
+Data backfills used to be one statement over the whole table
+(UPDATE tasks SET task_url = link) or a loop of per-row UPDATEs in a single
+transaction. On SQLite either holds the write lock for the entire run, so
+every claim, signup and withdrawal waits behind it.
+
+A backfill here walks the table by primary key in chunks of CHUNK_ROWS
+rows. Each chunk is its own short transaction:
+
+    UPDATE <table> SET <assignments> WHERE id > :last AND id <= :upper AND (<where>)
+    UPDATE backfill_state SET last_key = :upper, rows_done = ... WHERE name = :name
+
+so the checkpoint commits together with the rows it covers. Between chunks
+the runner sleeps long enough to keep the backfill's share of the write
+lock at --duty (0.25 = at most a quarter of the time), and a chunk that
+hits "database is locked" backs off and retries instead of failing. An
+interrupted backfill resumes from its checkpoint; --restart starts over
+(or runs a finished backfill again).
+
+Every backfill is written to be idempotent (its WHERE skips rows that are
+already correct), so re-running one is harmless.
+
+Schema changes stay in migrations.py; the column a backfill fills must
+already exist. Backfills that depend on the schema read it per chunk:
+coupon_type uses the unit of coupons.bonus_amount (money.money_scale) like
+migration 4, and total_balance bumps balances.version only when migration 8
+has added it. Small in-transaction backfills belong in the migration
+itself (migrations.backfill); use this for tables the app is writing to.
+
+Usage:
+    python online_backfill.py --list
+    python online_backfill.py task_url
+    python online_backfill.py total_balance --chunk 500 --duty 0.25
+    python online_backfill.py --status
+    python online_backfill.py --benchmark --database-url sqlite:////tmp/perf.db   # use a copy
+"""
+import argparse
+import statistics
+import sys
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from balance_reconciliation import EXPECTED_TOTAL, has_version
+from database import get_engine
+from money import money_scale
+
+CHUNK_ROWS = 1000
+DUTY_CYCLE = 0.5
+MAX_RETRIES = 20
+
+CREATE_STATE_SQL = """
+    CREATE TABLE IF NOT EXISTS backfill_state (
+        name VARCHAR(50) PRIMARY KEY,
+        table_name VARCHAR(50) NOT NULL,
+        last_key INTEGER,
+        rows_done INTEGER NOT NULL DEFAULT 0,
+        rows_changed INTEGER NOT NULL DEFAULT 0,
+        started_at TIMESTAMP,
+        updated_at TIMESTAMP,
+        finished_at TIMESTAMP
+    )
+"""
+
+STATE_SQL = text("SELECT last_key, rows_done, rows_changed, finished_at FROM backfill_state WHERE name = :name")
+
+START_SQL = text("""
+    INSERT INTO backfill_state (name, table_name, last_key, rows_done, rows_changed, started_at, updated_at)
+    VALUES (:name, :table_name, NULL, 0, 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+""")
+
+CHECKPOINT_SQL = text("""
+    UPDATE backfill_state
+    SET last_key = :last_key, rows_done = rows_done + :rows, rows_changed = rows_changed + :changed,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE name = :name
+""")
+
+FINISH_SQL = text("UPDATE backfill_state SET finished_at = CURRENT_TIMESTAMP WHERE name = :name")
+
+
+class BackfillSpec:
+    """One backfill: SET assignments for the rows of `table` matching `where`
+
+    `assignments` is SQL or a function(conn) returning it; `params` is a
+    function(conn) returning extra bind parameters for the UPDATE.
+    """
+
+    def __init__(self, table, assignments, where=None, key="id", description="", params=None):
+        self.table = table
+        self.assignments = assignments
+        self.where = where
+        self.key = key
+        self.description = description
+        self.params = params
+
+    def upper_sql(self):
+        # Key of the last row in the next chunk (rows, not key range, so gaps don't matter)
+        return text(f"SELECT {self.key} FROM {self.table} WHERE {self.key} > :last "
+                    f"ORDER BY {self.key} LIMIT 1 OFFSET :offset")
+
+    def update_sql(self, conn):
+        assignments = self.assignments(conn) if callable(self.assignments) else self.assignments
+        where = f" AND ({self.where})" if self.where else ""
+        return text(f"UPDATE {self.table} SET {assignments} "
+                    f"WHERE {self.key} > :last AND {self.key} <= :upper{where}")
+
+    def bind_params(self, conn):
+        return self.params(conn) if self.params else {}
+
+
+def _coupon_type_params(conn):
+    # ₦1,500 in the column's unit: kobo after migrate_money_to_kobo.py, naira before
+    return {"threshold": 1500 * money_scale(conn, "coupons", "bonus_amount")}
+
+
+def _total_balance_assignments(conn):
+    bump = ", version = version + 1" if has_version(conn) else ""
+    return f"total_balance = {EXPECTED_TOTAL}{bump}"
+
+
+BACKFILLS = {
+    # Column copy (schema version 1 added task_url next to the legacy link column)
+    "task_url": BackfillSpec(
+        "tasks", "task_url = link", "task_url IS NULL AND link IS NOT NULL",
+        description="copy tasks.link into tasks.task_url"),
+    # Type re-derivation: coupons without a type get it from their bonus
+    "coupon_type": BackfillSpec(
+        "coupons", "coupon_type = CASE WHEN bonus_amount >= :threshold THEN 'alpha' ELSE 'mega' END",
+        "coupon_type IS NULL OR coupon_type = ''",
+        description="derive coupons.coupon_type from bonus_amount", params=_coupon_type_params),
+    # Denormalized field: total_balance = activity + affiliate (main_balance is tracked
+    # separately; same formula as balance_reconciliation.py). Bumps version, where
+    # installed, like every balance writer so optimistic-lock readers see the change
+    "total_balance": BackfillSpec(
+        "balances", _total_balance_assignments,
+        f"total_balance IS NULL OR total_balance <> {EXPECTED_TOTAL}",
+        key="user_id", description="recompute balances.total_balance"),
+}
+
+
+def ensure_state_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(CREATE_STATE_SQL))
+
+
+def load_state(engine, name, table, restart=False):
+    """Checkpoint row for a backfill, created (or reset with restart) as needed"""
+    with engine.begin() as conn:
+        if restart:
+            conn.execute(text("DELETE FROM backfill_state WHERE name = :name"), {"name": name})
+        state = conn.execute(STATE_SQL, {"name": name}).mappings().first()
+        if state is None:
+            conn.execute(START_SQL, {"name": name, "table_name": table})
+            state = conn.execute(STATE_SQL, {"name": name}).mappings().first()
+        return dict(state)
+
+
+def _remaining(engine, spec, last):
+    with engine.connect() as conn:
+        return conn.execute(text(f"SELECT COUNT(*) FROM {spec.table} WHERE {spec.key} > :last"),
+                            {"last": last if last is not None else -1}).scalar()
+
+
+def run_chunk(engine, name, spec, last, chunk):
+    """Apply one chunk and its checkpoint in one transaction; returns (upper, rows, changed)"""
+    last = last if last is not None else -1
+    with engine.begin() as conn:
+        upper = conn.execute(spec.upper_sql(), {"last": last, "offset": chunk - 1}).scalar()
+        if upper is None:
+            upper = conn.execute(text(f"SELECT MAX({spec.key}) FROM {spec.table}")).scalar()
+            if upper is None or upper <= last:
+                return None, 0, 0
+        rows = conn.execute(text(f"SELECT COUNT(*) FROM {spec.table} WHERE {spec.key} > :last AND {spec.key} <= :upper"),
+                            {"last": last, "upper": upper}).scalar()
+        params = {"last": last, "upper": upper, **spec.bind_params(conn)}
+        changed = conn.execute(spec.update_sql(conn), params).rowcount
+        conn.execute(CHECKPOINT_SQL, {"name": name, "last_key": upper, "rows": rows, "changed": changed})
+    return upper, rows, changed
+
+
+def _is_locked(error):
+    return "locked" in str(error).lower() or "busy" in str(error).lower()
+
+
+def run_backfill(engine, name, spec=None, chunk=CHUNK_ROWS, duty=DUTY_CYCLE, restart=False,
+                 max_chunks=None, quiet=False):
+    """Run (or resume) a backfill to completion; returns its final state"""
+    spec = spec or BACKFILLS[name]
+    ensure_state_table(engine)
+    state = load_state(engine, name, spec.table, restart)
+    if state["finished_at"] is not None:
+        return state
+    last = state["last_key"]
+    total = state["rows_done"] + _remaining(engine, spec, last)
+    done, changed = state["rows_done"], state["rows_changed"]
+    started, started_done = time.perf_counter(), done
+    chunks = retries = 0
+    while max_chunks is None or chunks < max_chunks:
+        chunk_started = time.perf_counter()
+        try:
+            upper, rows, chunk_changed = run_chunk(engine, name, spec, last, chunk)
+        except OperationalError as e:
+            retries += 1
+            if not _is_locked(e) or retries > MAX_RETRIES:
+                raise
+            time.sleep(min(2.0, 0.05 * 2 ** retries))
+            continue
+        retries = 0
+        if upper is None:
+            with engine.begin() as conn:
+                conn.execute(FINISH_SQL, {"name": name})
+            break
+        last, chunks = upper, chunks + 1
+        done += rows
+        changed += chunk_changed
+        held = time.perf_counter() - chunk_started
+        if not quiet:
+            rate = (done - started_done) / (time.perf_counter() - started)
+            eta = (total - done) / rate if rate else 0.0
+            line = f"   {name}: {done:,}/{total:,} rows ({100.0 * done / max(total, 1):.0f}%), {changed:,} changed"
+            print(f"{line}, {rate:,.0f} rows/s, ETA {eta:.0f}s".ljust(90), end="\r", flush=True)
+        # Sleep so the chunk's lock time is at most `duty` of the wall clock
+        if duty < 1.0:
+            time.sleep(held * (1.0 - duty) / duty)
+    if not quiet:
+        print()
+    return load_state(engine, name, spec.table)
+
+
+def print_status(engine):
+    ensure_state_table(engine)
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT * FROM backfill_state ORDER BY started_at")).mappings().all()
+    if not rows:
+        print("No backfills have run")
+    for row in rows:
+        mark = "✅" if row["finished_at"] else "⏳"
+        print(f"{mark} {row['name']} on {row['table_name']}: {row['rows_done']:,} rows scanned, "
+              f"{row['rows_changed']:,} changed, checkpoint {row['last_key']}, updated {row['updated_at']}")
+
+
+# -- benchmark: live writes during a backfill -------------------------------
+
+def _live_writer(engine, stop, latencies, user_ids):
+    """Small balance updates, as the app's write paths would issue, timing each commit"""
+    i = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("UPDATE balances SET updated_at = CURRENT_TIMESTAMP WHERE user_id = :user_id"),
+                             {"user_id": user_ids[i % len(user_ids)]})
+            latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            latencies.append(float("inf"))
+        i += 1
+        time.sleep(0.005)
+
+
+def _measure(engine, work):
+    stop = threading.Event()
+    latencies = []
+    with engine.connect() as conn:
+        user_ids = [row[0] for row in conn.execute(text("SELECT user_id FROM balances LIMIT 1000"))]
+    writer = threading.Thread(target=_live_writer, args=(engine, stop, latencies, user_ids))
+    writer.start()
+    started = time.perf_counter()
+    try:
+        work()
+    finally:
+        elapsed = time.perf_counter() - started
+        stop.set()
+        writer.join()
+    finite = sorted(l for l in latencies if l != float("inf"))
+    return {
+        "elapsed": elapsed,
+        "writes": len(latencies),
+        "failed": len(latencies) - len(finite),
+        "p50_ms": statistics.median(finite) * 1000.0 if finite else 0.0,
+        "max_ms": finite[-1] * 1000.0 if finite else 0.0,
+    }
+
+
+def run_benchmark(engine, chunk, duty):
+    # Rewrites every transactions row: the worst case for a backfill
+    spec = BackfillSpec("transactions", "description = description", description="benchmark")
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT COUNT(*) FROM transactions")).scalar()
+    print(f"Rewriting {rows:,} transactions rows while a writer updates balances every 5 ms\n")
+
+    def single_statement():
+        with engine.begin() as conn:
+            conn.execute(text(f"UPDATE {spec.table} SET {spec.assignments}"))
+
+    def chunked():
+        run_backfill(engine, "__benchmark", spec, chunk=chunk, duty=duty, restart=True, quiet=True)
+
+    results = [("single UPDATE", _measure(engine, single_statement)),
+               (f"online ({chunk} rows, duty {duty})", _measure(engine, chunked))]
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM backfill_state WHERE name = '__benchmark'"))
+    for label, r in results:
+        print(f"{label:<28} {r['elapsed']:6.1f}s  live writes: {r['writes']:5d}, "
+              f"p50 {r['p50_ms']:7.1f} ms, max {r['max_ms']:8.1f} ms, failed {r['failed']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run resumable, throttled online backfills")
+    parser.add_argument('name', nargs='?', choices=sorted(BACKFILLS), help="Backfill to run or resume")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--chunk', type=int, default=CHUNK_ROWS, help="Rows per committed chunk")
+    parser.add_argument('--duty', type=float, default=DUTY_CYCLE, help="Max fraction of time spent holding the write lock (0-1]")
+    parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and start over")
+    parser.add_argument('--list', action='store_true', help="List the available backfills")
+    parser.add_argument('--status', action='store_true', help="Show checkpoints of started backfills")
+    parser.add_argument('--benchmark', action='store_true', help="Compare live write latency: single UPDATE vs online backfill")
+    args = parser.parse_args(argv)
+
+    if not 0 < args.duty <= 1:
+        parser.error("--duty must be in (0, 1]")
+    if args.list:
+        for name, spec in sorted(BACKFILLS.items()):
+            print(f"{name:<15} {spec.table:<10} {spec.description}")
+        return 0
+
+    engine = get_engine(args.database_url)
+    try:
+        if args.status:
+            print_status(engine)
+        elif args.benchmark:
+            run_benchmark(engine, args.chunk, args.duty)
+        elif args.name:
+            print(f"📦 {args.name}: {BACKFILLS[args.name].description}")
+            state = run_backfill(engine, args.name, chunk=args.chunk, duty=args.duty, restart=args.restart)
+            print(f"✅ {args.name}: {state['rows_done']:,} rows scanned, {state['rows_changed']:,} changed")
+        else:
+            parser.print_help()
+            return 1
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,413 @@
+"""
+Server-push update channel (Server-Sent Events)
+
+The dashboard, tasks and leaderboard pages used to poll their full endpoints
+every 30-60 s whether or not anything had changed. Instead, each open page
+holds one SSE stream and the backend pushes small deltas when something
+actually happens:
+
+    event: balance       {"activity": 1250.0, "total": 4250.0}      (changed fields only)
+    event: task          {"task_id": 7, "status": "completed"}
+    event: notification  {"id": 91, "title": "...", "message": "..."}
+    event: leaderboard   {"top": [{"rank": 1, "username": ..., "affiliate_earnings": ...}, ...]}
+    event: resync        {}    (the client fell behind; re-fetch everything once)
+
+js/api.js (api.push) consumes the stream and falls back to polling while it
+is disconnected.
+
+Backend wiring (FastAPI is imported lazily so this module also runs without it):
+
+    from push_channel import broker, create_router
+    app.include_router(create_router(user_id_from_token), prefix="/api")
+
+    # after the commit that changed the data
+    broker.publish_balance(user.id, {"activity": to_naira(b.activity_balance), "total": to_naira(b.total_balance)})
+    broker.publish_task_status(user.id, task.id, "completed")
+    broker.publish_notification(user.id, {"id": n.id, "title": n.title, "message": n.message})
+    broker.publish_leaderboard(leaderboard.get_top_earners(db, 20))
+
+Publishing is thread-safe, so sync route handlers can call it directly.
+
+The page never puts its JWT in the stream URL (URLs end up in access logs):
+it POSTs /events/token for a stream token, valid for STREAM_TOKEN_TTL
+seconds and a single connection, and opens the stream with that. Set
+$STREAM_TOKEN_SECRET when the API runs several worker processes.
+
+Usage (benchmark: real SSE clients over TCP against a live broker, no FastAPI needed):
+    python push_channel.py --clients 500 --events 5000 --broadcasts 20
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from admin_export import ExportTokens
+from money import KOBO_PER_NAIRA, from_stored, to_naira
+
+HEARTBEAT_SECONDS = 15.0
+RETRY_MILLISECONDS = 5000
+# Events buffered per connection before it is told to resync instead
+QUEUE_SIZE = 100
+STREAM_TOKEN_TTL = 60
+STREAM_TOKEN_NAME = "events"
+
+# Fields compared for the leaderboard; a broadcast only goes out when one changes
+LEADERBOARD_FIELDS = ("rank", "user_id", "username", "full_name", "affiliate_earnings", "referral_count")
+
+
+def format_event(event_id, event, data):
+    """Encode one SSE message"""
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, default=str, separators=(',', ':'))}\n\n"
+
+
+class Subscription:
+    """One open event stream, bound to the event loop that reads it"""
+
+    def __init__(self, user_id, loop, queue_size=QUEUE_SIZE):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # A stalled client must not hold memory forever: drop the backlog
+            # and let it re-fetch once when it catches up
+            self.overflowed = True
+
+    def deliver(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            pass  # loop already closed; the stream is going away
+
+    async def next_message(self, timeout):
+        """Next SSE message, a resync, or None when nothing arrived within timeout"""
+        if self.overflowed:
+            self.overflowed = False
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            return format_event(0, "resync", {})
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class PushBroker:
+    """In-process fan-out of per-user and broadcast events"""
+
+    def __init__(self):
+        self._subscriptions = {}  # user_id -> set of Subscription
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._balances = {}  # user_id -> last balance pushed
+        self._leaderboard = None
+        self.published = 0
+
+    def subscribe(self, user_id):
+        """Register a stream for user_id; must be called from the loop that reads it"""
+        subscription = Subscription(user_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subs = self._subscriptions.get(subscription.user_id)
+            if subs:
+                subs.discard(subscription)
+                if not subs:
+                    del self._subscriptions[subscription.user_id]
+                    self._balances.pop(subscription.user_id, None)
+
+    def connection_count(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._subscriptions.values())
+
+    def publish(self, user_id, event, data):
+        """Send an event to one user's streams, or to everyone when user_id is None
+
+        Returns the number of streams it was queued for.
+        """
+        with self._lock:
+            if user_id is None:
+                targets = [s for subs in self._subscriptions.values() for s in subs]
+            else:
+                targets = list(self._subscriptions.get(user_id, ()))
+            message = format_event(next(self._ids), event, data)
+        for subscription in targets:
+            subscription.deliver(message)
+        self.published += len(targets)
+        return len(targets)
+
+    def publish_balance(self, user_id, balance):
+        """Push only the balance fields that changed since the last push to this user"""
+        with self._lock:
+            if user_id not in self._subscriptions:
+                return 0
+            previous = self._balances.get(user_id, {})
+            delta = {key: value for key, value in balance.items() if previous.get(key) != value}
+            self._balances[user_id] = {**previous, **balance}
+        if not delta:
+            return 0
+        return self.publish(user_id, "balance", delta)
+
+    def publish_task_status(self, user_id, task_id, status):
+        return self.publish(user_id, "task", {"task_id": task_id, "status": str(status).lower()})
+
+    def publish_notification(self, user_id, notification):
+        return self.publish(user_id, "notification", notification)
+
+    def publish_leaderboard(self, top, scale=KOBO_PER_NAIRA):
+        """Broadcast the top earners, but only when the visible ranking changed
+
+        Accepts rows from leaderboard.get_top_earners() (affiliate_balance as
+        stored, `scale` = money_scale() of balances.affiliate_balance) or
+        already in the API shape (affiliate_earnings in naira).
+        """
+        rows = []
+        for row in top:
+            row = dict(row)
+            if "affiliate_earnings" not in row:
+                row["affiliate_earnings"] = to_naira(from_stored(row.pop("affiliate_balance", 0), scale))
+            rows.append({field: row.get(field) for field in LEADERBOARD_FIELDS})
+        with self._lock:
+            if rows == self._leaderboard:
+                return 0
+            self._leaderboard = rows
+        return self.publish(None, "leaderboard", {"top": rows})
+
+
+broker = PushBroker()
+
+
+async def event_stream(subscription, is_disconnected, heartbeat=HEARTBEAT_SECONDS):
+    """The SSE body for one subscription, until `await is_disconnected()` is true"""
+    yield f"retry: {RETRY_MILLISECONDS}\n\n"
+    while not await is_disconnected():
+        message = await subscription.next_message(heartbeat)
+        # Comment lines keep proxies from closing an idle stream
+        yield message if message is not None else ": keep-alive\n\n"
+
+
+def create_router(authenticate, push_broker=None, heartbeat=HEARTBEAT_SECONDS, tokens=None):
+    """FastAPI router exposing POST /events/token and GET /events as an SSE stream
+
+    `authenticate(token)` returns the user id or raises HTTPException(401);
+    it checks the bearer token of the token request only. EventSource cannot
+    send an Authorization header, so the stream URL carries a single-use
+    stream token (admin_export.ExportTokens) instead of the JWT.
+    """
+    from fastapi import APIRouter, Header, HTTPException, Request
+    from fastapi.responses import StreamingResponse
+
+    push_broker = push_broker or broker
+    tokens = tokens or ExportTokens(secret=os.getenv("STREAM_TOKEN_SECRET"), ttl=STREAM_TOKEN_TTL)
+    router = APIRouter()
+
+    @router.post("/events/token")
+    def stream_token(authorization: str = Header(default="")):
+        user_id = authenticate(authorization.removeprefix("Bearer ").strip())
+        return {"token": tokens.issue(user_id, STREAM_TOKEN_NAME), "expires_in": tokens.ttl}
+
+    @router.get("/events")
+    async def events(request: Request, token: str):
+        try:
+            user_id = tokens.redeem(token, STREAM_TOKEN_NAME)
+        except ValueError as e:
+            raise HTTPException(status_code=401, detail=str(e))
+        subscription = push_broker.subscribe(user_id)
+
+        async def stream():
+            try:
+                async for chunk in event_stream(subscription, request.is_disconnected, heartbeat):
+                    yield chunk
+            finally:
+                push_broker.unsubscribe(subscription)
+
+        return StreamingResponse(stream(), media_type="text/event-stream", headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        })
+
+    return router
+
+
+# -- SSE fan-out benchmark ---------------------------------------------------
+
+async def serve_events(push_broker, tokens, host="127.0.0.1", port=0, heartbeat=HEARTBEAT_SECONDS):
+    """Minimal HTTP/1.1 server for GET /events?token=..., the same stream create_router() serves
+
+    Lets the benchmark run real SSE connections without FastAPI; returns the
+    asyncio Server.
+    """
+
+    async def handle(reader, writer):
+        subscription = None
+        try:
+            request_line = (await reader.readline()).decode("latin-1")
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  # headers are not needed
+            query = parse_qs(urlsplit(request_line.split(" ")[1]).query) if " " in request_line else {}
+            try:
+                user_id = tokens.redeem(query.get("token", [""])[0], STREAM_TOKEN_NAME)
+            except ValueError:
+                writer.write(b"HTTP/1.1 401 Unauthorized\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                return
+            subscription = push_broker.subscribe(user_id)
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n\r\n")
+
+            async def is_disconnected():
+                return reader.at_eof() or writer.is_closing()
+
+            async for chunk in event_stream(subscription, is_disconnected, heartbeat):
+                writer.write(chunk.encode())
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if subscription is not None:
+                push_broker.unsubscribe(subscription)
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port, limit=2 ** 20)
+
+
+async def read_events(reader):
+    """Yield (event, data) pairs from an SSE response, skipping the HTTP headers"""
+    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+        pass
+    event, data = None, []
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        line = line.decode().rstrip("\r\n")
+        if not line:
+            if event is not None:
+                yield event, json.loads("\n".join(data) or "null")
+            event, data = None, []
+        elif line.startswith("event: "):
+            event = line[7:]
+        elif line.startswith("data: "):
+            data.append(line[6:])
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+async def run_benchmark(clients, events, broadcasts, seed=42, timeout=60.0):
+    """Connect `clients` SSE streams to a live broker and time event delivery
+
+    Each client is a real TCP connection reading the stream. `events` are
+    published to random users and `broadcasts` leaderboard updates to all of
+    them; every payload carries its publish time, so the result is the
+    measured publish-to-client latency and delivery rate.
+    """
+    rng = random.Random(seed)
+    push = PushBroker()
+    tokens = ExportTokens(ttl=STREAM_TOKEN_TTL)
+    server = await serve_events(push, tokens)
+    port = server.sockets[0].getsockname()[1]
+
+    latencies = []
+    received = [0]
+    writers = []
+
+    async def client(user_id):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=2 ** 20)
+        writers.append(writer)
+        token = tokens.issue(user_id, STREAM_TOKEN_NAME)
+        writer.write(f"GET /events?token={token} HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n\r\n".encode())
+        await writer.drain()
+        async for event, data in read_events(reader):
+            now = time.perf_counter()
+            if event == "task":
+                latencies.append(now - data["sent"])
+            elif event == "leaderboard":
+                latencies.append(now - data["top"][0]["referral_count"])
+            received[0] += 1
+
+    started = time.perf_counter()
+    readers = [asyncio.create_task(client(user_id)) for user_id in range(clients)]
+    while push.connection_count() < clients:
+        await asyncio.sleep(0.01)
+    connect_seconds = time.perf_counter() - started
+
+    expected = 0
+    started = time.perf_counter()
+    for i in range(events):
+        expected += push.publish(rng.randrange(clients), "task", {"task_id": i, "status": "completed", "sent": time.perf_counter()})
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+    for i in range(broadcasts):
+        # referral_count doubles as the send time so every broadcast differs
+        expected += push.publish_leaderboard([{"rank": 1, "user_id": 1, "username": "user1",
+                                               "affiliate_earnings": i, "referral_count": time.perf_counter()}])
+        await asyncio.sleep(0)
+    deadline = time.monotonic() + timeout
+    while received[0] < expected and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    delivery_seconds = time.perf_counter() - started
+
+    for writer in writers:
+        writer.close()
+    for task in readers:
+        task.cancel()
+    await asyncio.gather(*readers, return_exceptions=True)
+    # Streams notice a closed client on their next message; wake them all up
+    await asyncio.sleep(0.1)
+    push.publish(None, "resync", {})
+    deadline = time.monotonic() + 5
+    while push.connection_count() and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    server.close()
+    await server.wait_closed()
+    return {
+        "clients": clients,
+        "connect_seconds": connect_seconds,
+        "expected": expected,
+        "received": received[0],
+        "delivery_seconds": delivery_seconds,
+        "events_per_second": received[0] / delivery_seconds if delivery_seconds else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the push channel with real SSE clients")
+    parser.add_argument('--clients', type=int, default=500, help="Concurrent SSE connections")
+    parser.add_argument('--events', type=int, default=5000, help="Per-user events published")
+    parser.add_argument('--broadcasts', type=int, default=20, help="Leaderboard broadcasts to every client")
+    args = parser.parse_args(argv)
+
+    try:
+        result = asyncio.run(run_benchmark(args.clients, args.events, args.broadcasts))
+    except OSError as e:
+        print(f"❌ Error: {e} (raise the open-file limit with `ulimit -n` for more clients)")
+        return 1
+    print(f"📡 {result['clients']:,} SSE clients connected in {result['connect_seconds']:.2f}s")
+    print(f"   Delivered {result['received']:,}/{result['expected']:,} events in {result['delivery_seconds']:.2f}s "
+          f"({result['events_per_second']:,.0f}/s)")
+    print(f"   Publish-to-client latency: p50 {result['p50_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms")
+    if result["received"] < result["expected"]:
+        print("⚠️  Some events were not delivered (slow clients are sent a resync instead)")
+        return 1
+    print("✅ All events delivered")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
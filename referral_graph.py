@@ -0,0 +1,228 @@
+"""
+Referral graph index
+
+Referrals are stored only as users.referred_by = <referrer's referral_code>,
+so counting or listing them means scanning and grouping the users table.
+This module keeps an integer adjacency table plus maintained counters:
+
+    referral_edges(user_id, referrer_id)                 # one row per referred user
+    referral_stats(user_id, referral_count, downline_size)
+
+referral_count (direct referrals) and downline_size (all levels) are O(1)
+lookups. Multi-level downlines and uplines are walked with recursive CTEs
+over the indexed edge table.
+
+Backend write path (same transaction as the user insert):
+
+    record_signup(db, user.id, user.referred_by)
+
+Usage:
+    python referral_graph.py --rebuild
+    python referral_graph.py --user 42 --depth 3
+"""
+import argparse
+import sys
+
+from sqlalchemy import text
+
+from database import get_engine
+
+# Guards the recursive walks against bad data (a referral cycle)
+MAX_DEPTH = 64
+
+CREATE_TABLES_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS referral_edges (
+        user_id INTEGER PRIMARY KEY,
+        referrer_id INTEGER NOT NULL,
+        created_at TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_referral_edges_referrer ON referral_edges (referrer_id, user_id)",
+    """
+    CREATE TABLE IF NOT EXISTS referral_stats (
+        user_id INTEGER PRIMARY KEY,
+        referral_count INTEGER NOT NULL DEFAULT 0,
+        downline_size INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+]
+
+REBUILD_EDGES_SQL = text("""
+    INSERT INTO referral_edges (user_id, referrer_id, created_at)
+    SELECT u.id, r.id, u.created_at
+    FROM users u
+    JOIN users r ON r.referral_code = u.referred_by
+    WHERE u.referred_by IS NOT NULL AND r.id != u.id
+""")
+
+REBUILD_STATS_SQL = text("""
+    WITH RECURSIVE ancestors(user_id, ancestor_id, depth) AS (
+        SELECT user_id, referrer_id, 1 FROM referral_edges
+        UNION ALL
+        SELECT a.user_id, e.referrer_id, a.depth + 1
+        FROM ancestors a
+        JOIN referral_edges e ON e.user_id = a.ancestor_id
+        WHERE a.depth < :max_depth
+    ),
+    direct AS (
+        SELECT referrer_id AS user_id, COUNT(*) AS referral_count
+        FROM referral_edges GROUP BY referrer_id
+    ),
+    downline AS (
+        SELECT ancestor_id AS user_id, COUNT(*) AS downline_size
+        FROM ancestors GROUP BY ancestor_id
+    )
+    INSERT INTO referral_stats (user_id, referral_count, downline_size)
+    SELECT u.id, COALESCE(direct.referral_count, 0), COALESCE(downline.downline_size, 0)
+    FROM users u
+    LEFT JOIN direct ON direct.user_id = u.id
+    LEFT JOIN downline ON downline.user_id = u.id
+""")
+
+# Every ancestor of :referrer_id, the referrer included
+BUMP_UPLINE_SQL = text("""
+    WITH RECURSIVE upline(user_id, depth) AS (
+        SELECT :referrer_id, 1
+        UNION ALL
+        SELECT e.referrer_id, u.depth + 1
+        FROM referral_edges e
+        JOIN upline u ON e.user_id = u.user_id
+        WHERE u.depth < :max_depth
+    )
+    UPDATE referral_stats
+    SET downline_size = downline_size + 1
+    WHERE user_id IN (SELECT user_id FROM upline)
+""")
+
+DOWNLINE_SQL = text("""
+    WITH RECURSIVE downline(user_id, depth) AS (
+        SELECT user_id, 1 FROM referral_edges WHERE referrer_id = :user_id
+        UNION ALL
+        SELECT e.user_id, d.depth + 1
+        FROM referral_edges e
+        JOIN downline d ON e.referrer_id = d.user_id
+        WHERE d.depth < :max_depth
+    )
+    SELECT d.user_id, d.depth, u.username, u.full_name, u.created_at
+    FROM downline d
+    JOIN users u ON u.id = d.user_id
+    ORDER BY d.depth, d.user_id
+""")
+
+UPLINE_SQL = text("""
+    WITH RECURSIVE upline(user_id, depth) AS (
+        SELECT referrer_id, 1 FROM referral_edges WHERE user_id = :user_id
+        UNION ALL
+        SELECT e.referrer_id, up.depth + 1
+        FROM referral_edges e
+        JOIN upline up ON e.user_id = up.user_id
+        WHERE up.depth < :max_depth
+    )
+    SELECT up.user_id, up.depth, u.username, u.referral_code
+    FROM upline up
+    JOIN users u ON u.id = up.user_id
+    ORDER BY up.depth
+""")
+
+
+def ensure_tables(db):
+    for sql in CREATE_TABLES_SQL:
+        db.execute(text(sql))
+
+
+def rebuild_graph(db):
+    """Rebuild edges and counters from users.referred_by; returns the edge count"""
+    ensure_tables(db)
+    db.execute(text("DELETE FROM referral_edges"))
+    db.execute(text("DELETE FROM referral_stats"))
+    db.execute(REBUILD_EDGES_SQL)
+    db.execute(REBUILD_STATS_SQL, {"max_depth": MAX_DEPTH})
+    return db.execute(text("SELECT COUNT(*) FROM referral_edges")).scalar()
+
+
+def record_signup(db, user_id, referral_code=None):
+    """Index a newly registered user and, if referred, bump the referrer's upline
+
+    Returns the referrer's user id, or None if the user was not referred
+    (or the code does not exist).
+    """
+    db.execute(
+        text("INSERT INTO referral_stats (user_id, referral_count, downline_size) VALUES (:user_id, 0, 0)"),
+        {"user_id": user_id},
+    )
+    if not referral_code:
+        return None
+
+    referrer_id = db.execute(
+        text("SELECT id FROM users WHERE referral_code = :code"),
+        {"code": referral_code},
+    ).scalar()
+    if referrer_id is None or referrer_id == user_id:
+        return None
+
+    db.execute(
+        text("INSERT INTO referral_edges (user_id, referrer_id, created_at) VALUES (:user_id, :referrer_id, CURRENT_TIMESTAMP)"),
+        {"user_id": user_id, "referrer_id": referrer_id},
+    )
+    db.execute(
+        text("UPDATE referral_stats SET referral_count = referral_count + 1 WHERE user_id = :referrer_id"),
+        {"referrer_id": referrer_id},
+    )
+    db.execute(BUMP_UPLINE_SQL, {"referrer_id": referrer_id, "max_depth": MAX_DEPTH})
+    return referrer_id
+
+
+def get_stats(db, user_id):
+    """Return {'referral_count', 'downline_size'} for a user (zeros if unknown)"""
+    row = db.execute(
+        text("SELECT referral_count, downline_size FROM referral_stats WHERE user_id = :user_id"),
+        {"user_id": user_id},
+    ).mappings().first()
+    return dict(row) if row else {"referral_count": 0, "downline_size": 0}
+
+
+def get_downline(db, user_id, max_depth=1):
+    """Return everyone referred by user_id down to max_depth levels, with their depth"""
+    max_depth = min(max_depth, MAX_DEPTH)
+    return [dict(row) for row in db.execute(DOWNLINE_SQL, {"user_id": user_id, "max_depth": max_depth}).mappings()]
+
+
+def get_upline(db, user_id, max_depth=MAX_DEPTH):
+    """Return the chain of referrers above user_id, nearest first"""
+    max_depth = min(max_depth, MAX_DEPTH)
+    return [dict(row) for row in db.execute(UPLINE_SQL, {"user_id": user_id, "max_depth": max_depth}).mappings()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain and query the referral graph index")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild edges and counters from users.referred_by")
+    parser.add_argument('--user', type=int, default=None, help="Show stats and downline for this user id")
+    parser.add_argument('--depth', type=int, default=1, help="Downline depth to show")
+    args = parser.parse_args(argv)
+
+    engine = get_engine(args.database_url)
+    try:
+        if args.rebuild:
+            with engine.begin() as conn:
+                edges = rebuild_graph(conn)
+            print(f"✅ Referral graph rebuilt with {edges:,} edge(s)")
+
+        if args.user is not None:
+            with engine.connect() as conn:
+                stats = get_stats(conn, args.user)
+                downline = get_downline(conn, args.user, args.depth)
+            print(f"\nUser {args.user}: {stats['referral_count']} direct referral(s), downline of {stats['downline_size']}")
+            for row in downline:
+                print(f"{'  ' * row['depth']}L{row['depth']} {row['username']} (id={row['user_id']})")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
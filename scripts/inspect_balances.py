@@ -36,15 +36,15 @@ session.close()
 print('\nComputing net referral amounts from transactions and comparing to stored balances:')
 from sqlalchemy import func, case
 
+# For every user (not just the top 50) use: python ledger_materializer.py
 net_rows = session.query(
     User.id,
     User.username,
-    func.coalesce(func.sum(case((Transaction.type == 'credit', Transaction.amount), else_=-Transaction.amount)), 0).label('net_ref')
-).join(Transaction, Transaction.user_id == User.id).filter(Transaction.balance_type == 'referral').group_by(User.id).order_by(desc('net_ref')).limit(50).all()
+    func.coalesce(func.sum(case((Transaction.type == 'credit', Transaction.amount), else_=-Transaction.amount)), 0).label('net_ref'),
+    Balance.affiliate_balance
+).join(Transaction, Transaction.user_id == User.id).outerjoin(Balance, Balance.user_id == User.id).filter(Transaction.balance_type == 'referral').group_by(User.id, Balance.affiliate_balance).order_by(desc('net_ref')).limit(50).all()
 
-for uid, uname, net in net_rows:
-    user = session.query(User).filter(User.id == uid).first()
-    stored = user.balance.affiliate_balance if user.balance else None
+for uid, uname, net, stored in net_rows:
     print(f"- {uname} (id={uid}): net_ref_from_tx={net}, stored_affiliate_balance={stored}")
 
 session.close()
@@ -1,52 +1,235 @@
 #!/usr/bin/env python3
 """
-Simple HTTP server to serve the Affluence frontend
+HTTP server to serve the Affluence frontend
 Run this from the root directory of the project
+
+- Threaded: one slow client no longer blocks everyone else
+- Text assets are pre-compressed once (gzip, plus brotli if the `brotli`
+  package is installed) and served according to Accept-Encoding
+- Strong ETags with If-None-Match -> 304 Not Modified
+- Fingerprinted assets (e.g. js/api.3f2a9c1b.js from build_frontend.py) get
+  long-lived immutable caching; everything else is revalidated with its ETag
+- Uncompressed files are sent with sendfile() (zero-copy)
+
+Usage:
+    python serve_frontend.py [--port 3001] [--root dist]
 """
 
+import argparse
+import gzip
+import hashlib
 import http.server
-import socketserver
 import os
+import re
+import threading
 from pathlib import Path
 
+from http_cache import etag_matches
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 # Configuration
 PORT = 3001  # Changed from 3000 to avoid conflicts
 DIRECTORY = Path(__file__).parent
 
+COMPRESSIBLE_TYPES = ('.html', '.js', '.css', '.json', '.svg', '.txt', '.map', '.xml')
+MIN_COMPRESS_SIZE = 512
+# Directories never worth pre-compressing at startup (still served on demand)
+SKIP_DIRS = {'.git', 'backups', '__pycache__', 'node_modules'}
+FINGERPRINTED = re.compile(r'\.[0-9a-f]{8,}\.[A-Za-z0-9]+$')
+
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE = 'no-cache'
+
+
+class Asset:
+    """A file's validators and pre-compressed bodies"""
+
+    def __init__(self, path, stat):
+        self.path = path
+        self.mtime = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.etag = None
+        self.encoded = {}  # encoding -> bytes
+
+    def load(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()[:20]
+        self.etag = f'"{digest}"'
+        if self.path.endswith(COMPRESSIBLE_TYPES) and len(data) >= MIN_COMPRESS_SIZE:
+            self.encoded['gzip'] = gzip.compress(data, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.encoded['br'] = brotli.compress(data, quality=11)
+        return self
+
+    def etag_for(self, encoding):
+        # Each representation needs its own strong validator
+        return self.etag if encoding is None else f'{self.etag[:-1]}-{encoding}"'
+
+
+class AssetCache:
+    """Thread-safe cache of Assets, refreshed when a file's mtime or size changes"""
+
+    def __init__(self):
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        asset = self._assets.get(path)
+        if asset is None or asset.mtime != stat.st_mtime_ns or asset.size != stat.st_size:
+            asset = Asset(path, stat).load()
+            with self._lock:
+                self._assets[path] = asset
+        return asset
+
+    def warm(self, root):
+        """Pre-compress every text asset under root; returns the number of files"""
+        count = 0
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS and not d.startswith('admin_panel_backup')]
+            for name in filenames:
+                if name.endswith(COMPRESSIBLE_TYPES):
+                    self.get(os.path.join(dirpath, name))
+                    count += 1
+        return count
+
+
+ASSETS = AssetCache()
+
+
+def accepted_encodings(header):
+    """Parse Accept-Encoding into the set of codings with a non-zero q-value"""
+    accepted = set()
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
 class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, directory=str(DIRECTORY), **kwargs)
-    
+
     def end_headers(self):
         # Add CORS headers
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-        self.send_header('Cache-Control', 'no-store, no-cache, must-revalidate')
         super().end_headers()
-    
+
     def do_OPTIONS(self):
         self.send_response(200)
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
+    def do_GET(self):
+        self.serve(send_body=True)
+
+    def do_HEAD(self):
+        self.serve(send_body=False)
+
+    def resolve(self):
+        """Map the request path to a file, or None to fall back to the default handler"""
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            if not self.path.split('?', 1)[0].endswith('/'):
+                return None  # let SimpleHTTPRequestHandler redirect to the trailing slash
+            index = os.path.join(path, 'index.html')
+            return index if os.path.isfile(index) else None
+        return path if os.path.isfile(path) else None
+
+    def serve(self, send_body):
+        path = self.resolve()
+        if path is None:
+            return super().do_GET() if send_body else super().do_HEAD()
+
+        asset = ASSETS.get(path)
+        if asset is None:
+            self.send_error(404, "File not found")
+            return
+
+        accepted = accepted_encodings(self.headers.get('Accept-Encoding'))
+        encoding = next((e for e in ('br', 'gzip') if e in asset.encoded and e in accepted), None)
+        etag = asset.etag_for(encoding)
+        cache_control = IMMUTABLE_CACHE if FINGERPRINTED.search(path) else REVALIDATE_CACHE
+
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
+            if asset.encoded:
+                self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return
+
+        body = asset.encoded.get(encoding) if encoding else None
+        self.send_response(200)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Length', str(len(body) if body is not None else asset.size))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', cache_control)
+        self.send_header('Last-Modified', self.date_time_string(asset.mtime // 1_000_000_000))
+        if asset.encoded:
+            self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+
+        if not send_body:
+            return
+        if body is not None:
+            self.wfile.write(body)
+            return
+        self.wfile.flush()
+        with open(path, 'rb') as f:
+            # Zero-copy on platforms with os.sendfile, plain copy elsewhere
+            self.connection.sendfile(f, 0, asset.size)
+
+
+class FrontendServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve the Affluence frontend")
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--root', default=str(DIRECTORY), help="Directory to serve (e.g. dist after build_frontend.py)")
+    args = parser.parse_args()
+
+    DIRECTORY = Path(args.root).resolve()
     os.chdir(DIRECTORY)
-    
-    with socketserver.TCPServer(("", PORT), MyHTTPRequestHandler) as httpd:
+    warmed = ASSETS.warm(DIRECTORY)
+
+    with FrontendServer(("", args.port), MyHTTPRequestHandler) as httpd:
         print("=" * 60)
         print(f"  🌐 Affluence Frontend Server")
         print("=" * 60)
-        print(f"  Server running at: http://localhost:{PORT}")
+        print(f"  Server running at: http://localhost:{args.port}")
         print(f"  Serving files from: {DIRECTORY}")
+        print(f"  Pre-compressed {warmed} asset(s) (gzip{', brotli' if brotli else ''})")
         print()
-        print(f"  📄 Login page: http://localhost:{PORT}/login.html")
-        print(f"  📄 Register page: http://localhost:{PORT}/register.html")
-        print(f"  📄 Dashboard: http://localhost:{PORT}/dashboard.html")
-        print(f"  📄 Admin Panel: http://localhost:{PORT}/admin-dashboard.html")
+        print(f"  📄 Login page: http://localhost:{args.port}/login.html")
+        print(f"  📄 Register page: http://localhost:{args.port}/register.html")
+        print(f"  📄 Dashboard: http://localhost:{args.port}/dashboard.html")
+        print(f"  📄 Admin Panel: http://localhost:{args.port}/admin-dashboard.html")
         print()
         print("  Press Ctrl+C to stop the server")
         print("=" * 60)
-        
+
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
@@ -0,0 +1,328 @@
+"""
+Batched stream-progress ingestion for audio earnings
+
+js/streaming.js reports progress every 10 seconds per listener
+(PUT /streams/{id}/progress). Writing each heartbeat straight to
+streams.duration_listened means one write transaction per heartbeat, and
+with many listeners SQLite's single write lock becomes the bottleneck.
+
+ProgressBuffer keeps heartbeats in memory keyed by stream id, coalescing
+each stream down to its highest reported position, and a background thread
+flushes everything in one transaction every `flush_interval` seconds. The
+flush still applies the server-side rules:
+
+  - only STARTED streams owned by the reporting user are updated
+  - progress never moves backwards and is capped at the audio's duration
+  - a stream reaching the audio's duration becomes COMPLETED (completed_at set)
+  - claims flush the stream first, then move COMPLETED -> CLAIMED atomically,
+    so a claim can never be lost or applied twice
+
+Backend wiring:
+
+    from stream_progress import ProgressBuffer
+    progress = ProgressBuffer(engine)      # at startup; progress.stop() at shutdown
+    progress.start()
+
+    progress.record(stream_id, current_user.id, seconds)          # progress endpoint
+    amount = progress.claim(db, stream_id, current_user.id)       # claim endpoint
+    if amount:
+        credit(db, current_user.id, amount, "ACTIVITY", "Audio stream reward", reference=f"STREAM-{stream_id}")
+
+Usage (listener-capacity benchmark on a scratch database, e.g. one made by
+generate_test_dataset.py):
+    python stream_progress.py --database-url sqlite:////tmp/perf.db --listeners 2000 --seconds 10
+"""
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import bindparam, text
+
+from database import get_engine
+
+DEFAULT_FLUSH_INTERVAL = 2.0
+# Heartbeat interval used by js/streaming.js, for converting throughput to listeners
+HEARTBEAT_SECONDS = 10
+
+STREAM_STATE_SQL = text("""
+    SELECT s.id, s.user_id, s.status, COALESCE(s.duration_listened, 0) AS listened, a.duration_seconds
+    FROM streams s
+    LEFT JOIN audios a ON a.id = s.audio_id
+    WHERE s.id IN :ids
+""").bindparams(bindparam("ids", expanding=True))
+
+# The status/position guards make a racing direct write or a stale buffer harmless
+APPLY_PROGRESS_SQL = text("""
+    UPDATE streams
+    SET duration_listened = :seconds,
+        status = CASE WHEN :completed = 1 THEN 'COMPLETED' ELSE status END,
+        completed_at = CASE WHEN :completed = 1 THEN :now ELSE completed_at END
+    WHERE id = :stream_id AND status = 'STARTED' AND COALESCE(duration_listened, 0) < :seconds
+""")
+
+CLAIM_SQL = text("""
+    UPDATE streams
+    SET status = 'CLAIMED', claimed_at = :now
+    WHERE id = :stream_id AND user_id = :user_id AND status = 'COMPLETED'
+""")
+
+
+class ProgressBuffer:
+    """Coalesces progress heartbeats in memory and writes them in batches"""
+
+    def __init__(self, engine, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.engine = engine
+        self.flush_interval = flush_interval
+        # (stream_id, user_id) -> seconds; keyed by user too so a bogus
+        # heartbeat for someone else's stream cannot displace the owner's
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"heartbeats": 0, "flushes": 0, "rows_written": 0, "completed": 0, "rejected": 0}
+
+    def record(self, stream_id, user_id, seconds):
+        """Accept one heartbeat; returns immediately without touching the database"""
+        seconds = int(seconds)
+        if seconds < 0:
+            raise ValueError("Progress cannot be negative")
+        with self._lock:
+            self.stats["heartbeats"] += 1
+            key = (stream_id, user_id)
+            if self._pending.get(key, -1) < seconds:
+                self._pending[key] = seconds
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self, stream_ids=None):
+        """Write pending progress (all of it, or only stream_ids) in one transaction
+
+        Returns the number of streams updated. On a database error the
+        batch is put back, so the next flush retries it.
+        """
+        with self._lock:
+            if stream_ids is None:
+                batch, self._pending = self._pending, {}
+            else:
+                wanted = set(stream_ids)
+                batch = {key: self._pending.pop(key) for key in list(self._pending) if key[0] in wanted}
+        if not batch:
+            return 0
+
+        with self._flush_lock:
+            try:
+                with self.engine.begin() as conn:
+                    written, completed, rejected = self._apply(conn, batch)
+            except Exception:
+                self._requeue(batch)
+                raise
+
+        with self._lock:
+            self.stats["flushes"] += 1
+            self.stats["rows_written"] += written
+            self.stats["completed"] += completed
+            self.stats["rejected"] += rejected
+        return written
+
+    def _apply(self, conn, batch):
+        now = datetime.utcnow()
+        params = []
+        rejected = 0
+        states = {row["id"]: row for row in conn.execute(
+            STREAM_STATE_SQL, {"ids": sorted({stream_id for stream_id, _ in batch})}).mappings()}
+        for (stream_id, user_id), seconds in batch.items():
+            state = states.get(stream_id)
+            if state is None or state["user_id"] != user_id or state["status"] != 'STARTED':
+                rejected += 1
+                continue
+            duration = state["duration_seconds"]
+            if duration:
+                seconds = min(seconds, duration)
+            if seconds <= state["listened"]:
+                continue
+            completed = 1 if duration and seconds >= duration else 0
+            params.append({"stream_id": state["id"], "seconds": seconds, "completed": completed, "now": now})
+        if params:
+            conn.execute(APPLY_PROGRESS_SQL, params)
+        return len(params), sum(p["completed"] for p in params), rejected
+
+    def _requeue(self, batch):
+        with self._lock:
+            for key, seconds in batch.items():
+                if self._pending.get(key, -1) < seconds:
+                    self._pending[key] = seconds
+
+    def claim(self, db, stream_id, user_id):
+        """Claim a completed stream's reward; returns the amount or None if not claimable
+
+        Pending progress for the stream is flushed first so the final
+        heartbeat and the claim cannot race. Crediting the balance is left to
+        the caller (balance_service.credit), in the same transaction as `db`.
+        """
+        self.flush([stream_id])
+        result = db.execute(CLAIM_SQL, {"stream_id": stream_id, "user_id": user_id, "now": datetime.utcnow()})
+        if result.rowcount != 1:
+            return None
+        return db.execute(text("SELECT amount FROM streams WHERE id = :stream_id"), {"stream_id": stream_id}).scalar()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="stream-progress-flush", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the flush thread and write whatever is still pending"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️  Stream progress flush failed (will retry): {e}")
+
+
+# -- listener-capacity benchmark -----------------------------------------------
+
+def _create_benchmark_streams(engine, listeners):
+    with engine.begin() as conn:
+        audio = conn.execute(text(
+            "SELECT id, duration_seconds, amount FROM audios ORDER BY duration_seconds DESC LIMIT 1")).first()
+        user_ids = [row[0] for row in conn.execute(text("SELECT id FROM users ORDER BY id LIMIT :n"), {"n": listeners})]
+        if audio is None or not user_ids:
+            raise RuntimeError("Benchmark needs at least one audio and one user (use generate_test_dataset.py)")
+        first = (conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM streams")).scalar() or 0) + 1
+        conn.execute(
+            text("INSERT INTO streams (id, user_id, audio_id, duration_listened, amount, status, started_at) "
+                 "VALUES (:id, :user_id, :audio_id, 0, :amount, 'STARTED', :now)"),
+            [{"id": first + i, "user_id": user_ids[i % len(user_ids)], "audio_id": audio[0],
+              "amount": audio[2], "now": datetime.utcnow()} for i in range(listeners)],
+        )
+    return [(first + i, user_ids[i % len(user_ids)]) for i in range(listeners)]
+
+
+def _reset_benchmark_streams(engine, streams, delete=False):
+    ids = [stream_id for stream_id, _ in streams]
+    sql = ("DELETE FROM streams WHERE id IN :ids" if delete else
+           "UPDATE streams SET duration_listened = 0, status = 'STARTED', completed_at = NULL WHERE id IN :ids")
+    with engine.begin() as conn:
+        conn.execute(text(sql).bindparams(bindparam("ids", expanding=True)), {"ids": ids})
+
+
+def _drive(streams, workers, seconds, send):
+    """Send heartbeats round-robin from `workers` threads for `seconds`; returns (latencies, errors)"""
+    deadline = time.perf_counter() + seconds
+    shards = [streams[i::workers] for i in range(workers)]
+
+    def worker(shard):
+        latencies, errors, position = [], 0, 0
+        while time.perf_counter() < deadline:
+            position += HEARTBEAT_SECONDS
+            for stream_id, user_id in shard:
+                started = time.perf_counter()
+                try:
+                    send(stream_id, user_id, position)
+                except Exception:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+                if time.perf_counter() >= deadline:
+                    break
+        return latencies, errors
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(worker, shards))
+    return sorted(l for r in results for l in r[0]), sum(r[1] for r in results)
+
+
+def _latency_ms(latencies, pct):
+    if not latencies:
+        return 0.0
+    return latencies[min(len(latencies) - 1, int(len(latencies) * pct / 100.0))] * 1000.0
+
+
+def run_benchmark(engine, listeners, workers, seconds, flush_interval):
+    """Compare one-transaction-per-heartbeat with ProgressBuffer on the same streams"""
+    streams = _create_benchmark_streams(engine, listeners)
+    results = {}
+    try:
+        direct = ProgressBuffer(engine)
+
+        def send_direct(stream_id, user_id, position):
+            # What the endpoint did before: read, update and commit per heartbeat
+            with engine.begin() as conn:
+                direct._apply(conn, {(stream_id, user_id): position})
+
+        latencies, errors = _drive(streams, workers, seconds, send_direct)
+        results["direct"] = {"heartbeats": len(latencies), "errors": errors,
+                             "p50_ms": _latency_ms(latencies, 50), "p99_ms": _latency_ms(latencies, 99),
+                             "listeners": int(len(latencies) / seconds * HEARTBEAT_SECONDS)}
+
+        _reset_benchmark_streams(engine, streams)
+        buffer = ProgressBuffer(engine, flush_interval=flush_interval).start()
+        latencies, errors = _drive(streams, workers, seconds, buffer.record)
+        buffer.stop()
+
+        # A full flush of every listener's stream, timed on its own
+        for stream_id, user_id in streams:
+            buffer.record(stream_id, user_id, 1)
+        _reset_benchmark_streams(engine, streams)
+        started = time.perf_counter()
+        buffer.flush()
+        flush_seconds = time.perf_counter() - started
+
+        ingest = len(latencies) / seconds * HEARTBEAT_SECONDS
+        # A flush must finish within its interval to keep up
+        flushable = listeners * flush_interval / flush_seconds if flush_seconds else float("inf")
+        results["buffered"] = {"heartbeats": len(latencies), "errors": errors,
+                               "p50_ms": _latency_ms(latencies, 50), "p99_ms": _latency_ms(latencies, 99),
+                               "flushes": buffer.stats["flushes"], "flush_ms": flush_seconds * 1000.0,
+                               "listeners": int(min(ingest, flushable))}
+    finally:
+        _reset_benchmark_streams(engine, streams, delete=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark stream-progress ingestion (direct writes vs batched)")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--listeners', type=int, default=1000, help="Concurrent streams to simulate")
+    parser.add_argument('--workers', type=int, default=16, help="Request-handler threads sending heartbeats")
+    parser.add_argument('--seconds', type=float, default=10.0, help="Duration of each run")
+    parser.add_argument('--flush-interval', type=float, default=DEFAULT_FLUSH_INTERVAL)
+    args = parser.parse_args(argv)
+
+    engine = get_engine(args.database_url)
+    try:
+        print(f"🎧 {args.listeners:,} listeners, {args.workers} worker threads, {args.seconds:.0f}s per run")
+        results = run_benchmark(engine, args.listeners, args.workers, args.seconds, args.flush_interval)
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+    for name, r in results.items():
+        print(f"\n{name.capitalize()}: {r['heartbeats']:,} heartbeats, {r['errors']} error(s), "
+              f"p50 {r['p50_ms']:.2f} ms, p99 {r['p99_ms']:.2f} ms")
+        if "flush_ms" in r:
+            print(f"   {r['flushes']} background flush(es); flushing all {args.listeners:,} streams took {r['flush_ms']:.0f} ms")
+        print(f"   ≈ {r['listeners']:,} listeners at one heartbeat per {HEARTBEAT_SECONDS}s")
+    gain = results["buffered"]["listeners"] / max(results["direct"]["listeners"], 1)
+    print(f"\n✅ Batched ingestion supports {gain:.1f}x the listeners of direct writes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
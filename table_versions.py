@@ -0,0 +1,389 @@
+"""
+Table version counters for conditional GET (ETag / Last-Modified)
+
+Read endpoints such as /tasks/, /users/dashboard and /withdrawals/ return
+the same payload on almost every call. A per-table version counter, bumped
+by triggers on every INSERT/UPDATE/DELETE, lets an endpoint decide that
+nothing changed from a single indexed read:
+
+    table_versions(table_name, version, updated_at)       -- SQLite
+    table_version_<table> sequences                       -- PostgreSQL
+
+ETag = hash of the versions of the tables an endpoint reads (plus the user
+for per-user endpoints). When the client's If-None-Match matches, the
+endpoint answers 304 without running its queries or serialising anything.
+js/api.js keeps the bodies and sends If-None-Match automatically.
+
+Backend wiring:
+
+    from table_versions import READ_ENDPOINTS, USER_STATE, conditional_json
+
+    @router.get("/withdrawals/")
+    def list_withdrawals(request: Request, skip: int = 0, limit: int = 50, db=..., user=...):
+        return conditional_json(request, db, READ_ENDPOINTS["/withdrawals/"],
+                                lambda: [serialize(w) for w in crud.get_withdrawals(db, user.id, skip, limit)],
+                                scope=user.id, user_state=USER_STATE["/withdrawals/"])
+
+The CORS middleware must allow the If-None-Match request header
+(allow_headers), and conditional_json exposes ETag to the browser.
+
+Versions are global per table, so a write by any user changes the ETag of
+every view of that table. That suits shared catalogs (tasks, audios,
+articles); per-user endpoints (dashboard, withdrawals, my-tasks) are keyed
+on the user's own rows instead (USER_STATE), so other users' writes leave
+their ETag alone.
+
+Usage:
+    python table_versions.py --install
+    python table_versions.py --benchmark --requests 2000 --change-rate 0.05
+"""
+import argparse
+import hashlib
+import json
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime
+
+from sqlalchemy import bindparam, text
+
+from database import get_engine
+from db_backend import backend_for
+from http_cache import etag_matches
+
+TRACKED_TABLES = [
+    "users", "balances", "transactions", "tasks", "user_tasks", "audios", "streams",
+    "withdrawals", "notifications", "articles", "cards", "announcements", "coupons",
+]
+
+# Shared tables each cacheable read endpoint depends on
+READ_ENDPOINTS = {
+    "/tasks/": ("tasks",),
+    "/tasks/my-tasks": ("tasks",),
+    "/audios/": ("audios",),
+    "/users/dashboard": (),
+    "/users/top-earners": ("users", "balances"),
+    "/withdrawals/": (),
+    "/admin/articles": ("articles",),
+    "/admin/cards": ("cards",),
+    "/admin/announcements": ("announcements",),
+}
+
+# Per-user endpoints are keyed on the user's own rows instead of the global
+# version of balances/withdrawals/user_tasks, which every user's writes bump.
+# The state is read from the values the payload shows, not from counters the
+# writers would have to remember to bump (the ORM does not touch
+# balances.version). Rows are grouped by status with the sum of their ids, so
+# a row changing status moves it between groups even when no count or
+# timestamp changes. Each query is an index range scan over one user's rows.
+TASK_STATE = text("""
+    SELECT status, COUNT(*), SUM(id), MAX(taken_at), MAX(completed_at), MAX(claimed_at)
+    FROM user_tasks WHERE user_id = :user_id
+    GROUP BY status ORDER BY status
+""")
+
+WITHDRAWAL_STATE = text("""
+    SELECT status, COUNT(*), SUM(id), MAX(created_at), MAX(processed_at)
+    FROM withdrawals WHERE user_id = :user_id
+    GROUP BY status ORDER BY status
+""")
+
+USER_STATE = {
+    "/tasks/my-tasks": (TASK_STATE,),
+    "/users/dashboard": (
+        text("""
+            SELECT u.username, u.full_name, u.email, u.phone,
+                   b.main_balance, b.activity_balance, b.affiliate_balance, b.total_balance,
+                   (SELECT COUNT(*) FROM users r WHERE r.referred_by = u.referral_code)
+            FROM users u LEFT JOIN balances b ON b.user_id = u.id
+            WHERE u.id = :user_id
+        """),
+        TASK_STATE,
+        WITHDRAWAL_STATE,
+    ),
+    "/withdrawals/": (WITHDRAWAL_STATE,),
+}
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS table_versions (
+        table_name VARCHAR(64) PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP
+    )
+"""
+
+SEED_COLUMNS = ["table_name", "version", "updated_at"]
+
+# SQLite triggers are row-level, so a bulk statement bumps the version once
+# per row; the counter only has to change, not count statements
+TRIGGER_SQL = """
+    CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{op}
+    AFTER {op} ON {table}
+    BEGIN
+        UPDATE table_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE table_name = '{table}';
+    END
+"""
+
+# Postgres: the version of a table is a sequence, table_version_<table>.
+# Updating a shared counter row would hold its lock until commit and
+# serialise every writer of the table; nextval never waits. The trigger is
+# deferred to commit time so the new version becomes visible together with
+# the data (a bump taken mid-transaction would let a concurrent read cache
+# the old rows under the new ETag), and the transaction-local setting makes
+# it one nextval per table per transaction rather than per row.
+PG_SEQUENCE_SQL = "CREATE SEQUENCE IF NOT EXISTS table_version_{table}"
+
+PG_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+    BEGIN
+        IF current_setting('table_versions.' || TG_TABLE_NAME, true) IS DISTINCT FROM '1' THEN
+            PERFORM set_config('table_versions.' || TG_TABLE_NAME, '1', true);
+            PERFORM nextval('table_version_' || TG_TABLE_NAME);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+PG_TRIGGER_SQL = [
+    "DROP TRIGGER IF EXISTS trg_{table}_version ON {table}",
+    """
+    CREATE CONSTRAINT TRIGGER trg_{table}_version
+    AFTER INSERT OR UPDATE OR DELETE ON {table}
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE FUNCTION bump_table_version()
+    """,
+]
+
+PG_VERSION_SQL = "SELECT '{table}', last_value, NULL FROM table_version_{table}"
+
+VERSIONS_SQL = text("""
+    SELECT table_name, version, updated_at FROM table_versions WHERE table_name IN :tables
+""").bindparams(bindparam("tables", expanding=True))
+
+
+def install(db, tables=None):
+    """Create the counters and triggers for tables that exist; returns the tables tracked"""
+    backend = backend_for(db)
+    existing = set(backend.table_names(db))
+    tracked = [t for t in (tables or TRACKED_TABLES) if t in existing]
+    if backend.name == "postgresql":
+        db.execute(text(PG_FUNCTION_SQL))
+        for table in tracked:
+            db.execute(text(PG_SEQUENCE_SQL.format(table=table)))
+            for sql in PG_TRIGGER_SQL:
+                db.execute(text(sql.format(table=table)))
+        return tracked
+
+    db.execute(text(CREATE_TABLE_SQL))
+    if tracked:
+        now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        db.execute(text(backend.upsert_sql("table_versions", SEED_COLUMNS, ["table_name"], update=())),
+                   [{"table_name": table, "version": 0, "updated_at": now} for table in tracked])
+    for table in tracked:
+        for op in ("INSERT", "UPDATE", "DELETE"):
+            db.execute(text(TRIGGER_SQL.format(table=table, op=op)))
+    return tracked
+
+
+def _versions_query(db, tables):
+    if backend_for(db).name != "postgresql":
+        return VERSIONS_SQL, {"tables": list(tables)}
+    # One UNION ALL over the sequences; no Last-Modified on Postgres (sequences carry no timestamp)
+    unknown = set(tables) - set(TRACKED_TABLES)
+    if unknown:
+        raise ValueError(f"Untracked tables: {sorted(unknown)}")
+    return text(" UNION ALL ".join(PG_VERSION_SQL.format(table=table) for table in tables)), {}
+
+
+def get_versions(db, tables):
+    """Return ({table: version}, latest updated_at) for the given tables"""
+    versions = {}
+    last_modified = None
+    if not tables:
+        return versions, last_modified
+    sql, params = _versions_query(db, tables)
+    for row in db.execute(sql, params):
+        versions[row[0]] = row[1]
+        if row[2] is not None and (last_modified is None or str(row[2]) > str(last_modified)):
+            last_modified = row[2]
+    return versions, last_modified
+
+
+def get_user_state(db, state_sql, user_id):
+    """The per-user state of an endpoint (every row of its USER_STATE queries) as a string for the ETag"""
+    return ";".join(
+        "/".join(str(value) for value in row)
+        for sql in state_sql
+        for row in db.execute(sql, {"user_id": user_id})
+    )
+
+
+def compute_etag(versions, scope=None, state=None):
+    """Strong ETag for a set of table versions, optionally scoped (e.g. to a user id) and per-user state"""
+    key = ";".join(f"{table}={versions[table]}" for table in sorted(versions))
+    if scope is not None:
+        key += f"|{scope}"
+    if state is not None:
+        key += f"|{state}"
+    return f'"v-{hashlib.sha1(key.encode()).hexdigest()[:16]}"'
+
+
+def http_date(value):
+    """Format a DB timestamp (datetime or 'YYYY-MM-DD HH:MM:SS' string, UTC) as an HTTP date"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.split(".")[0])
+    return format_datetime(value.replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def conditional_json(request, db, tables, build, scope=None, user_state=None):
+    """Answer 304 if the client's ETag is current, otherwise build and return the JSON
+
+    `build` is only called on a miss, so a 304 costs one or two small
+    queries. Per-user endpoints pass scope=user.id and
+    user_state=USER_STATE[path].
+    """
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse, Response
+
+    versions, last_modified = get_versions(db, tables)
+    state = get_user_state(db, user_state, scope) if user_state is not None else None
+    etag = compute_etag(versions, scope, state)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",
+        # Lets js/api.js read the validators on cross-origin responses
+        "Access-Control-Expose-Headers": "ETag, Last-Modified",
+    }
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(jsonable_encoder(build()), headers=headers)
+
+
+# -- benchmark ---------------------------------------------------------------
+
+# endpoint -> (query, per-user?, table a write to the endpoint's data changes)
+BENCHMARK_QUERIES = {
+    "/tasks/": (text("SELECT * FROM tasks WHERE is_active = 1 ORDER BY id"), False, "tasks"),
+    "/withdrawals/": (text("SELECT * FROM withdrawals WHERE user_id = :user_id ORDER BY created_at DESC LIMIT 50"),
+                      True, "withdrawals"),
+    "/users/dashboard": (text("""
+        SELECT u.id, u.username, u.full_name, u.referral_code,
+               b.activity_balance, b.affiliate_balance, b.total_balance,
+               (SELECT COUNT(*) FROM users r WHERE r.referred_by = u.referral_code) AS total_referrals,
+               (SELECT COUNT(*) FROM user_tasks t WHERE t.user_id = u.id) AS tasks_taken,
+               (SELECT COUNT(*) FROM withdrawals w WHERE w.user_id = u.id AND w.status = 'PENDING') AS pending_withdrawals
+        FROM users u LEFT JOIN balances b ON b.user_id = u.id
+        WHERE u.id = :user_id
+    """), True, "balances"),
+}
+
+
+def run_benchmark(engine, requests, change_rate, seed=42):
+    """Replay the same reads without ETags, with global table ETags and with the endpoint's own ETags
+
+    A fraction `change_rate` of requests follow a write by a random user
+    (simulated: the written table's version and that user's state move).
+    With global ETags any user's write makes every client's ETag stale; with
+    USER_STATE only the writer's. Returns {endpoint: {"full": {...},
+    "global": {...}, "keyed": {...}}} with bytes sent and server CPU seconds.
+    """
+    rng = random.Random(seed)
+    results = {}
+    with engine.connect() as conn:
+        user_ids = [row[0] for row in conn.execute(text(
+            "SELECT user_id FROM withdrawals GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 50"))] or [1]
+
+        def body(query, params):
+            return json.dumps([dict(r) for r in conn.execute(query, params).mappings()], default=str).encode()
+
+        for endpoint, (query, per_user, written) in BENCHMARK_QUERIES.items():
+            tables = READ_ENDPOINTS[endpoint]
+            state_sql = USER_STATE.get(endpoint)
+            full = {"bytes": 0, "cpu": 0.0}
+            runs = {"global": {"bytes": 0, "cpu": 0.0, "not_modified": 0, "clients": {}},
+                    "keyed": {"bytes": 0, "cpu": 0.0, "not_modified": 0, "clients": {}}}
+            fake_versions = {}  # table -> simulated writes
+            fake_state = {}  # user_id -> simulated writes by that user
+
+            for _ in range(requests):
+                user_id = rng.choice(user_ids)
+                params = {"user_id": user_id} if per_user else {}
+                if rng.random() < change_rate:
+                    writer = rng.choice(user_ids)
+                    fake_versions[written] = fake_versions.get(written, 0) + 1
+                    fake_state[writer] = fake_state.get(writer, 0) + 1
+
+                started = time.process_time()
+                full["bytes"] += len(body(query, params))
+                full["cpu"] += time.process_time() - started
+
+                for name, run in runs.items():
+                    started = time.process_time()
+                    scope = user_id if per_user else None
+                    if name == "global" or state_sql is None:
+                        versions, _ = get_versions(conn, set(tables) | {written})
+                        versions.update(fake_versions)
+                        etag = compute_etag(versions, scope)
+                    else:
+                        versions, _ = get_versions(conn, tables)
+                        state = f"{get_user_state(conn, state_sql, user_id)}/{fake_state.get(user_id, 0)}"
+                        etag = compute_etag(versions, scope, state)
+                    if run["clients"].get(user_id) == etag:
+                        run["not_modified"] += 1
+                    else:
+                        run["bytes"] += len(body(query, params))
+                        run["clients"][user_id] = etag
+                    run["cpu"] += time.process_time() - started
+            for run in runs.values():
+                del run["clients"]
+            results[endpoint] = {"full": full, **runs}
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Install table version counters / benchmark conditional GET")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--install', action='store_true', help="Create table_versions and its triggers")
+    parser.add_argument('--benchmark', action='store_true', help="Compare bytes and CPU without ETags, with global and with per-user ETags")
+    parser.add_argument('--requests', type=int, default=2000, help="Requests per endpoint in the benchmark")
+    parser.add_argument('--change-rate', type=float, default=0.01, help="Fraction of requests preceded by a write")
+    args = parser.parse_args(argv)
+
+    engine = get_engine(args.database_url)
+    try:
+        if args.install or args.benchmark:
+            with engine.begin() as conn:
+                tracked = install(conn)
+            print(f"✅ Version counters installed on {len(tracked)} table(s)")
+
+        if args.benchmark:
+            results = run_benchmark(engine, args.requests, args.change_rate)
+            print(f"\n{'Endpoint':<18} {'Full KB':>9} {'Global KB':>10} {'Keyed KB':>9} "
+                  f"{'Full CPU s':>11} {'Keyed CPU s':>12} {'304s global':>12} {'304s keyed':>11}")
+            print("-" * 100)
+            total_full = total_keyed = 0
+            for endpoint, r in results.items():
+                full, glob, keyed = r["full"], r["global"], r["keyed"]
+                total_full += full["bytes"]
+                total_keyed += keyed["bytes"]
+                print(f"{endpoint:<18} {full['bytes'] / 1024:>9.1f} {glob['bytes'] / 1024:>10.1f} "
+                      f"{keyed['bytes'] / 1024:>9.1f} {full['cpu']:>11.3f} {keyed['cpu']:>12.3f} "
+                      f"{glob['not_modified']:>12} {keyed['not_modified']:>11}")
+            if total_full:
+                print(f"\n✅ Response bytes down {1 - total_keyed / total_full:.1%} "
+                      f"with writes by random users before {args.change_rate:.0%} of requests")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
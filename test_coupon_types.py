@@ -7,6 +7,7 @@ sys.path.insert(0, os.getcwd())
 
 from app.database import get_db
 from app.models import Coupon, CouponType, CouponStatus
+from money import format_naira, from_stored, money_scale
 
 def test_coupon_types():
     db = next(get_db())
@@ -16,12 +17,13 @@ def test_coupon_types():
         
         # Get all coupons
         coupons = db.query(Coupon).all()
+        scale = money_scale(db, "coupons", "bonus_amount")
         
         print(f"{'Code':<20} {'Type':<10} {'Bonus':<15} {'Status':<10}")
         print("-" * 60)
         
         for coupon in coupons:
-            bonus_str = f"₦{coupon.bonus_amount:,.0f}"
+            bonus_str = format_naira(from_stored(coupon.bonus_amount, scale))
             coupon_type_str = coupon.coupon_type.upper() if isinstance(coupon.coupon_type, str) else coupon.coupon_type
             status_str = coupon.status.value.upper() if hasattr(coupon.status, 'value') else str(coupon.status).upper()
             print(f"{coupon.code:<20} {coupon_type_str:<10} {bonus_str:<15} {status_str:<10}")
@@ -9,6 +9,8 @@ sys.path.insert(0, os.getcwd())
 from app.database import get_db
 from app.models import User, Balance
 from sqlalchemy import func
+from leaderboard import get_top_earners, print_top_earners
+from money import money_scale
 
 def test_top_earners():
     db = next(get_db())
@@ -54,6 +56,18 @@ def test_top_earners():
         
         if not top_users:
             print("No users found!")
+
+        # The endpoint serves the precomputed snapshot; it should agree with the live query
+        snapshot = get_top_earners(db, 10)
+        print("\n=== Precomputed Leaderboard Snapshot ===")
+        print_top_earners(snapshot, money_scale(db, "balances", "affiliate_balance"))
+        # Compare amounts only: the live query does not break ties by user id
+        live = [affiliate for _, _, _, affiliate, _ in top_users]
+        cached = [row['affiliate_balance'] for row in snapshot]
+        if live == cached:
+            print("\n✅ Snapshot matches the live query")
+        else:
+            print("\n⚠️  Snapshot is stale, run: python leaderboard.py --rebuild")
         
     except Exception as e:
         print(f"Error: {e}")
@@ -1,23 +1,51 @@
-"""Update MEGA coupons to ₦500"""
-import sys
-import os
+"""Update MEGA coupons to ₦500
 
-os.chdir('backend')
-sys.path.insert(0, os.getcwd())
+Usage:
+    python update_mega_bonus.py [--database-url sqlite:////path/to/affluence.db]
+"""
+import argparse
+import sys
 
-from app.database import get_db
 from sqlalchemy import text
 
-db = next(get_db())
-try:
-    result = db.execute(text("UPDATE coupons SET bonus_amount = 500.0 WHERE coupon_type = 'mega'"))
-    db.commit()
-    print(f"✅ Updated {result.rowcount} MEGA coupons to ₦500")
-    
+from database import get_engine
+from money import format_naira, from_stored, money_scale, to_kobo, to_stored
+
+MEGA_BONUS = to_kobo(500)
+
+
+def update_mega_bonus(engine):
+    """Set every MEGA coupon's bonus to MEGA_BONUS; returns the number updated"""
+    with engine.begin() as conn:
+        # Naira or kobo, whichever the column holds (migrate_money_to_kobo.py)
+        scale = money_scale(conn, "coupons", "bonus_amount")
+        result = conn.execute(text("UPDATE coupons SET bonus_amount = :bonus WHERE coupon_type = 'mega'"),
+                              {"bonus": to_stored(MEGA_BONUS, scale)})
+    print(f"✅ Updated {result.rowcount} MEGA coupons to {format_naira(MEGA_BONUS)}")
+
     # Show updated coupons
-    coupons = db.execute(text("SELECT code, coupon_type, bonus_amount FROM coupons")).fetchall()
+    with engine.connect() as conn:
+        coupons = conn.execute(text("SELECT code, coupon_type, bonus_amount FROM coupons")).fetchall()
     print("\nAll coupons:")
     for code, ctype, bonus in coupons:
-        print(f"  {code}: {ctype.upper()} - ₦{bonus:,.0f}")
-finally:
-    db.close()
+        print(f"  {code}: {ctype.upper()} - {format_naira(from_stored(bonus, scale))}")
+    return result.rowcount
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Set the bonus of every MEGA coupon to ₦500")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    args = parser.parse_args(argv)
+
+    try:
+        update_mega_bonus(get_engine(args.database_url))
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
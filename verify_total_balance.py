@@ -1,71 +1,62 @@
 """
 Verify and fix total_balance = activity_balance + affiliate_balance
 Ensures all user balances follow the correct formula
+
+Uses the set-based engine in balance_reconciliation.py: mismatches are found
+with one SQL aggregate and fixed in keyset-paginated batches, so this runs in
+constant memory regardless of the number of users.
+
+Usage:
+    python verify_total_balance.py [--dry-run] [--report report.json] [--database-url URL]
 """
+import argparse
 import sys
-import os
-
-os.chdir('backend')
-sys.path.insert(0, os.getcwd())
 
-from app.database import get_db
-from app.models import Balance
+from balance_reconciliation import (
+    DEFAULT_CHUNK_SIZE,
+    print_summary,
+    reconcile,
+    write_report,
+)
+from database import get_engine
+from money import format_naira
 
-def fix_total_balances():
-    db = next(get_db())
-    
+def fix_total_balances(engine, dry_run=False, chunk_size=DEFAULT_CHUNK_SIZE, report_path=None):
     try:
         print("=== Checking and Fixing Total Balances ===\n")
-        
-        # Get all balances
-        balances = db.query(Balance).all()
-        
-        fixed_count = 0
-        correct_count = 0
-        
-        for balance in balances:
-            expected_total = balance.activity_balance + balance.affiliate_balance
-            
-            if abs(balance.total_balance - expected_total) > 0.01:  # Allow for floating point errors
-                print(f"❌ User ID {balance.user_id}:")
-                print(f"   Activity: ₦{balance.activity_balance:,.2f}")
-                print(f"   Affiliate: ₦{balance.affiliate_balance:,.2f}")
-                print(f"   Current Total: ₦{balance.total_balance:,.2f}")
-                print(f"   Expected Total: ₦{expected_total:,.2f}")
-                print(f"   → Fixing...")
-                
-                balance.total_balance = expected_total
-                fixed_count += 1
-            else:
-                correct_count += 1
-        
-        if fixed_count > 0:
-            db.commit()
-            print(f"\n✅ Fixed {fixed_count} balance(s)")
-        
-        print(f"✅ {correct_count} balance(s) were already correct")
-        print(f"\n=== Summary ===")
-        print(f"Total records: {len(balances)}")
-        print(f"Fixed: {fixed_count}")
-        print(f"Correct: {correct_count}")
-        
-        # Show all balances
-        print("\n=== All User Balances ===")
-        print(f"{'User ID':<10} {'Activity':<15} {'Affiliate':<15} {'Total':<15} {'Status':<10}")
-        print("-" * 70)
-        
-        for balance in db.query(Balance).all():
-            expected = balance.activity_balance + balance.affiliate_balance
-            status = "✓" if abs(balance.total_balance - expected) < 0.01 else "✗"
-            print(f"{balance.user_id:<10} ₦{balance.activity_balance:<14,.2f} ₦{balance.affiliate_balance:<14,.2f} ₦{balance.total_balance:<14,.2f} {status:<10}")
-        
+
+        def progress(chunk, rows, fixed):
+            for row in rows[:5]:
+                print(f"❌ User ID {row['user_id']}: total {format_naira(row['total_balance'] or 0)}, expected {format_naira(row['expected_total'])}")
+            if len(rows) > 5:
+                print(f"   ... and {len(rows) - 5} more in chunk {chunk}")
+            if not dry_run:
+                print(f"   → Fixed {fixed} balance(s)")
+
+        report = reconcile(engine, dry_run=dry_run, chunk_size=chunk_size, on_chunk=progress)
+
+        if report["mismatched"] == 0:
+            print("✅ All balances are correct")
+        elif not dry_run:
+            print(f"\n✅ Fixed {report['fixed']} balance(s)")
+
+        print_summary(report)
+
+        if report_path:
+            write_report(report, report_path)
+        return report
+
     except Exception as e:
-        db.rollback()
         print(f"\n❌ Error: {e}")
         import traceback
         traceback.print_exc()
-    finally:
-        db.close()
 
 if __name__ == "__main__":
-    fix_total_balances()
+    parser = argparse.ArgumentParser(description="Verify and fix total balances")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--dry-run', action='store_true', help="Report mismatches without fixing them")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--report', default=None, help="Write a JSON report to this path ('-' for stdout)")
+    args = parser.parse_args()
+    fix_total_balances(get_engine(args.database_url), dry_run=args.dry_run,
+                       chunk_size=args.chunk_size, report_path=args.report)
@@ -0,0 +1,335 @@
+"""
+Withdrawal processing queue
+
+Pending withdrawals are approved one at a time from admin-withdrawals.html.
+For payouts run by workers (a cron job, or several processes draining the
+queue at month end) each worker claims a batch of the oldest PENDING rows.
+
+Paying out is a call to an external system, so it must never happen inside
+a transaction that can still roll back: a rollback would put the rows back
+in the queue and pay them again. Processing is therefore split up:
+
+  1. Claim (one short transaction): lock the oldest unclaimed PENDING rows
+
+         SELECT ... FROM withdrawals WHERE status = 'PENDING' AND <no payout row>
+         ORDER BY created_at, id LIMIT :batch FOR UPDATE SKIP LOCKED
+
+     and record a PROCESSING row in withdrawal_payouts for each, carrying
+     its idempotency key (WD-<id>). Commit.
+  2. Pay: call handler(withdrawal) for each claimed row, outside any
+     transaction. The handler passes withdrawal["idempotency_key"] to the
+     payment provider, so a repeated call cannot pay twice.
+  3. Settle (one short transaction per row): set the withdrawal's status
+     and mark its payout SETTLED.
+
+A worker that dies between 1 and 3 leaves PROCESSING payouts behind.
+recover() (run at the start of every drain) re-claims those older than
+STALE_SECONDS and calls the handler again with the same idempotency key. A
+handler that raises leaves its row PROCESSING for the same retry.
+
+The claim state lives in withdrawal_payouts rather than in
+withdrawals.status: that column holds the backend's enum (VARCHAR(8) on
+existing databases), and the app reads it back through the ORM.
+
+On PostgreSQL, SKIP LOCKED makes concurrent workers take disjoint batches
+without waiting on each other, and the payout row's primary key (inserted
+with ON CONFLICT DO NOTHING) settles any race between two claims of one row.
+On SQLite the clause is dropped (db_backend.py): the writer transaction is
+BEGIN IMMEDIATE, so workers simply take turns.
+
+The payout itself is a callable handler(withdrawal) returning
+("APPROVED" | "REJECTED", note) - the code that actually sends the money.
+There is no default: this module only claims and records. The amount was
+debited when the user requested the withdrawal, so a rejection must refund
+it. Without --handler, --process is a dry run that lists what would be
+claimed.
+
+--benchmark settles the queue with a no-op handler and restores it. Its
+"settled twice" count only exercises SKIP LOCKED on PostgreSQL; on SQLite the
+single writer serialises the workers, so 0 there says nothing about the
+locking.
+
+Usage:
+    python withdrawal_queue.py --status
+    python withdrawal_queue.py --process --limit 20                          # dry run
+    python withdrawal_queue.py --process --batch 100 --handler payouts:send_withdrawal
+    python withdrawal_queue.py --benchmark --workers 8 --database-url postgresql://.../perf   # use a copy
+"""
+import argparse
+import importlib
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, text
+
+from database import format_timestamp, get_engine
+from db_backend import backend_for
+from money import format_naira, from_stored, money_scale
+
+DEFAULT_BATCH = 50
+STALE_SECONDS = 15 * 60  # a PROCESSING payout older than this is retried
+
+CREATE_PAYOUTS_SQL = """
+    CREATE TABLE IF NOT EXISTS withdrawal_payouts (
+        withdrawal_id INTEGER PRIMARY KEY,
+        idempotency_key VARCHAR(64) NOT NULL,
+        state VARCHAR(10) NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 1,
+        claimed_at TIMESTAMP NOT NULL,
+        settled_at TIMESTAMP
+    )
+"""
+
+PAYOUT_COLUMNS = ["withdrawal_id", "idempotency_key", "state", "attempts", "claimed_at"]
+
+CLAIM_SQL = """
+    SELECT id, user_id, amount, balance_type, created_at
+    FROM withdrawals w
+    WHERE status = 'PENDING'
+      AND NOT EXISTS (SELECT 1 FROM withdrawal_payouts p WHERE p.withdrawal_id = w.id)
+    ORDER BY created_at, id
+    LIMIT :batch{lock}
+"""
+
+STALE_SQL = """
+    SELECT withdrawal_id FROM withdrawal_payouts
+    WHERE state = 'PROCESSING' AND claimed_at < :cutoff
+    ORDER BY claimed_at
+    LIMIT :batch{lock}
+"""
+
+RECLAIM_SQL = text("""
+    UPDATE withdrawal_payouts SET claimed_at = :now, attempts = attempts + 1
+    WHERE withdrawal_id = :id AND state = 'PROCESSING' AND claimed_at < :cutoff
+""")
+
+CLAIMED_ROWS_SQL = text("""
+    SELECT w.id, w.user_id, w.amount, w.balance_type, w.created_at, p.idempotency_key
+    FROM withdrawals w JOIN withdrawal_payouts p ON p.withdrawal_id = w.id
+    WHERE w.id IN :ids
+    ORDER BY w.created_at, w.id
+""").bindparams(bindparam("ids", expanding=True))
+
+SETTLE_SQL = text("""
+    UPDATE withdrawals SET status = :status, admin_note = :note, processed_at = :now
+    WHERE id = :id AND status = 'PENDING'
+""")
+
+SETTLE_PAYOUT_SQL = text("""
+    UPDATE withdrawal_payouts SET state = 'SETTLED', settled_at = :now
+    WHERE withdrawal_id = :id AND state = 'PROCESSING'
+""")
+
+
+def load_handler(spec):
+    """'module:function' -> the payout handler"""
+    module, _, name = spec.partition(":")
+    if not name:
+        raise ValueError(f"Handler must be module:function, got {spec!r}")
+    return getattr(importlib.import_module(module), name)
+
+
+def idempotency_key(withdrawal_id):
+    return f"WD-{withdrawal_id}"
+
+
+def ensure_table(conn):
+    conn.execute(text(CREATE_PAYOUTS_SQL))
+
+
+def _now():
+    return format_timestamp(datetime.utcnow())
+
+
+def _claimed_rows(conn, ids):
+    if not ids:
+        return []
+    return [dict(row) for row in conn.execute(CLAIMED_ROWS_SQL, {"ids": ids}).mappings()]
+
+
+def claim(conn, batch=DEFAULT_BATCH):
+    """Mark up to `batch` of the oldest unclaimed pending withdrawals PROCESSING and return them
+
+    Runs in the caller's transaction, which must commit before any payout.
+    """
+    backend = backend_for(conn)
+    rows = conn.execute(text(CLAIM_SQL.format(lock=backend.skip_locked())), {"batch": batch}).mappings().all()
+    insert = text(backend.upsert_sql("withdrawal_payouts", PAYOUT_COLUMNS, ["withdrawal_id"], update=()))
+    now = _now()
+    claimed = []
+    for row in rows:
+        # A concurrent claim that got there first wins the primary key
+        if conn.execute(insert, {"withdrawal_id": row["id"], "idempotency_key": idempotency_key(row["id"]),
+                                 "state": "PROCESSING", "attempts": 1, "claimed_at": now}).rowcount:
+            claimed.append(row["id"])
+    return _claimed_rows(conn, claimed)
+
+
+def claim_stale(conn, batch=DEFAULT_BATCH, stale_seconds=STALE_SECONDS):
+    """Re-claim PROCESSING payouts abandoned by a worker; same idempotency keys"""
+    now = datetime.utcnow()
+    params = {"cutoff": format_timestamp(now - timedelta(seconds=stale_seconds)), "now": format_timestamp(now)}
+    sql = STALE_SQL.format(lock=backend_for(conn).skip_locked())
+    ids = [row[0] for row in conn.execute(text(sql), {"batch": batch, **params})]
+    reclaimed = [i for i in ids if conn.execute(RECLAIM_SQL, {"id": i, **params}).rowcount]
+    return _claimed_rows(conn, reclaimed)
+
+
+def preview(conn, limit=DEFAULT_BATCH):
+    """The withdrawals the next claims would take, without locking them"""
+    ensure_table(conn)
+    return [dict(row) for row in conn.execute(text(CLAIM_SQL.format(lock="")), {"batch": limit}).mappings()]
+
+
+def settle(engine, withdrawal_id, status, note):
+    """Record one payout result in its own transaction; False if it was already settled"""
+    with engine.begin() as conn:
+        now = _now()
+        conn.execute(SETTLE_SQL, {"status": status, "note": note, "now": now, "id": withdrawal_id})
+        return bool(conn.execute(SETTLE_PAYOUT_SQL, {"now": now, "id": withdrawal_id}).rowcount)
+
+
+def pay_and_settle(engine, handler, withdrawals):
+    """Call the handler for each claimed withdrawal (no transaction open) and settle it; returns [(id, status)]"""
+    settled = []
+    for withdrawal in withdrawals:
+        try:
+            status, note = handler(withdrawal)
+        except Exception as e:
+            # Outcome unknown: stays PROCESSING and is retried by recover() with the same key
+            print(f"⚠️  Withdrawal #{withdrawal['id']} ({withdrawal['idempotency_key']}): {e}")
+            continue
+        if settle(engine, withdrawal["id"], status, note):
+            settled.append((withdrawal["id"], status))
+    return settled
+
+
+def claim_batch(engine, batch=DEFAULT_BATCH):
+    """Claim one batch in its own, committed transaction"""
+    with engine.begin() as conn:
+        ensure_table(conn)
+        return claim(conn, batch)
+
+
+def process_batch(engine, handler, batch=DEFAULT_BATCH):
+    """Claim one batch (committed), then pay and settle it row by row; returns [(id, status)]"""
+    return pay_and_settle(engine, handler, claim_batch(engine, batch))
+
+
+def recover(engine, handler, batch=DEFAULT_BATCH, stale_seconds=STALE_SECONDS):
+    """Retry payouts left PROCESSING for longer than stale_seconds; returns [(id, status)]"""
+    settled = []
+    while True:
+        with engine.begin() as conn:
+            ensure_table(conn)
+            claimed = claim_stale(conn, batch, stale_seconds)
+        if not claimed:
+            return settled
+        settled.extend(pay_and_settle(engine, handler, claimed))
+
+
+def drain(engine, handler, batch=DEFAULT_BATCH, limit=None, stale_seconds=STALE_SECONDS):
+    """Recover stale payouts, then process batches until the queue is empty (or `limit` rows are claimed)"""
+    settled = recover(engine, handler, batch, stale_seconds)
+    claimed = len(settled)
+    while limit is None or claimed < limit:
+        withdrawals = claim_batch(engine, batch if limit is None else min(batch, limit - claimed))
+        if not withdrawals:
+            break
+        claimed += len(withdrawals)
+        settled.extend(pay_and_settle(engine, handler, withdrawals))
+    return settled
+
+
+def queue_status(conn):
+    """Pending count, total amount (kobo), oldest request and payouts in flight"""
+    ensure_table(conn)
+    row = conn.execute(text(
+        "SELECT COUNT(*), COALESCE(SUM(amount), 0), MIN(created_at) FROM withdrawals WHERE status = 'PENDING'")).one()
+    processing = conn.execute(text("SELECT COUNT(*) FROM withdrawal_payouts WHERE state = 'PROCESSING'")).scalar()
+    return {"pending": row[0], "amount": from_stored(row[1], money_scale(conn, "withdrawals", "amount")),
+            "oldest": row[2], "processing": processing}
+
+
+def run_benchmark(engine, workers, batch):
+    """Drain the queue with concurrent workers, check nothing was settled twice, then restore it"""
+    with engine.connect() as conn:
+        before = [dict(r) for r in conn.execute(text(
+            "SELECT id, admin_note, processed_at FROM withdrawals WHERE status = 'PENDING'")).mappings()]
+    results = []
+    lock = threading.Lock()
+
+    def settle_without_payout(withdrawal):
+        return "APPROVED", "withdrawal_queue benchmark"
+
+    def worker():
+        done = drain(engine, settle_without_payout, batch=batch)
+        with lock:
+            results.extend(done)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    ids = [withdrawal_id for withdrawal_id, _ in results]
+    with engine.begin() as conn:
+        if before:
+            conn.execute(text(
+                "UPDATE withdrawals SET status = 'PENDING', admin_note = :admin_note, processed_at = :processed_at "
+                "WHERE id = :id"), before)
+            conn.execute(text("DELETE FROM withdrawal_payouts WHERE withdrawal_id = :id"), before)
+    return {"pending": len(before), "settled": len(ids), "duplicates": len(ids) - len(set(ids)),
+            "seconds": elapsed, "backend": engine.dialect.name}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process pending withdrawals in locked batches")
+    parser.add_argument('--database-url', default=None, help="Database URL (default: $DATABASE_URL or backend/affluence.db)")
+    parser.add_argument('--status', action='store_true', help="Show the pending queue")
+    parser.add_argument('--process', action='store_true', help="Settle pending withdrawals, oldest first (dry run without --handler)")
+    parser.add_argument('--handler', default=None, metavar='MODULE:FUNCTION', help="Payout handler for --process")
+    parser.add_argument('--limit', type=int, default=None, help="Stop after this many withdrawals")
+    parser.add_argument('--batch', type=int, default=DEFAULT_BATCH, help="Withdrawals claimed per transaction")
+    parser.add_argument('--benchmark', action='store_true', help="Drain with concurrent workers and restore the queue")
+    parser.add_argument('--workers', type=int, default=8, help="Concurrent workers for --benchmark")
+    args = parser.parse_args(argv)
+
+    engine = get_engine(args.database_url)
+    try:
+        if args.benchmark:
+            r = run_benchmark(engine, args.workers, args.batch)
+            print(f"✅ {args.workers} workers settled {r['settled']:,} of {r['pending']:,} pending "
+                  f"withdrawals in {r['seconds']:.2f}s; settled twice: {r['duplicates']} (queue restored)")
+            if r["backend"] != "postgresql":
+                print(f"⚠️  {r['backend']} serialises writers, so this does not exercise SKIP LOCKED - run it on PostgreSQL")
+        elif args.process and not args.handler:
+            with engine.connect() as conn:
+                rows = preview(conn, args.limit or args.batch)
+                scale = money_scale(conn, "withdrawals", "amount")
+            for w in rows:
+                print(f"   #{w['id']} user {w['user_id']}: {format_naira(from_stored(w['amount'], scale))} {w['balance_type']} ({w['created_at']})")
+            print(f"📦 Dry run: {len(rows):,} withdrawal(s) would be claimed; pass --handler MODULE:FUNCTION to pay them")
+        elif args.process:
+            settled = drain(engine, load_handler(args.handler), batch=args.batch, limit=args.limit)
+            print(f"✅ Processed {len(settled):,} withdrawal(s)")
+        else:
+            with engine.connect() as conn:
+                s = queue_status(conn)
+            print(f"📦 {s['pending']:,} pending withdrawal(s), {format_naira(s['amount'])}, oldest {s['oldest']}"
+                  f"; {s['processing']:,} payout(s) in flight")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())